@@ -1,3 +1,5 @@
+import numpy as np
+
 import Node
 
 '''
@@ -19,3 +21,11 @@ class BadMouther(Node.Node):
         if proxy.is_malicious():  # say that other malicious nodes are good
             return 1
         return -1
+
+
+def take_notes(proxy_malicious):
+    '''
+    Give bad mouthed notes on many transactions at once, with the same rules as
+    BadMouther.take_note.
+    '''
+    return np.where(proxy_malicious, np.int8(1), np.int8(-1))
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+
+import numpy as np
+import joblib
+
+import TrustManager
+
+'''
+Benchmark each phase of the trust model at increasing numbers of nodes and epochs,
+and compare the results against a stored baseline to find regressions.
+'''
+
+PHASES = (
+    "network", "bootstrap", "save_reports", "save_reports_csv", "read_data", "train",
+    "find_best_servers", "get_all_recommendations", "simulate_transactions"
+)
+
+
+def measure(func, repeats=3, warmup=1):
+    '''
+    Time a function over a number of repetitions after warming up, then find its peak
+    traced memory use in a separate run, so that tracing does not skew the timings.
+    '''
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "mean": float(np.mean(times)),
+        "min": float(np.min(times)),
+        "max": float(np.max(times)),
+        "stdev": float(np.std(times)),
+        "repeats": repeats,
+        "peak_memory": peak_memory
+    }
+
+
+def fit_fixed_svms():
+    '''
+    Fit the SVMs with fixed parameters, to give a predictor without evolving one.
+    '''
+    train_data, train_notes, _ = TrustManager.read_data("data/reports-train.bin")
+    joblib.dump({
+        reporter_id: TrustManager.SVM.create_and_fit_svm(train_data[reporter_id], train_notes[reporter_id], 10, 0.5)
+        for reporter_id in train_data
+    }, "data/SVMs.pkl")
+
+
+def benchmark_config(no_of_nodes, epochs, phases, use_svm=True, repeats=3, warmup=1, transactions=10_000, seed=0):
+    '''
+    Benchmark the phases for a network of no_of_nodes bootstrapped for epochs, within a
+    temporary work directory, seeded so that each run benchmarks the same network. The
+    trust matrix cache is kept in memory only and cleared before each run of the
+    prediction phases, so that the predictor itself is measured.
+    '''
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(io.StringIO()):
+        os.chdir(work_dir)
+        try:
+            os.makedirs("data")
+            np.random.seed(seed)
+
+            def create_network():
+                return TrustManager.TrustManager(
+                    no_of_nodes=no_of_nodes, use_svm=use_svm, train_filename="data/reports-train.bin",
+                    test_filename="data/reports-test.bin", cache_dir=None
+                )
+
+            trust_manager = create_network()
+            trust_manager.bootstrap(epochs, verbose=False)
+            if "train" not in phases and any(phase in phases for phase in PHASES[PHASES.index("train") + 1:]):
+                if use_svm:
+                    fit_fixed_svms()
+                else:
+                    TrustManager.ANN.create_ann().save("data/ANN.h5")
+
+            def uncached(func):
+                def run():
+                    trust_manager.get_trust_cache().clear()
+                    return func()
+                return run
+
+            phase_funcs = {
+                "network": create_network,
+                "bootstrap": lambda: trust_manager.bootstrap(epochs, filewrite=False, verbose=False),
+                "save_reports": lambda: trust_manager.save_reports("data/bench-reports.bin"),
+                "save_reports_csv": lambda: trust_manager.save_reports_csv("data/bench-reports.csv"),
+                "read_data": lambda: TrustManager.read_data("data/reports-train.bin"),
+                "train": lambda: trust_manager.train(False, workers=1, seed=0),
+                "find_best_servers": uncached(lambda: trust_manager.find_best_servers(1, 3, 5)),
+                "get_all_recommendations": uncached(lambda: trust_manager.get_all_recommendations(3, 5)),
+                "simulate_transactions": uncached(lambda: trust_manager.simulate_transactions(transactions))
+            }
+            for phase in PHASES:
+                if phase in phases:
+                    phase_repeats, phase_warmup = (1, 0) if phase == "train" else (repeats, warmup)
+                    result = measure(phase_funcs[phase], phase_repeats, phase_warmup)
+                    results.append(dict(result, phase=phase, no_of_nodes=no_of_nodes, epochs=epochs))
+                    for filename in ["data/bench-reports.bin", "data/bench-reports.csv"]:
+                        if os.path.exists(filename):
+                            os.remove(filename)
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def run_benchmarks(node_counts, epoch_counts, phases=PHASES, use_svm=True, repeats=3, warmup=1,
+                   transactions=10_000, seed=0, verbose=True):
+    '''
+    Benchmark the phases at each combination of the node and epoch counts.
+    '''
+    results = []
+    configs = [(no_of_nodes, epochs) for no_of_nodes in node_counts for epochs in epoch_counts]
+    for no_of_nodes, epochs in configs:
+        if verbose:
+            print(f"Benchmarking {no_of_nodes} nodes for {epochs} epochs...")
+        results.extend(benchmark_config(
+            no_of_nodes, epochs, phases, use_svm, repeats, warmup, transactions, seed
+        ))
+
+    return {
+        "meta": {
+            "predictor": "SVM" if use_svm else "ANN",
+            "seed": seed,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "results": results
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    '''
+    Compare benchmark results against a baseline, giving a list of the entries that are
+    slower than the baseline by more than the threshold fraction.
+    '''
+    baseline_means = {
+        (entry["phase"], entry["no_of_nodes"], entry["epochs"]): entry["mean"] for entry in baseline["results"]
+    }
+    regressions = []
+    for entry in results["results"]:
+        key = (entry["phase"], entry["no_of_nodes"], entry["epochs"])
+        if key in baseline_means and entry["mean"] > baseline_means[key] * (1 + threshold):
+            regressions.append(dict(
+                entry, baseline_mean=baseline_means[key], slowdown=entry["mean"] / baseline_means[key]
+            ))
+
+    return regressions
+
+
+def format_results(results):
+    '''
+    Format benchmark results as a plain text table.
+    '''
+    lines = [f"{'phase':>24} {'nodes':>6} {'epochs':>6} {'mean (s)':>12} {'stdev (s)':>12} {'peak (MiB)':>11}"]
+    for entry in results["results"]:
+        lines.append(
+            f"{entry['phase']:>24} {entry['no_of_nodes']:>6} {entry['epochs']:>6} {entry['mean']:>12.6f} "
+            f"{entry['stdev']:>12.6f} {entry['peak_memory'] / 2**20:>11.2f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description="Benchmark each phase of the trust model.")
+    PARSER.add_argument("-n", "--nodes", dest="node_counts", type=int, nargs="+", default=[10, 50, 100],
+                        help="The numbers of nodes to benchmark at. [default 10 50 100]")
+    PARSER.add_argument("-e", "--epochs", dest="epoch_counts", type=int, nargs="+", default=[5, 20],
+                        help="The numbers of epochs to bootstrap for. [default 5 20]")
+    PARSER.add_argument("-p", "--phases", dest="phases", nargs="+", choices=PHASES,
+                        default=[phase for phase in PHASES if phase != "train"],
+                        help="The phases to benchmark. [default all but train]")
+    PARSER.add_argument("-a", "--ann", dest="use_ann", action="store_const", const=True, default=False,
+                        help="Benchmark with an ann as the predictor instead of svms.")
+    PARSER.add_argument("-r", "--repeats", dest="repeats", type=int, default=3,
+                        help="The number of timed repetitions of each phase. [default 3]")
+    PARSER.add_argument("-wu", "--warmup", dest="warmup", type=int, default=1,
+                        help="The number of untimed warmup runs of each phase. [default 1]")
+    PARSER.add_argument("-si", "--simulate", dest="transactions", type=int, default=10_000,
+                        help="The number of transactions to simulate. [default 10000]")
+    PARSER.add_argument("--seed", dest="seed", type=int, default=0,
+                        help="The random seed to create each network with. [default 0]")
+    PARSER.add_argument("-o", "--output", dest="output", default="benchmark.json",
+                        help="The file to write the results to. [default benchmark.json]")
+    PARSER.add_argument("-c", "--compare", dest="baseline", default=None,
+                        help="A baseline results file to compare against.")
+    PARSER.add_argument("-th", "--threshold", dest="threshold", type=float, default=0.1,
+                        help="The fraction slower than the baseline that counts as a regression. [default 0.1]")
+    ARGS = PARSER.parse_args()
+
+    RESULTS = run_benchmarks(
+        ARGS.node_counts, ARGS.epoch_counts, ARGS.phases, not ARGS.use_ann, ARGS.repeats, ARGS.warmup,
+        ARGS.transactions, ARGS.seed
+    )
+    with open(ARGS.output, "w") as OUTPUT_FILE:
+        json.dump(RESULTS, OUTPUT_FILE, indent=2)
+    print(format_results(RESULTS))
+    print(f"Results written to {ARGS.output}")
+
+    if ARGS.baseline:
+        with open(ARGS.baseline) as BASELINE_FILE:
+            REGRESSIONS = compare(RESULTS, json.load(BASELINE_FILE), ARGS.threshold)
+        if REGRESSIONS:
+            print(f"\n{len(REGRESSIONS)} regressions against {ARGS.baseline}:")
+            for REGRESSION in REGRESSIONS:
+                print(
+                    f"{REGRESSION['phase']} at {REGRESSION['no_of_nodes']} nodes and {REGRESSION['epochs']} epochs: "
+                    f"{REGRESSION['mean']:.6f}s against {REGRESSION['baseline_mean']:.6f}s "
+                    f"({REGRESSION['slowdown']:.2f}x)"
+                )
+            sys.exit(1)
+        print(f"\nNo regressions against {ARGS.baseline}.")
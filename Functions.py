@@ -38,15 +38,17 @@ def wrong_note(note):
     return list(wrong_notes)[int(np.round(np.random.rand()))]
 
 
-def get_conditioned_ids(no_of_nodes, condition_factor):
+def get_conditioned_ids(no_of_nodes, condition_factor, rng=None):
     '''
-    Give an id list of random nodes that fit a given condition.
+    Give an id list of random nodes that fit a given condition, drawn from the random
+    generator rng if one is given.
     '''
     conditioned_list = []
     ids = [i for i in range(no_of_nodes)]
+    randint = np.random.randint if rng is None else rng.integers
 
     for _ in range(int(no_of_nodes * condition_factor)):
-        conditioned_list.append(ids.pop(np.random.randint(len(ids))))
+        conditioned_list.append(ids.pop(randint(len(ids))))
 
     return conditioned_list
 
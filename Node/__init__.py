@@ -53,3 +53,16 @@ class Node:
             note = -1
 
         return note
+
+
+def take_notes(proxy_services, proxy_capabilities, proxy_malicious, service_targets, capability_targets):
+    '''
+    Take notes on many transactions at once, the arguments are broadcast together
+    and rated with the same rules as Node.take_note.
+    '''
+    meets_service = np.asarray(proxy_services >= service_targets, dtype=np.int8)
+    meets_capability = np.asarray(proxy_capabilities >= capability_targets, dtype=np.int8)
+    # 1 when both are met, 0 when only one is, and -1 when neither is
+    notes = meets_service + meets_capability - 1
+
+    return np.where(proxy_malicious, np.int8(-1), notes)
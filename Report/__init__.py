@@ -1,12 +1,25 @@
+import numpy as np
+
 '''
 Class for reports, which state the context of a service and rates it.
 '''
 
+REPORT_COLUMNS = (
+    ("epoch", np.int32),
+    ("reporter", np.int32),
+    ("target", np.int32),
+    ("service", np.int8),
+    ("capability", np.int8),
+    ("note", np.int8),
+)
+
 
 class Report:
     '''
     Report that states the context and how well the node performed at that.
     '''
+    __slots__ = ("__service", "__capability", "__note", "__time")
+
     def __init__(self, service=0, capability=0, note=0, time=0):
         self.__service = service
         self.__capability = capability
@@ -29,4 +42,131 @@ class Report:
         '''
         Output contained data in a format suitable for a csv
         '''
-        return f"{self.__service},{self.__capability},{self.__note}"
+        return f"{self.__service},{self.__capability},{self.__note},{self.__time}"
+
+
+class ReportStore:
+    '''
+    Columnar store of reports, each field is held in a contiguous typed array.
+    Reports are appended an epoch at a time, in order of time.
+    '''
+    def __init__(self, capacity=1024):
+        self.__size = 0
+        self.__columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in REPORT_COLUMNS}
+
+    def __len__(self):
+        return self.__size
+
+    def __getstate__(self):
+        return {"size": self.__size, "columns": self.get_columns()}
+
+    def __setstate__(self, state):
+        self.__size = state["size"]
+        self.__columns = {name: np.array(column) for name, column in state["columns"].items()}
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''
+        Create a store that adopts the given columns without copying them, such as
+        memory-mapped arrays. Read-only columns are copied once more reports are appended.
+        '''
+        store = cls(capacity=0)
+        store.__columns = {name: columns[name] for name, _ in REPORT_COLUMNS}
+        store.__size = len(store.__columns["epoch"])
+        return store
+
+    def get_capacity(self):
+        return len(self.__columns["epoch"])
+
+    def get_epochs(self):
+        '''
+        Get the distinct epochs held in the store.
+        '''
+        return np.unique(self.get_column("epoch"))
+
+    def get_latest_epoch(self):
+        return int(self.__columns["epoch"][self.__size - 1]) if self.__size else None
+
+    def get_column(self, name):
+        '''
+        Get a zero-copy view of a column.
+        '''
+        return self.__columns[name][:self.__size]
+
+    def get_columns(self):
+        '''
+        Get zero-copy views of all of the columns.
+        '''
+        return {name: self.get_column(name) for name, _ in REPORT_COLUMNS}
+
+    def append_epoch(self, epoch, reporters, targets, services, capabilities, notes):
+        '''
+        Append an epoch's worth of reports to the store.
+        '''
+        latest_epoch = self.get_latest_epoch()
+        if latest_epoch is not None and epoch < latest_epoch:
+            raise ValueError(f"Epoch {epoch} is older than the latest stored epoch {latest_epoch}")
+        no_of_reports = len(reporters)
+        self.__reserve(self.__size + no_of_reports)
+        start, stop = self.__size, self.__size + no_of_reports
+        self.__columns["epoch"][start:stop] = epoch
+        self.__columns["reporter"][start:stop] = reporters
+        self.__columns["target"][start:stop] = targets
+        self.__columns["service"][start:stop] = services
+        self.__columns["capability"][start:stop] = capabilities
+        self.__columns["note"][start:stop] = notes
+        self.__size = stop
+
+    def __reserve(self, size):
+        '''
+        Make sure that the columns can hold at least size reports, and can be written to.
+        '''
+        capacity = self.get_capacity()
+        if size <= capacity and self.__columns["epoch"].flags.writeable:
+            return
+        capacity = max(size, 2 * capacity)
+        for name, column in self.__columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.__size] = column[:self.__size]
+            self.__columns[name] = grown
+
+    def clear(self):
+        self.__size = 0
+
+    def by_time(self, start_epoch, end_epoch):
+        '''
+        Get zero-copy views of the reports made from start_epoch up to and including end_epoch.
+        '''
+        epochs = self.get_column("epoch")
+        start = np.searchsorted(epochs, start_epoch, side="left")
+        stop = np.searchsorted(epochs, end_epoch, side="right")
+        return {name: column[start:stop] for name, column in self.get_columns().items()}
+
+    def by_reporter(self, reporter_id):
+        '''
+        Get the reports made by a node.
+        '''
+        return self.__select(self.get_column("reporter") == reporter_id)
+
+    def by_target(self, target_id):
+        '''
+        Get the reports made on a node.
+        '''
+        return self.__select(self.get_column("target") == target_id)
+
+    def __select(self, mask):
+        return {name: column[mask] for name, column in self.get_columns().items()}
+
+    def get_report(self, index):
+        '''
+        Get a single stored report as a Report.
+        '''
+        if not -self.__size <= index < self.__size:
+            raise IndexError("report index out of range")
+        index %= self.__size
+        return Report(
+            int(self.__columns["service"][index]),
+            int(self.__columns["capability"][index]),
+            int(self.__columns["note"][index]),
+            int(self.__columns["epoch"][index])
+        )
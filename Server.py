@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import json
+import asyncio
+import argparse
+import collections
+import concurrent.futures
+
+import numpy as np
+
+import TrustManager
+
+'''
+Serve trust queries from a resident trust manager and predictor over a local socket.
+Requests and responses are JSON lines, and the queries that arrive within a short
+window are coalesced into one predictor call per context.
+'''
+
+DEFAULT_WINDOW = 0.002
+DEFAULT_MAX_BATCH = 1024
+
+
+class RequestBatcher:
+    '''
+    Batch the trust row queries that arrive within a window of each other, the batches
+    are predicted on a single worker thread so the event loop keeps taking requests.
+    '''
+    def __init__(self, trust_manager, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.__trust_manager = trust_manager
+        self.__window = window
+        self.__max_batch = max_batch
+        self.__pending = []
+        self.__flush_handle = None
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+
+    async def trust_row(self, client_id, service_target, capability_target):
+        '''
+        Get the notes that the client is predicted to give each node at the target service
+        and capability.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__pending.append((client_id, service_target, capability_target, future))
+        if len(self.__pending) >= self.__max_batch:
+            self.__flush()
+        elif self.__flush_handle is None:
+            self.__flush_handle = loop.call_later(self.__window, self.__flush)
+        return await future
+
+    def __flush(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        pending, self.__pending = self.__pending, []
+        if pending:
+            asyncio.ensure_future(self.__run_batch(pending))
+
+    async def __run_batch(self, pending):
+        loop = asyncio.get_running_loop()
+        queries = np.array([query[:3] for query in pending], dtype=np.int64)
+        try:
+            rows = await loop.run_in_executor(self.__executor, self.__predict, queries)
+        except Exception as error:
+            for *_, future in pending:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (*_, future), row in zip(pending, rows):
+            if not future.done():
+                future.set_result(row)
+
+    def __predict(self, queries):
+        '''
+        Predict the trust rows for a batch of (client, service, capability) queries, with
+        one trust matrix lookup for each distinct context.
+        '''
+        stats = self.__trust_manager.get_stats()
+        rows = [None for _ in queries]
+        with stats.timer("server.batch"):
+            contexts = collections.defaultdict(list)
+            for index, (_, service_target, capability_target) in enumerate(queries):
+                contexts[(int(service_target), int(capability_target))].append(index)
+            for (service_target, capability_target), indices in contexts.items():
+                trust_rows = self.__trust_manager.get_trust_matrix(
+                    service_target, capability_target, queries[indices, 0]
+                )
+                for index, trust_row in zip(indices, trust_rows):
+                    rows[index] = trust_row
+        stats.count("server.queries", len(queries))
+        stats.count("server.contexts", len(contexts))
+        return rows
+
+
+async def handle_request(request, trust_manager, batcher):
+    '''
+    Answer a request, which is find_best_servers or trusted_list for a client, service and
+    capability, or stats.
+    '''
+    method = request.get("method", "find_best_servers")
+    if method == "stats":
+        return trust_manager.stats()
+    if method not in ("find_best_servers", "trusted_list"):
+        raise ValueError(f"Unknown method {method}")
+    client_id = int(request["client"])
+    if not 0 <= client_id < trust_manager.get_no_of_nodes():
+        raise ValueError(f"Client {client_id} is not in the network")
+    trust_row = await batcher.trust_row(client_id, int(request["service"]), int(request["capability"]))
+    if method == "trusted_list":
+        return trust_row.tolist()
+    return TrustManager.to_trusted_list(trust_row)
+
+
+async def handle_connection(reader, writer, trust_manager, batcher):
+    '''
+    Answer the JSON line requests of a connection concurrently, each response carries the
+    id of its request as they may be sent out of order.
+    '''
+    async def respond(line):
+        request = {}
+        try:
+            request = json.loads(line)
+            response = {"result": await handle_request(request, trust_manager, batcher)}
+        except Exception as error:
+            response = {"error": f"{type(error).__name__}: {error}"}
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    tasks = set()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        writer.close()
+
+
+async def start_server(trust_manager, host="127.0.0.1", port=8765, unix_path=None, window=DEFAULT_WINDOW,
+                       max_batch=DEFAULT_MAX_BATCH):
+    '''
+    Load the predictor and start serving on a TCP port, or a unix socket if a path is
+    given. Returns the asyncio server and the request batcher.
+    '''
+    trust_manager.load_predictor()
+    batcher = RequestBatcher(trust_manager, window, max_batch)
+
+    def on_connection(reader, writer):
+        return handle_connection(reader, writer, trust_manager, batcher)
+
+    if unix_path:
+        server = await asyncio.start_unix_server(on_connection, path=unix_path)
+    else:
+        server = await asyncio.start_server(on_connection, host=host, port=port)
+    return server, batcher
+
+
+async def serve(trust_manager, host="127.0.0.1", port=8765, unix_path=None, window=DEFAULT_WINDOW,
+                max_batch=DEFAULT_MAX_BATCH):
+    '''
+    Serve trust queries until cancelled.
+    '''
+    server, batcher = await start_server(trust_manager, host, port, unix_path, window, max_batch)
+    addresses = unix_path or ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Serving trust queries on {addresses}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher.close()
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description="Serve trust queries from a resident trust manager.")
+    PARSER.add_argument("-s", "--svm", dest="use_svm", action="store_const", const=True, default=False,
+                        help="Use a svm as the predictor")
+    PARSER.add_argument("-a", "--ann", dest="use_ann", action="store_const", const=True, default=False,
+                        help="Use an ann as the predictor [default predictor]")
+    PARSER.add_argument("-np", "--numpy-ann", dest="numpy_ann", action="store_const", const=True, default=False,
+                        help="Serve the ann from its NumPy export, so TensorFlow is not needed.")
+    PARSER.add_argument("--host", dest="host", default="127.0.0.1",
+                        help="The host to listen on. [default 127.0.0.1]")
+    PARSER.add_argument("-p", "--port", dest="port", type=int, default=8765,
+                        help="The port to listen on. [default 8765]")
+    PARSER.add_argument("-u", "--unix", dest="unix_path", default=None,
+                        help="Listen on a unix socket at this path instead of a port.")
+    PARSER.add_argument("-bw", "--batch-window", dest="window", type=float, default=DEFAULT_WINDOW * 1000,
+                        help=f"The milliseconds to wait for queries to batch together. [default {DEFAULT_WINDOW * 1000}]")
+    PARSER.add_argument("-mb", "--max-batch", dest="max_batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help=f"The most queries to put in a batch. [default {DEFAULT_MAX_BATCH}]")
+    ARGS = PARSER.parse_args()
+
+    TRUST_MANAGER = TrustManager.load("data/reports-train.bin", "data/reports-test.bin", ARGS.use_svm, ARGS.numpy_ann)
+    try:
+        asyncio.run(serve(TRUST_MANAGER, ARGS.host, ARGS.port, ARGS.unix_path, ARGS.window / 1000, ARGS.max_batch))
+    except KeyboardInterrupt:
+        pass
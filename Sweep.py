@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import csv
+import time
+import argparse
+import itertools
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+import numpy as np
+
+import Functions
+import TrustManager
+
+'''
+Sweep the trust model over a grid of network parameters, running the full bootstrap,
+train and simulate pipeline for each point in its own work directory.
+'''
+
+GRID_KEYS = ("no_of_nodes", "constrained_nodes", "malicious_nodes", "malicious_reporters", "predictor", "seed")
+RESULT_KEYS = GRID_KEYS + (
+    "bad", "okay", "good", "bootstrap_time", "train_time", "simulate_time", "predict_latency", "error"
+)
+
+
+def create_grid(no_of_nodes, constrained_nodes, malicious_nodes, malicious_reporters, predictors, seeds):
+    '''
+    Create every combination of the given parameter values.
+    '''
+    return [
+        dict(zip(GRID_KEYS, values)) for values in itertools.product(
+            no_of_nodes, constrained_nodes, malicious_nodes, malicious_reporters, predictors, seeds
+        )
+    ]
+
+
+def work_dir_name(point):
+    return "n{no_of_nodes}_c{constrained_nodes}_m{malicious_nodes}_r{malicious_reporters}_{predictor}_s{seed}".format(
+        **point
+    )
+
+
+def run_point(point, work_dir, epochs, transactions):
+    '''
+    Run the bootstrap, train and simulate pipeline for a point of the grid within work_dir,
+    and return its results.
+    '''
+    cwd = os.getcwd()
+    os.makedirs(os.path.join(work_dir, "data"), exist_ok=True)
+    os.chdir(work_dir)
+    try:
+        with open("log.txt", "w") as log, contextlib.redirect_stdout(log):
+            np.random.seed(point["seed"])
+            trust_manager = TrustManager.TrustManager(
+                no_of_nodes=point["no_of_nodes"],
+                constrained_nodes=point["constrained_nodes"],
+                malicious_nodes=point["malicious_nodes"],
+                malicious_reporters=point["malicious_reporters"],
+                use_svm=point["predictor"] == "svm",
+                train_filename="data/reports-train.bin",
+                test_filename="data/reports-test.bin"
+            )
+            start = time.perf_counter()
+            trust_manager.bootstrap(epochs, verbose=False)
+            bootstrap_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            trust_manager.train(False, workers=1, seed=point["seed"])
+            train_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            bad, okay, good = trust_manager.simulate_transactions(transactions)
+            simulate_time = time.perf_counter() - start
+
+            predict_latency = trust_manager.time_predict()
+            trust_manager.save()
+    finally:
+        os.chdir(cwd)
+
+    return dict(
+        point, bad=bad, okay=okay, good=good, bootstrap_time=bootstrap_time, train_time=train_time,
+        simulate_time=simulate_time, predict_latency=predict_latency, error=""
+    )
+
+
+def sweep(grid, out_dir="sweeps", epochs=200, transactions=100_000, workers=None, verbose=True):
+    '''
+    Run every point of the grid across a pool of worker processes, each point in its own
+    work directory under out_dir, and return the results in the order of the grid. A point
+    that fails has its error recorded in place of its results.
+    '''
+    results = [None for _ in grid]
+    # Spawn fresh workers, as the predictor libraries do not survive being forked
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(
+                run_point, point, os.path.abspath(os.path.join(out_dir, work_dir_name(point))), epochs, transactions
+            ): index for index, point in enumerate(grid)
+        }
+        if verbose:
+            Functions.print_progress(0, len(grid), prefix=f"0/{len(grid)}")
+        for progress, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                results[futures[future]] = dict(grid[futures[future]], error=f"{type(error).__name__}: {error}")
+            if verbose:
+                Functions.print_progress(progress, len(grid), prefix=f"{progress}/{len(grid)}")
+    if verbose:
+        print()
+
+    return results
+
+
+def write_table(results, filename):
+    '''
+    Write the results of a sweep as a csv table.
+    '''
+    with open(filename, "w", newline="") as table_file:
+        writer = csv.DictWriter(table_file, fieldnames=RESULT_KEYS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def format_table(results):
+    '''
+    Format the results of a sweep as a plain text table.
+    '''
+    rows = [RESULT_KEYS] + [
+        tuple(
+            f"{result[key]:.4g}" if isinstance(result.get(key), float) else str(result.get(key, ""))
+            for key in RESULT_KEYS
+        )
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(RESULT_KEYS))]
+    output = io.StringIO()
+    for row in rows:
+        output.write("  ".join(value.rjust(width) for value, width in zip(row, widths)) + "\n")
+    return output.getvalue()
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description="Sweep the trust model over a grid of network parameters.")
+    PARSER.add_argument("-n", "--nodes", dest="no_of_nodes", type=int, nargs="+", default=[50],
+                        help="The numbers of nodes in the network. [default 50]")
+    PARSER.add_argument("-cn", "--constrained", dest="constrained_nodes", type=float, nargs="+", default=[0.5],
+                        help="The fractions of constrained nodes. [default 0.5]")
+    PARSER.add_argument("-m", "--malicious", dest="malicious_nodes", type=float, nargs="+", default=[0.1],
+                        help="The fractions of malicious nodes. [default 0.1]")
+    PARSER.add_argument("-r", "--malicious-reporters", dest="malicious_reporters", type=float, nargs="+",
+                        default=[0.1], help="The fractions of bad mouthing reporters. [default 0.1]")
+    PARSER.add_argument("-p", "--predictors", dest="predictors", nargs="+", choices=["svm", "ann"], default=["svm"],
+                        help="The predictors to use. [default svm]")
+    PARSER.add_argument("--seeds", dest="seeds", type=int, nargs="+", default=[0],
+                        help="The random seeds to run each point with. [default 0]")
+    PARSER.add_argument("-e", "--epochs", dest="epochs", type=int, default=200,
+                        help="The number of epochs to bootstrap for. [default 200]")
+    PARSER.add_argument("-si", "--simulate", dest="transactions", type=int, default=100_000,
+                        help="The number of transactions to simulate. [default 100000]")
+    PARSER.add_argument("-w", "--workers", dest="workers", type=int, default=None,
+                        help="The number of worker processes. [default no. of cpus]")
+    PARSER.add_argument("-o", "--out-dir", dest="out_dir", default="sweeps",
+                        help="The directory to place the work directories and results in. [default sweeps]")
+    ARGS = PARSER.parse_args()
+
+    GRID = create_grid(
+        ARGS.no_of_nodes, ARGS.constrained_nodes, ARGS.malicious_nodes, ARGS.malicious_reporters,
+        ARGS.predictors, ARGS.seeds
+    )
+    print(f"Sweeping {len(GRID)} points...")
+    RESULTS = sweep(GRID, ARGS.out_dir, ARGS.epochs, ARGS.transactions, ARGS.workers)
+    write_table(RESULTS, os.path.join(ARGS.out_dir, "results.csv"))
+    print(format_table(RESULTS))
+    print(f"Results written to {os.path.join(ARGS.out_dir, 'results.csv')}")
@@ -1,4 +1,13 @@
 #!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import asyncio
+import subprocess
+import contextlib
+import shutil
+import tempfile
 import unittest
 import numpy as np
 
@@ -6,7 +15,12 @@ import Functions
 import Report
 import Node
 import BadMouther
+import joblib
+
 import TrustManager
+import Sweep
+import Benchmark
+import Server
 
 '''
 Perform unit tests on the program.
@@ -15,6 +29,8 @@ Author: Cody Lewis
 Date: 2019-03-12
 '''
 
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
 class TestTrustModel(unittest.TestCase):
     def test_report(self):
@@ -37,9 +53,30 @@ class TestTrustModel(unittest.TestCase):
         self.assertEqual(report.get_note(), note)
         self.assertEqual(report.get_time(), time)
         self.assertEqual(
-            report.csv_output(), f"{service},{capability},{note}"
+            report.csv_output(), f"{service},{capability},{note},{time}"
         )
 
+    def test_report_store(self):
+        '''
+        Test appending to and slicing the columnar report store.
+        '''
+        store = Report.ReportStore(capacity=2)
+        for epoch in range(1, 4):
+            store.append_epoch(epoch, [0, 0, 1], [1, 2, 0], [epoch, 2, 3], [4, 5, 6], [1, 0, -1])
+        self.assertEqual(len(store), 9)
+        self.assertEqual(list(store.get_epochs()), [1, 2, 3])
+        recent = store.by_time(2, 3)
+        self.assertEqual(list(recent["service"]), [2, 2, 3, 3, 2, 3])
+        self.assertTrue(np.shares_memory(recent["note"], store.get_column("note")))
+        self.assertEqual(list(store.by_reporter(1)["note"]), [-1, -1, -1])
+        self.assertEqual(list(store.by_target(2)["epoch"]), [1, 2, 3])
+        report = store.get_report(-1)
+        self.assertEqual(
+            (report.get_service(), report.get_capability(), report.get_note(), report.get_time()), (3, 6, -1, 3)
+        )
+        with self.assertRaises(ValueError):
+            store.append_epoch(1, [0], [1], [1], [1], [1])
+
     def test_wrong_note(self):
         '''
         Test that the wrong note is assigned for each possible note.
@@ -112,6 +149,740 @@ class TestTrustModel(unittest.TestCase):
 
         trust_manager.bootstrap(no_of_transactions, False, verbose=False)
         self.assertEqual(np.shape(trust_manager.get_reports()), (50, 50))
+        for report_store in trust_manager.get_report_stores():
+            self.assertEqual(len(report_store), no_of_transactions * 50 * 49)
+
+    def test_vectorized_bootstrap(self):
+        '''
+        Test that the vectorized bootstrap gives the same notes as the nodes would.
+        '''
+        trust_manager = TrustManager.TrustManager(no_of_nodes=30, malicious_nodes=0.2, malicious_reporters=0.2)
+        network = trust_manager.get_network()
+
+        for vectorized in [True, False]:
+            trust_manager.bootstrap(2, False, verbose=False, vectorized=vectorized)
+            reports = trust_manager.get_reports()
+            for i, node_i in enumerate(network):
+                for j, node_j in enumerate(network):
+                    if i != j:
+                        report = reports[i][j]
+                        self.assertEqual(report.get_time(), 2)
+                        self.assertTrue(1 <= report.get_service() <= TrustManager.SERVICE_MAX)
+                        self.assertTrue(1 <= report.get_capability() <= TrustManager.CAP_MAX)
+                        self.assertEqual(
+                            report.get_note(),
+                            node_i.take_note(node_j, report.get_service(), report.get_capability())
+                        )
+
+    def test_saved_state(self):
+        '''
+        Test that a saved trust manager loads back with memory-mapped reports and the same
+        network, and that it may be bootstrapped and saved over again.
+        '''
+        self.use_work_dir()
+        with self.assertRaises(FileNotFoundError):
+            TrustManager.load("train.bin", "test.bin", True)
+        trust_manager = TrustManager.TrustManager(no_of_nodes=12)
+        trust_manager.bootstrap(3, filewrite=False, verbose=False)
+        trust_manager.save()
+        loaded = TrustManager.load("train.bin", "test.bin", True)
+        for report_store, loaded_store in zip(trust_manager.get_report_stores(), loaded.get_report_stores()):
+            self.assertIsInstance(loaded_store.get_column("note"), np.memmap)
+            for name, column in report_store.get_columns().items():
+                self.assertTrue(np.array_equal(column, loaded_store.get_column(name)))
+        self.assertEqual(
+            [(node.get_service(), node.get_capability(), node.is_malicious(), type(node))
+             for node in trust_manager.get_network()],
+            [(node.get_service(), node.get_capability(), node.is_malicious(), type(node))
+             for node in loaded.get_network()]
+        )
+
+        inodes = {filename: os.stat(os.path.join(TrustManager.STATE_DIR, filename)).st_ino
+                  for filename in os.listdir(TrustManager.STATE_DIR)}
+        loaded.save()
+        for filename in os.listdir(TrustManager.STATE_DIR):
+            if filename.endswith(".npy"):
+                self.assertEqual(os.stat(os.path.join(TrustManager.STATE_DIR, filename)).st_ino, inodes[filename])
+        loaded = TrustManager.load("train.bin", "test.bin", True)
+        loaded.bootstrap(2, filewrite=False, verbose=False)
+        loaded.save()
+        self.assertNotEqual(
+            os.stat(os.path.join(TrustManager.STATE_DIR, "train_reports.note.npy")).st_ino,
+            inodes["train_reports.note.npy"]
+        )
+        reloaded = TrustManager.load("train.bin", "test.bin", True)
+        self.assertEqual(len(reloaded.get_report_stores()[0]), 2 * 12 * 11)
+
+    def test_legacy_state(self):
+        '''
+        Test that the pickled trust manager from before the array state is converted to a state when loaded.
+        '''
+        self.use_work_dir()
+        os.makedirs("data")
+        shutil.copy(os.path.join(PACKAGE_DIR, TrustManager.LEGACY_FILENAME), TrustManager.LEGACY_FILENAME)
+        trust_manager = TrustManager.load("train.bin", "test.bin", False)
+        self.assertTrue(TrustManager.State.is_state(TrustManager.STATE_DIR))
+        self.assertEqual(trust_manager.get_no_of_nodes(), 50)
+        self.assertEqual(len(trust_manager.get_report_stores()[1]), 50 * 49)
+        self.assertTrue(all(
+            report is not None for reporter_id, row in enumerate(trust_manager.get_reports())
+            for target_id, report in enumerate(row) if reporter_id != target_id
+        ))
+
+    def test_sparse_bootstrap(self):
+        '''
+        Test bootstrapping with random partners and along topologies, giving reports only
+        for the interactions.
+        '''
+        trust_manager = TrustManager.TrustManager(no_of_nodes=20)
+        trust_manager.bootstrap(4, filewrite=False, verbose=False, partners=3)
+        train_reports = trust_manager.get_report_stores()[0]
+        self.assertEqual(len(train_reports), 4 * 20 * 3)
+        for epoch in range(1, 5):
+            reports = train_reports.by_time(epoch, epoch)
+            self.assertTrue(np.array_equal(np.bincount(reports["reporter"]), np.full(20, 3)))
+            self.assertEqual(len(set(zip(reports["reporter"].tolist(), reports["target"].tolist()))), 20 * 3)
+            self.assertFalse(np.any(reports["reporter"] == reports["target"]))
+
+        reporters, targets = TrustManager.Topology.random_regular(20, 4)
+        self.assertTrue(np.array_equal(np.bincount(targets), np.full(20, 4)))
+        trust_manager.bootstrap(2, filewrite=False, verbose=False, topology=(reporters, targets))
+        reports = trust_manager.get_report_stores()[1].by_time(2, 2)
+        self.assertTrue(np.array_equal(reports["reporter"], reporters))
+        self.assertTrue(np.array_equal(reports["target"], targets))
+
+        reporters, targets = TrustManager.Topology.small_world(20, 4, rewire=0.0)
+        self.assertEqual(set(((targets - reporters) % 20).tolist()), {1, 2, 18, 19})
+        with self.assertRaises(ValueError):
+            trust_manager.bootstrap(1, filewrite=False, verbose=False, partners=2, topology=(reporters, targets))
+
+    def test_sharded_bootstrap(self):
+        '''
+        Test that a sharded bootstrap writes the same shards for a seed and number of shards
+        whatever the number of workers, and that its manifests read back as report files.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            train_filename = os.path.join(tmp_dir, "train.bin")
+            test_filename = os.path.join(tmp_dir, "test.bin")
+            trust_manager = TrustManager.TrustManager(
+                no_of_nodes=12, train_filename=train_filename, test_filename=test_filename
+            )
+
+            def bootstrap(seed, workers, shards=3):
+                trust_manager.bootstrap_sharded(5, shards, seed, workers, partners=4, verbose=False)
+                return [
+                    np.fromfile(shard, dtype=np.uint8).tobytes()
+                    for filename in (train_filename, test_filename)
+                    for shard in TrustManager.ReportFile.read_manifest(filename)
+                ]
+
+            shards = bootstrap(7, workers=2)
+            self.assertEqual(len(shards), 6)
+            self.assertEqual(bootstrap(7, workers=1), shards)
+            self.assertNotEqual(bootstrap(8, workers=1), shards)
+            self.assertEqual(len(bootstrap(7, workers=1, shards=7)), 14)
+            self.assertEqual(len([filename for filename in os.listdir(tmp_dir) if ".shard-" in filename and
+                                  not filename.endswith(".idx")]), 14)
+            bootstrap(7, workers=2)
+
+            train_store, test_store = trust_manager.get_report_stores()
+            self.assertEqual(list(train_store.get_epochs()), [1, 2, 3, 4, 5])
+            self.assertEqual(len(test_store), 5 * 12 * 4)
+            data, notes, _ = TrustManager.read_data(train_filename, dict_mode=False)
+            self.assertTrue(np.array_equal(data[:, 0], train_store.get_column("reporter")))
+            self.assertTrue(np.array_equal(notes, train_store.get_column("note")))
+            data, notes, weights = TrustManager.read_data(train_filename, dict_mode=False, window=2, decay=0.5)
+            batches = list(TrustManager.ANN.report_batches(
+                [train_filename], batch_size=16, shuffle=False, window=2, decay=0.5
+            ))
+            self.assertTrue(np.array_equal(np.concatenate([inputs for inputs, *_ in batches]), data))
+            self.assertTrue(np.allclose(np.concatenate([batch_weights for *_, batch_weights in batches]), weights))
+
+            trust_manager.save_reports(test_filename)
+            self.assertEqual(len(TrustManager.ReportFile.load_reports(test_filename)), 6 * 12 * 4)
+            self.assertTrue(TrustManager.ReportFile.is_manifest(test_filename))
+
+    def test_seeded_sharded_bootstrap(self):
+        '''
+        Test that sharded bootstraps of networks created with the same seed write identical shards.
+        '''
+        def bootstrap(tmp_dir, seed):
+            train_filename = os.path.join(tmp_dir, "train.bin")
+            trust_manager = TrustManager.TrustManager(
+                no_of_nodes=12, train_filename=train_filename, test_filename=os.path.join(tmp_dir, "test.bin"),
+                seed=seed
+            )
+            trust_manager.bootstrap_sharded(4, 2, seed, 1, verbose=False)
+            return [
+                np.fromfile(shard, dtype=np.uint8).tobytes()
+                for shard in TrustManager.ReportFile.read_manifest(train_filename)
+            ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir, tempfile.TemporaryDirectory() as other_dir:
+            shards = bootstrap(tmp_dir, 1)
+            np.random.seed(5)
+            self.assertEqual(bootstrap(other_dir, 1), shards)
+            self.assertNotEqual(bootstrap(other_dir, 2), shards)
+
+    def test_report_files(self):
+        '''
+        Test that the binary report files and csvs read back the same reports.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trust_manager = TrustManager.TrustManager(no_of_nodes=10)
+            binary_filename = os.path.join(tmp_dir, "reports.bin")
+            csv_filename = os.path.join(tmp_dir, "reports.csv")
+            trust_manager.set_filenames(binary_filename, csv_filename)
+            trust_manager.bootstrap(3, verbose=False)
+            self.assertTrue(TrustManager.ReportFile.is_report_file(binary_filename))
+            self.assertFalse(TrustManager.ReportFile.is_report_file(csv_filename))
+
+            train_store, test_store = trust_manager.get_report_stores()
+            for filename, report_store in [(binary_filename, train_store), (csv_filename, test_store)]:
+                data, notes, _ = TrustManager.read_data(filename, dict_mode=False)
+                columns = report_store.get_columns()
+                self.assertEqual(data.shape, (3 * 10 * 9, 4))
+                self.assertTrue(np.array_equal(data[:, 0], columns["reporter"]))
+                self.assertTrue(np.array_equal(data[:, 3], columns["capability"]))
+                self.assertTrue(np.array_equal(notes, columns["note"]))
+                data, notes, _ = TrustManager.read_data(filename)
+                self.assertEqual(sorted(data.keys()), list(range(10)))
+                self.assertTrue(np.array_equal(notes[4], report_store.by_reporter(4)["note"]))
+            self.assertTrue(os.path.exists(TrustManager.ReportFile.cache_filename(csv_filename)))
+
+    def test_reporter_index(self):
+        '''
+        Test that reading only some reporters through the report file index gives the same
+        data as reading the whole file, and that a missing index is rebuilt.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            train_filename = os.path.join(tmp_dir, "train.bin")
+            trust_manager = TrustManager.TrustManager(
+                no_of_nodes=10, train_filename=train_filename, test_filename=os.path.join(tmp_dir, "test.bin")
+            )
+            trust_manager.bootstrap(4, verbose=False)
+            ReportFile = TrustManager.ReportFile
+            self.assertEqual(ReportFile.index_coverage(train_filename), 4 * 10 * 9)
+            self.assertEqual(len(ReportFile.open_index(train_filename)), 4 * 10)
+
+            for rebuild in (False, True):
+                if rebuild:
+                    os.remove(ReportFile.index_filename(train_filename))
+                for window, decay in [(None, None), (2, 0.5)]:
+                    full = TrustManager.read_data(train_filename, window=window, decay=decay)
+                    selected = TrustManager.read_data(train_filename, window=window, decay=decay, reporter_ids=[2, 5])
+                    self.assertEqual(len(selected), 3)
+                    self.assertEqual(selected[2] is None, decay is None)
+                    no_of_items = 2 if decay is None else 3
+                    for full_item, selected_item in zip(full[:no_of_items], selected[:no_of_items]):
+                        self.assertEqual(sorted(selected_item), [2, 5])
+                        for reporter_id in (2, 5):
+                            self.assertTrue(np.array_equal(selected_item[reporter_id], full_item[reporter_id]))
+            self.assertEqual(ReportFile.index_coverage(train_filename), 4 * 10 * 9)
+
+    def test_windowed_data(self):
+        '''
+        Test that report times survive csvs, and that reading a window or with decay selects
+        and weights the reports by their age.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            train_filename = os.path.join(tmp_dir, "train.csv")
+            test_filename = os.path.join(tmp_dir, "test.bin")
+            trust_manager = TrustManager.TrustManager(
+                no_of_nodes=6, train_filename=train_filename, test_filename=test_filename
+            )
+            trust_manager.bootstrap(5, verbose=False)
+            csv_reports = TrustManager.ReportFile.load_reports(train_filename)
+            self.assertTrue(np.array_equal(csv_reports["epoch"], np.repeat(np.arange(1, 6), 6 * 5)))
+
+            for filename in [train_filename, test_filename]:
+                data, notes, _ = TrustManager.read_data(filename, dict_mode=False, window=2)
+                self.assertEqual(len(notes), 2 * 6 * 5)
+                data, notes, weights = TrustManager.read_data(filename, decay=0.5)
+                self.assertEqual(set(notes.keys()), set(range(6)))
+                self.assertTrue(np.allclose(weights[0], np.repeat([1 / 16, 1 / 8, 1 / 4, 1 / 2, 1], 5)))
+
+            inputs, labels, weights = TrustManager.SVM.merge_duplicates(
+                np.array([[1, 2], [1, 2], [3, 4]]), np.array([1, 1, 0]), np.array([0.5, 0.25, 1.0])
+            )
+            self.assertTrue(np.array_equal(weights, [0.75, 1.0]))
+
+    def test_report_batches(self):
+        '''
+        Test that streaming batches from report files covers every report once.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trust_manager = TrustManager.TrustManager(no_of_nodes=10)
+            train_filename = os.path.join(tmp_dir, "reports-train.bin")
+            test_filename = os.path.join(tmp_dir, "reports-test.bin")
+            trust_manager.set_filenames(train_filename, test_filename)
+            trust_manager.bootstrap(2, verbose=False)
+
+            batches = list(TrustManager.ANN.report_batches(
+                [train_filename, test_filename], batch_size=50, shuffle_buffer=70
+            ))
+            self.assertTrue(all(len(inputs) <= 50 for inputs, _ in batches))
+            inputs = np.concatenate([batch_inputs for batch_inputs, _ in batches])
+            labels = np.concatenate([batch_labels for _, batch_labels in batches])
+            self.assertEqual(inputs.shape, (2 * 2 * 10 * 9, 4))
+            self.assertTrue(np.all(labels.sum(axis=1) == 1))
+            data = np.concatenate([
+                TrustManager.read_data(filename, dict_mode=False)[0] for filename in [train_filename, test_filename]
+            ])
+            self.assertEqual(sorted(map(tuple, inputs.astype(int))), sorted(map(tuple, data)))
+
+    def test_batched_ann_inference(self):
+        '''
+        Test that batched ANN inference decodes the same notes as one prediction at a time.
+        '''
+        class StubANN:
+            def predict(self, inputs, batch_size=None, verbose=0):
+                inputs = np.asarray(inputs)
+                return np.eye(3)[(inputs[:, 0] + inputs[:, 1] * inputs[:, 2]).astype(int) % 3] * 0.9
+
+        ann = StubANN()
+        trust_matrix = TrustManager.ANN.predict_trust_matrix(ann, [0, 3, 4], 2, 5, 6, batch_size=4)
+        self.assertEqual(trust_matrix.shape, (3, 6))
+        for row, client_id in enumerate([0, 3, 4]):
+            trusted_list = TrustManager.ANN.get_trusted_list(ann, client_id, 2, 5, 6)
+            for server_id in range(6):
+                expected = TrustManager.ANN.unbinarize(ann.predict(np.array([[client_id, server_id, 2, 5]]))[0])
+                self.assertEqual(trust_matrix[row, server_id], expected)
+                self.assertEqual(trusted_list[server_id], expected)
+
+    def test_training_run(self):
+        '''
+        Test that a training run stops early, keeps only its best checkpoints and resumes at
+        the epoch and optimizer state it stopped at.
+        '''
+        from tensorflow import keras
+        TrainingRun = TrustManager.ANN.TrainingRun
+
+        def create_model(learning_rate):
+            model = keras.Sequential([keras.Input(shape=(4,)), keras.layers.Dense(3, activation="sigmoid")])
+            model.compile(loss="binary_crossentropy", optimizer=keras.optimizers.Adam(learning_rate=learning_rate))
+            return model
+
+        inputs = np.random.rand(64, 4)
+        labels = np.eye(3)[np.random.randint(0, 3, 64)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Without learning the loss never improves after the first epoch
+            run = TrainingRun.TrainingRun(tmp_dir, max_epochs=50, patience=2, keep_best=2)
+            model = run.fit(create_model(0.0), inputs, labels, validation_split=0.5, verbose=0)
+            self.assertEqual(run.get_stopped_epoch(), 3)
+            self.assertEqual(len(run.get_best_checkpoints()), 2)
+            self.assertEqual(sorted(os.listdir(tmp_dir)), sorted(
+                [os.path.basename(filename) for filename in run.get_best_checkpoints()] + [TrainingRun.LAST_CHECKPOINT]
+            ))
+            weights = model.get_weights()
+            self.assertTrue(all(np.array_equal(weight, best_weight) for weight, best_weight in zip(
+                weights, TrainingRun.read_checkpoint(os.path.join(tmp_dir, "best-0001.npz"))["weights"]
+            )))
+
+            run = TrainingRun.TrainingRun(tmp_dir, max_epochs=5, patience=10, keep_best=2)
+            model = create_model(0.01)
+            # Half of the samples are one batch of training data an epoch
+            self.assertEqual(run.resume(model), 3)
+            self.assertEqual(int(model.optimizer.iterations.numpy()), 3)
+            run.fit(model, inputs, labels, validation_split=0.5, verbose=0, resume=True)
+            self.assertEqual(TrainingRun.read_checkpoint(run.get_last_checkpoint())["epoch"], 5)
+            self.assertEqual(int(model.optimizer.iterations.numpy()), 5)
+
+    def test_numpy_ann(self):
+        '''
+        Test that the NumPy export of the ANN predicts the same as the Keras model, and that
+        the trust manager can use it without importing TensorFlow.
+        '''
+        self.use_work_dir()
+        os.makedirs("data")
+        model = TrustManager.ANN.create_ann()
+        model.save(TrustManager.ANN_FILENAME)
+        trust_manager = TrustManager.TrustManager(no_of_nodes=20, use_svm=False, cache_dir=None)
+        trust_manager.save()
+        inputs = TrustManager.ANN.create_grid(np.arange(20), np.arange(20), 3, 4)
+        keras_matrix = trust_manager.get_trust_matrix(3, 4)
+
+        trust_manager.set_numpy_ann_flag(True)
+        numpy_matrix = trust_manager.get_trust_matrix(3, 4)
+        numpy_ann = TrustManager.NumpyANN.load_model(TrustManager.NUMPY_ANN_FILENAME)
+        self.assertTrue(np.allclose(
+            numpy_ann.predict(inputs), model.predict(inputs, verbose=0), rtol=1e-4, atol=1e-5
+        ))
+        self.assertEqual(keras_matrix.shape, numpy_matrix.shape)
+        self.assertTrue(np.array_equal(
+            numpy_matrix, TrustManager.NumpyANN.decode(numpy_ann.predict(inputs)).reshape(20, 20)
+        ))
+        self.assertEqual([name for *_, name in numpy_ann.get_layers()], ["relu"] * 4 + ["sigmoid"])
+
+        script = (
+            "import sys; sys.modules['tensorflow'] = None;"
+            "import TrustManager;"
+            "trust_manager = TrustManager.load('train.bin', 'test.bin', False, numpy_ann=True);"
+            "print(trust_manager.find_best_servers(0, 3, 4))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+            env=dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+        ).stdout.strip()
+        self.assertEqual(output, str(TrustManager.to_trusted_list(numpy_matrix[0])))
+
+    def test_fused_svms(self):
+        '''
+        Test that the fused SVM evaluator predicts the same as each of the SVMs.
+        '''
+        inputs = np.array([[i, s, c] for i in range(8) for s in range(0, 7, 2) for c in range(0, 11, 3)])
+        svms = {
+            0: TrustManager.SVM.create_and_fit_svm(inputs, np.where(inputs[:, 0] < 4, 1, -1), 10, 0.5),
+            1: TrustManager.SVM.create_and_fit_svm(inputs, (inputs[:, 1] > 2).astype(int) - (inputs[:, 2] > 6), 1, 0.1),
+            2: TrustManager.SVM.create_and_fit_svm(inputs, (inputs[:, 0] % 3) - 1, 50, 1.5),
+        }
+        fused_svms = TrustManager.SVM.FusedSVMs(svms, workers=2, chunk_size=1)
+        for service in range(TrustManager.SERVICE_MAX + 1):
+            trust_matrix = fused_svms.trust_matrix(service, 4, 8)
+            grid_predictions = fused_svms.predict(TrustManager.SVM.create_inputs(service, 4, 8))
+            for client_id, svm in svms.items():
+                expected = TrustManager.SVM.predict_servers(svm, service, 4, 8)
+                self.assertTrue(np.array_equal(trust_matrix[client_id], expected))
+                self.assertTrue(np.array_equal(grid_predictions[client_id], expected))
+
+    def test_trust_cache(self):
+        '''
+        Test the LRU and on-disk tiers of the trust matrix cache.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            predictor_filename = os.path.join(tmp_dir, "predictor.pkl")
+            self.assertIsNone(TrustManager.Cache.fingerprint(predictor_filename))
+            with open(predictor_filename, "w") as predictor_file:
+                predictor_file.write("model")
+            predictor_fingerprint = TrustManager.Cache.fingerprint(predictor_filename)
+
+            cache = TrustManager.Cache.TrustCache(max_entries=2, cache_dir=os.path.join(tmp_dir, "cache"))
+            for service in range(3):
+                cache.put(("SVM", predictor_fingerprint, 5, service, 1), np.full((5, 5), service, dtype=np.int8))
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get(("SVM", None, 5, 1, 1)))
+            self.assertEqual(cache.get(("SVM", predictor_fingerprint, 5, 0, 1))[0, 0], 0)
+            self.assertIsNone(cache.get(("SVM", predictor_fingerprint, 5, 0, 2)))
+            cache.put(("ANN", "annfingerprint", 5, 0, 1), np.ones((5, 5), dtype=np.int8))
+
+            with open(predictor_filename, "w") as predictor_file:
+                predictor_file.write("retrained model")
+            new_fingerprint = TrustManager.Cache.fingerprint(predictor_filename)
+            self.assertNotEqual(new_fingerprint, predictor_fingerprint)
+            cache.clear("SVM", new_fingerprint)
+            self.assertIsNone(cache.get(("SVM", predictor_fingerprint, 5, 2, 1)))
+            self.assertEqual(cache.get(("ANN", "annfingerprint", 5, 0, 1))[0, 0], 1)
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, "cache"))), 1)
+
+    def use_work_dir(self):
+        '''
+        Run the rest of the test in a fresh temporary directory, for the tests that write
+        to the data directory, changing back and removing it when the test is done.
+        '''
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp_dir.name)
+        return tmp_dir.name
+
+    def create_svm_trust_manager(self, no_of_nodes):
+        '''
+        Create a bootstrapped trust manager with quickly fitted SVMs in the current directory,
+        which should be a work directory.
+        '''
+        trust_manager = TrustManager.TrustManager(
+            no_of_nodes=no_of_nodes, train_filename="reports-train.bin", test_filename="reports-test.bin"
+        )
+        trust_manager.bootstrap(2, verbose=False)
+        train_data, train_notes, _ = TrustManager.read_data("reports-train.bin")
+        os.makedirs("data")
+        joblib.dump({
+            reporter_id: TrustManager.SVM.create_and_fit_svm(train_data[reporter_id], train_notes[reporter_id], 10, 0.5)
+            for reporter_id in train_data
+        }, "data/SVMs.pkl")
+        return trust_manager
+
+    def test_server_batching(self):
+        '''
+        Test that the server answers concurrent queries the same as the trust manager,
+        coalescing them into fewer predictor batches.
+        '''
+        async def query_server(trust_manager, queries):
+            server, batcher = await Server.start_server(trust_manager, port=0, window=0.05)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            for request_id, (client_id, service, capability) in enumerate(queries):
+                writer.write((json.dumps({
+                    "id": request_id, "method": "trusted_list", "client": client_id, "service": service,
+                    "capability": capability
+                }) + "\n").encode())
+            writer.write(b'{"id": "bad", "client": 100, "service": 1, "capability": 1}\n')
+            await writer.drain()
+            responses = [json.loads(await reader.readline()) for _ in range(len(queries) + 1)]
+            writer.close()
+            await writer.wait_closed()
+            # Let the server see the connection close before shutting down
+            await asyncio.sleep(0.1)
+            server.close()
+            await server.wait_closed()
+            batcher.close()
+            return {response["id"]: response for response in responses}
+
+        self.use_work_dir()
+        trust_manager = self.create_svm_trust_manager(8)
+        queries = [(client_id, service, 4) for client_id in range(8) for service in (1, 2, 3)]
+        responses = asyncio.run(query_server(trust_manager, queries))
+        for request_id, (client_id, service, capability) in enumerate(queries):
+            self.assertEqual(
+                responses[request_id]["result"],
+                list(trust_manager.find_best_servers(client_id, service, capability).values())
+            )
+        self.assertIn("error", responses["bad"])
+        stats = trust_manager.stats()
+        self.assertEqual(stats["counters"]["server.queries"], len(queries))
+        self.assertLess(stats["timers"]["server.batch"]["calls"], len(queries))
+
+    def test_export_graphs(self):
+        '''
+        Test that the bulk graph export predicts only the requested rows, once for each
+        context, and writes the same graphs as graphviz would without its binary.
+        '''
+        self.use_work_dir()
+        trust_manager = self.create_svm_trust_manager(8)
+        queries = [(0, 2, 3), (5, 2, 3), (0, 4, 1), (0, 2, 3)]
+        dot_filenames = trust_manager.export_graphs(queries, "dot", workers=2)
+        self.assertEqual(trust_manager.stats()["counters"]["predict.rows"], 3)
+        self.assertEqual(dot_filenames[0], "graphs/id0_s2_c3_SVM_recommendations.gv")
+        self.assertEqual(len(dot_filenames), 3)
+        json_filenames = trust_manager.export_graphs(queries, "json", directory="edges")
+
+        malicious = trust_manager.get_node_arrays()[2]
+        for (client_id, service, capability), dot_filename, json_filename in zip(
+                queries, dot_filenames, json_filenames):
+            trusted_list = trust_manager.find_best_servers(client_id, service, capability)
+            graph = TrustManager.Backends.get_renderer("graphviz").Digraph(comment="Recommendations DiGraph")
+            for node_id in range(8):
+                graph.node(f"{node_id}", f"{node_id}", color="red" if malicious[node_id] else "blue",
+                           style="filled", fontcolor="white")
+            for server_id, note in trusted_list.items():
+                graph.edge(f"{client_id}", f"{server_id}", color=TrustManager.Graphs.NOTE_COLOURS[note])
+            with open(dot_filename) as dot_file:
+                self.assertEqual(dot_file.read(), graph.source)
+            with open(json_filename) as json_file:
+                edge_list = json.load(json_file)
+            self.assertEqual(
+                edge_list["edges"], [[client_id, server_id, note] for server_id, note in trusted_list.items()]
+            )
+            self.assertEqual(edge_list["malicious"], np.flatnonzero(malicious).tolist())
+        with self.assertRaises(ValueError):
+            trust_manager.export_graphs(queries, "png")
+
+    def test_incremental_update(self):
+        '''
+        Test that updating with new reports refits only the SVMs of their reporters, keeping
+        their C and gamma, and adds the reports to the training data.
+        '''
+        self.use_work_dir()
+        trust_manager = self.create_svm_trust_manager(8)
+        old_svms = joblib.load("data/SVMs.pkl")
+        old_matrix = trust_manager.get_trust_matrix(3, 4)
+        no_of_train_reports = len(trust_manager.get_report_stores()[0])
+
+        targets = np.array([target for target in range(8) if target != 2] * 4)
+        trust_manager.update({
+            "reporter": np.full(len(targets), 2),
+            "target": targets,
+            "service": np.tile([1, 3, 5, 6], len(targets) // 4),
+            "capability": np.repeat([2, 4, 8, 10], len(targets) // 4),
+            "note": np.where(targets % 2 == 0, 1, -1)
+        })
+
+        new_svms = joblib.load("data/SVMs.pkl")
+        self.assertEqual(len(TrustManager.read_data("reports-train.bin")[1][2]), 2 * 7 + len(targets))
+        self.assertEqual(len(trust_manager.get_report_stores()[0]), no_of_train_reports + len(targets))
+        self.assertEqual(len(new_svms[2].support_), len(new_svms[2].support_vectors_))
+        self.assertNotEqual(len(new_svms[2].support_), len(old_svms[2].support_))
+        self.assertEqual((new_svms[2].C, new_svms[2].gamma), (old_svms[2].C, old_svms[2].gamma))
+        for reporter_id in old_svms:
+            if reporter_id != 2:
+                self.assertTrue(np.array_equal(new_svms[reporter_id].dual_coef_, old_svms[reporter_id].dual_coef_))
+        new_matrix = trust_manager.get_trust_matrix(3, 4)
+        self.assertTrue(np.array_equal(np.delete(new_matrix, 2, axis=0), np.delete(old_matrix, 2, axis=0)))
+        self.assertEqual(trust_manager.stats()["counters"]["update.refits"], 1)
+
+    def test_trust_tensor(self):
+        '''
+        Test that the compiled trust tensor gives the same trust matrices as the predictor.
+        '''
+        self.use_work_dir()
+        trust_manager = self.create_svm_trust_manager(6)
+        expected = [trust_manager.get_trust_matrix(service, 3) for service in range(TrustManager.SERVICE_MAX + 1)]
+        self.assertIsNone(trust_manager.get_trust_tensor())
+        trust_manager.compile_trust_tensor(workers=2, verbose=False)
+        self.assertEqual(
+            trust_manager.get_trust_tensor().shape,
+            (TrustManager.SERVICE_MAX + 1, TrustManager.CAP_MAX + 1, 6, 6)
+        )
+        for service in range(TrustManager.SERVICE_MAX + 1):
+            self.assertTrue(np.array_equal(trust_manager.get_trust_matrix(service, 3), expected[service]))
+        self.assertEqual(trust_manager.find_best_servers(2, 1, 3), TrustManager.to_trusted_list(expected[1][2]))
+
+    def test_seeded_evolve_svm(self):
+        '''
+        Test that evolving the SVMs with a seed gives the same parameters for every reporter
+        however many workers run it, leaving NumPy's global random state alone.
+        '''
+        def evolve(workers, seed=3):
+            with contextlib.redirect_stdout(io.StringIO()):
+                trust_manager.evolve_svm(workers=workers, seed=seed)
+            return {
+                reporter_id: (svm.C, svm.gamma) for reporter_id, svm in joblib.load("data/SVMs.pkl").items()
+            }
+
+        self.use_work_dir()
+        trust_manager = TrustManager.TrustManager(
+            no_of_nodes=4, train_filename="reports-train.bin", test_filename="reports-test.bin"
+        )
+        # Reports that are the same in both files and easily learnt, so that the evolution stops early
+        reporters, targets = TrustManager.all_pairs(4)
+        reports = {
+            "epoch": 1,
+            "reporter": np.repeat(reporters, 3),
+            "target": np.repeat(targets, 3),
+            "service": np.tile(np.arange(1, 4, dtype=np.int8), len(reporters)),
+            "capability": 5,
+            "note": np.where(np.repeat(targets, 3) % 2 == 0, -1, 1).astype(np.int8)
+        }
+        for filename in ("reports-train.bin", "reports-test.bin"):
+            TrustManager.ReportFile.write_reports(filename, reports)
+        np.random.seed(11)
+        global_state = np.random.get_state()[1].copy()
+        parameters = evolve(1)
+        self.assertTrue(np.array_equal(np.random.get_state()[1], global_state))
+        self.assertEqual(sorted(parameters), list(range(4)))
+        self.assertEqual(evolve(2), parameters)
+        self.assertNotEqual(evolve(1, seed=4), parameters)
+
+    def test_missing_svm(self):
+        '''
+        Test that the fused SVMs refuse to predict a trust matrix when a client has no SVM.
+        '''
+        self.use_work_dir()
+        trust_manager = self.create_svm_trust_manager(6)
+        svms = joblib.load("data/SVMs.pkl")
+        del svms[3]
+        joblib.dump(svms, "data/SVMs.pkl")
+        with self.assertRaises(KeyError):
+            trust_manager.get_trust_matrix(1, 3)
+        self.assertEqual(trust_manager.get_trust_matrix(1, 3, [2, 4], fill_cache=False).shape, (2, 6))
+
+    def test_simulate_transactions(self):
+        '''
+        Test that the simulated transaction ratings follow the expected distribution.
+        '''
+        self.use_work_dir()
+        trust_manager = self.create_svm_trust_manager(8)
+        network = trust_manager.get_network()
+        expected = np.zeros(3)
+        for service in range(TrustManager.SERVICE_MAX + 1):
+            for capability in range(TrustManager.CAP_MAX + 1):
+                trust_matrix = trust_manager.get_trust_matrix(service, capability)
+                for client_id, client in enumerate(network):
+                    good = [i for i in range(8) if i != client_id and trust_matrix[client_id, i] == 1]
+                    okay = [i for i in range(8) if i != client_id and trust_matrix[client_id, i] == 0]
+                    candidates = good if good else okay
+                    if not candidates:
+                        expected[0] += 1
+                    for server_id in candidates:
+                        note = client.take_note(network[server_id], service, capability)
+                        expected[note + 1] += 1 / len(candidates)
+        expected = 100 * expected / expected.sum()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            percentages = trust_manager.simulate_transactions(100_000)
+        self.assertAlmostEqual(sum(percentages), 100)
+        for percentage, expected_percentage in zip(percentages, expected):
+            self.assertAlmostEqual(percentage, expected_percentage, delta=1)
+
+    def test_precomputed_fitness(self):
+        '''
+        Test that the precomputed kernel fitness matches the accuracy of an RBF SVM.
+        '''
+        inputs = np.array([[i, s, c] for i in range(6) for s in range(1, 7) for c in range(1, 11, 2)] * 2)
+        labels = np.where(inputs[:, 0] == 2, -1, (inputs[:, 1] > 3).astype(int) + (inputs[:, 2] > 5) - 1)
+        test_inputs = inputs[::3] + [0, 0, 1]
+        test_labels = labels[::3]
+        fitness = TrustManager.SVM.create_fitness(inputs, labels, test_inputs, test_labels)
+        for genome in [[50.0, 1.0], [2.0, 0.1], [0.5, 4.0]]:
+            svm = TrustManager.SVM.create_and_fit_svm(inputs, labels, *genome)
+            self.assertAlmostEqual(
+                fitness(genome), TrustManager.SVM.find_accuracy(svm, test_inputs, test_labels),
+                delta=100 / len(test_labels)
+            )
+            self.assertEqual(fitness(list(genome)), fitness(genome))
+
+    def test_sweep_grid(self):
+        '''
+        Test that the sweep grid covers every combination with a distinct work directory.
+        '''
+        grid = Sweep.create_grid([10, 20], [0.5], [0.1], [0.0, 0.1, 0.2], ["svm", "ann"], [0, 1])
+        self.assertEqual(len(grid), 2 * 3 * 2 * 2)
+        self.assertEqual(len({Sweep.work_dir_name(point) for point in grid}), len(grid))
+        self.assertEqual(set(grid[0].keys()), set(Sweep.GRID_KEYS))
+
+    def test_stats(self):
+        '''
+        Test that the trust manager counts its work, and that disabled stats record nothing.
+        '''
+        trust_manager = TrustManager.TrustManager(no_of_nodes=10)
+        trust_manager.bootstrap(epochs=3, filewrite=False, verbose=False)
+        stats = trust_manager.stats()
+        self.assertEqual(stats["counters"]["transactions.reports"], 2 * 3 * 10 * 9)
+        self.assertEqual(stats["timers"]["transactions"]["calls"], 6)
+
+        trust_manager.get_stats().set_enabled(False)
+        trust_manager.bootstrap(epochs=3, filewrite=False, verbose=False)
+        self.assertEqual(trust_manager.stats()["counters"], stats["counters"])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, "stats.jsonl")
+            trust_manager.get_stats().dump(filename)
+            trust_manager.get_stats().reset()
+            trust_manager.get_stats().dump(filename)
+            with open(filename) as stats_file:
+                lines = [json.loads(line) for line in stats_file]
+        self.assertEqual(lines[0]["counters"], stats["counters"])
+        self.assertEqual(lines[1]["counters"], {})
+
+    def test_lazy_backends(self):
+        '''
+        Test that importing the trust manager does not import the predictor backends or
+        graph renderer, and that they load on first access.
+        '''
+        script = (
+            "import sys, TrustManager, TrustManager.Backends as Backends;"
+            "loaded = [Backends.is_loaded(name) for name in ('svm', 'ann', 'graphviz')];"
+            "print(loaded, 'tensorflow' in sys.modules, hasattr(TrustManager.SVM, 'FusedSVMs'), Backends.is_loaded('svm'))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True,
+            cwd=PACKAGE_DIR
+        ).stdout.strip()
+        self.assertEqual(output, "[False, False, False] False True True")
+
+    def test_benchmark_compare(self):
+        '''
+        Test that benchmarking records each phase, and that only slowdowns beyond the
+        threshold are reported as regressions.
+        '''
+        results = Benchmark.run_benchmarks([5], [2], ["network", "bootstrap"], repeats=2, warmup=0, verbose=False)
+        self.assertEqual([entry["phase"] for entry in results["results"]], ["network", "bootstrap"])
+        self.assertTrue(all(entry["mean"] > 0 and entry["repeats"] == 2 for entry in results["results"]))
+
+        baseline = {"results": [dict(entry, mean=entry["mean"] / 2) for entry in results["results"]]}
+        self.assertEqual(len(Benchmark.compare(results, baseline, threshold=0.5)), 2)
+        self.assertEqual(len(Benchmark.compare(results, baseline, threshold=1.5)), 0)
+        self.assertEqual(len(Benchmark.compare(results, results, threshold=0.0)), 0)
 
 
 if __name__ == '__main__':
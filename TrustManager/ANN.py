@@ -1,10 +1,13 @@
-import os
-
+import tensorflow as tf
 from tensorflow import keras
 import numpy as np
 import sklearn.preprocessing as skp
 
-import Functions
+import TrustManager.ReportFile as ReportFile
+import TrustManager.TrainingRun as TrainingRun
+import TrustManager.NumpyANN as NumpyANN
+from TrustManager.NumpyANN import NOTES, PREDICT_BATCH_SIZE, get_trusted_list, create_grid, predict_notes, \
+    predict_trust_matrix, decode, time_predict
 
 '''
 Use an artificial neural network for trust management.
@@ -13,63 +16,195 @@ Author: Cody Lewis
 Date: 2019-04-12
 '''
 
+# The inference functions are shared with the NumPy engine and re-exported from it
+__all__ = [
+    "create_ann", "load_model", "export_numpy", "create_callbacks", "create_and_train_ann", "update_ann", "one_hot",
+    "report_batches", "create_dataset", "create_and_train_ann_streaming", "unbinarize",
+    "NOTES", "PREDICT_BATCH_SIZE", "get_trusted_list", "create_grid", "predict_notes", "predict_trust_matrix",
+    "decode", "time_predict"
+]
+
 
-def create_and_train_ann(train_data, train_labels, test_data, test_labels, model=None):
+def create_ann():
     '''
-    Create a neural network and train it on the given data.
+    Create and compile the neural network.
+    '''
+    model = keras.models.Sequential()
+    model.add(keras.layers.Dense(128, input_shape=(4,)))
+    model.add(keras.layers.Activation('relu'))
+    model.add(keras.layers.Dense(128))
+    model.add(keras.layers.Activation('relu'))
+    model.add(keras.layers.Dense(128))
+    model.add(keras.layers.Activation('relu'))
+    model.add(keras.layers.Dense(64))
+    model.add(keras.layers.Activation('relu'))
+    model.add(keras.layers.Dropout(0.5))
+    model.add(keras.layers.Dense(3))
+    model.add(keras.layers.Activation('sigmoid'))
+
+    adam = keras.optimizers.Adam(learning_rate=0.0001)
+    model.compile(loss="mean_squared_error", optimizer=adam, metrics=['accuracy'])
+
+    return model
+
+
+def load_model(filename):
+    '''
+    Load a saved neural network.
+    '''
+    return keras.models.load_model(filename)
+
+
+def export_numpy(model, filename, source_fingerprint=None):
+    '''
+    Export the dense layers of a neural network to a NumPy archive that NumpyANN can
+    predict with. Activation layers are folded into the dense layer before them, and
+    dropout is dropped as it does nothing at inference.
+    '''
+    kernels, biases, activations = [], [], []
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.Dense):
+            kernel, bias = layer.get_weights()
+            kernels.append(kernel)
+            biases.append(bias)
+            activations.append(layer.activation.__name__)
+        elif isinstance(layer, keras.layers.Activation) and kernels and activations[-1] == "linear":
+            activations[-1] = layer.activation.__name__
+        elif not isinstance(layer, keras.layers.Dropout):
+            raise ValueError(f"Cannot export the {type(layer).__name__} layer {layer.name}")
+    numpy_ann = NumpyANN.NumpyANN(kernels, biases, activations, source_fingerprint)
+    NumpyANN.save_model(filename, numpy_ann)
+
+    return numpy_ann
+
+
+def create_callbacks():
+    '''
+    Create the tensorboard callback used in training, checkpointing is left to the
+    training run.
     '''
-    if not model:
-        model = keras.models.Sequential()
-        model.add(keras.layers.Dense(128, input_shape=(4,)))
-        model.add(keras.layers.Activation('relu'))
-        model.add(keras.layers.Dense(128))
-        model.add(keras.layers.Activation('relu'))
-        model.add(keras.layers.Dense(128))
-        model.add(keras.layers.Activation('relu'))
-        model.add(keras.layers.Dense(64))
-        model.add(keras.layers.Activation('relu'))
-        model.add(keras.layers.Dropout(0.5))
-        model.add(keras.layers.Dense(3))
-        model.add(keras.layers.Activation('sigmoid'))
-
-        adam = keras.optimizers.Adam(lr=0.0001)
-        model.compile(loss="mean_squared_error", optimizer=adam, metrics=['accuracy'])
-    data = np.array(train_data + test_data)
-    labels = skp.label_binarize(np.array(train_labels + test_labels), ["-1", "0", "1"])
     tensorboard = keras.callbacks.TensorBoard(log_dir="./logs", histogram_freq=0, write_graph=True, write_images=False)
-    if not os.path.exists("data/ANN"):
-        os.makedirs("data/ANN")
-    checkpointer = keras.callbacks.ModelCheckpoint("data/ANN/ANN.{epoch:03d}-{val_loss:.2f}.h5", monitor='val_loss',
-                                                   verbose=1, save_best_only=False, save_weights_only=False,
-                                                   mode='auto', period=1)
-    model.fit(x=data, y=labels, epochs=500, validation_split=0.5, callbacks=[tensorboard, checkpointer])
+    return [tensorboard]
+
+
+def create_and_train_ann(train_data, train_labels, test_data, test_labels, model=None, train_weights=None,
+                         test_weights=None, run=None, resume=False):
+    '''
+    Create a neural network and train it on the given data, with optional sample weights,
+    over a training run that stops early and may be resumed.
+    '''
+    if not model:
+        model = create_ann()
+    if not run:
+        run = TrainingRun.TrainingRun()
+    data = np.concatenate((train_data, test_data))
+    labels = skp.label_binarize(np.concatenate((train_labels, test_labels)), classes=[-1, 0, 1])
+    sample_weight = None
+    if train_weights is not None and test_weights is not None:
+        sample_weight = np.concatenate((train_weights, test_weights))
+    run.fit(
+        model, x=data, y=labels, sample_weight=sample_weight, validation_split=0.5, callbacks=create_callbacks(),
+        resume=resume
+    )
 
     return model
 
 
-def get_trusted_list(ann, client_id, service_target, capability_target, no_of_nodes):
+def update_ann(model, inputs, notes, epochs=5, batch_size=32):
     '''
-    Get the list of nodes that client trusts for a given target service, and capability.
+    Warm start a trained neural network with a few epochs on newly arrived reports.
     '''
-    trusted_list = dict()
+    model.fit(x=inputs, y=one_hot(notes), epochs=epochs, batch_size=batch_size, verbose=0)
 
-    for i in range(no_of_nodes):
-        trusted_list[i] = unbinarize(ann.predict(np.array([[client_id, i, service_target, capability_target]]))[0])
+    return model
 
-    return trusted_list
 
+def one_hot(notes):
+    '''
+    One-hot encode notes, in the class order -1, 0, 1.
+    '''
+    return np.eye(3, dtype=np.float32)[np.asarray(notes, dtype=np.int64) + 1]
 
-def unbinarize(arr):
+
+def report_batches(filenames, batch_size=1024, shuffle_buffer=65536, shuffle=True, window=None, decay=None):
     '''
-    Convert a binarized array into the respective classes.
+    Generate batches of inputs and one-hot labels from report files. The files are
+    memory-mapped and decoded a shuffle buffer of records at a time, so memory use
+    does not depend on the size of the files. If window is given only the reports
+    from each file's latest window epochs are used, and if decay is given the batches
+    also hold sample weights decaying with the age of the reports. The shards of a
+    manifest are each memory-mapped, with the window and decay taken from the latest
+    epoch of all of them.
     '''
-    value = list(arr)
-    return [-1, 0, 1][value.index(max(value))]
+    files = []
+    for filename in filenames:
+        shards = [ReportFile.open_reports(shard) for shard in ReportFile.report_filenames(filename)]
+        latest_epoch = max((ReportFile.select_window(shard)[1] for shard in shards), default=0)
+        files.extend(ReportFile.select_window(shard, window, latest_epoch) for shard in shards)
+    chunks = []
+    for file_index, (reports, _) in enumerate(files):
+        chunks.extend((file_index, start) for start in range(0, len(reports), shuffle_buffer))
+    if shuffle:
+        chunks = [chunks[i] for i in np.random.permutation(len(chunks))]
+
+    for file_index, start in chunks:
+        file_reports, latest_epoch = files[file_index]
+        reports = file_reports[start:start + shuffle_buffer]
+        order = np.random.permutation(len(reports)) if shuffle else np.arange(len(reports))
+        for batch_start in range(0, len(order), batch_size):
+            batch = reports[order[batch_start:batch_start + batch_size]]
+            inputs = np.column_stack(
+                (batch["reporter"], batch["target"], batch["service"], batch["capability"])
+            ).astype(np.float32)
+            if decay is None:
+                yield inputs, one_hot(batch["note"])
+            else:
+                yield inputs, one_hot(batch["note"]), ReportFile.decay_weights(batch["epoch"], decay, latest_epoch)
+
+
+def create_dataset(filenames, batch_size=1024, shuffle_buffer=65536, shuffle=True, window=None, decay=None):
+    '''
+    Create a prefetching tf.data pipeline over report files.
+    '''
+    output_signature = (
+        tf.TensorSpec(shape=(None, 4), dtype=tf.float32),
+        tf.TensorSpec(shape=(None, 3), dtype=tf.float32)
+    )
+    if decay is not None:
+        output_signature += (tf.TensorSpec(shape=(None,), dtype=tf.float32),)
+    dataset = tf.data.Dataset.from_generator(
+        lambda: report_batches(filenames, batch_size, shuffle_buffer, shuffle, window, decay),
+        output_signature=output_signature
+    )
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
+
+
+def create_and_train_ann_streaming(train_filenames, test_filenames, model=None, batch_size=1024,
+                                   shuffle_buffer=65536, window=None, decay=None, run=None, resume=False):
+    '''
+    Create a neural network and train it by streaming batches from the report files,
+    validating on the test files, over a training run that stops early and may be resumed.
+    '''
+    if not model:
+        model = create_ann()
+    if not run:
+        run = TrainingRun.TrainingRun()
+    run.fit(
+        model,
+        create_dataset(train_filenames, batch_size, shuffle_buffer, window=window, decay=decay),
+        validation_data=create_dataset(
+            test_filenames, batch_size, shuffle_buffer, shuffle=False, window=window, decay=decay
+        ),
+        callbacks=create_callbacks(),
+        resume=resume
+    )
+
+    return model
 
 
-def time_predict(ann, client_id, server_id, service_target, capability_target):
+def unbinarize(arr):
     '''
-    Find the average time to predict.
+    Convert a binarized array into the respective classes.
     '''
-    predict = Functions.wrap_func(ann.predict, np.array([[client_id, server_id, service_target, capability_target]]))
-    return Functions.time(predict)
+    value = list(arr)
+    return [-1, 0, 1][value.index(max(value))]
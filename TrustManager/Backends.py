@@ -0,0 +1,51 @@
+import sys
+import importlib
+
+'''
+A registry of the predictor backends and graph renderers, each is only imported when
+it is first asked for, so the libraries behind them are not loaded by runs that never
+use them.
+'''
+
+PREDICTORS = {
+    "svm": "TrustManager.SVM",
+    "ann": "TrustManager.ANN",
+    "numpy": "TrustManager.NumpyANN"
+}
+RENDERERS = {
+    "graphviz": "graphviz"
+}
+
+
+def register_predictor(name, module_name):
+    PREDICTORS[name] = module_name
+
+
+def register_renderer(name, module_name):
+    RENDERERS[name] = module_name
+
+
+def get_predictor(name):
+    '''
+    Get the module of a predictor backend, importing it on first use.
+    '''
+    if name not in PREDICTORS:
+        raise KeyError(f"Unknown predictor backend {name}, expected one of {', '.join(PREDICTORS)}")
+    return importlib.import_module(PREDICTORS[name])
+
+
+def get_renderer(name="graphviz"):
+    '''
+    Get the module of a graph renderer, importing it on first use.
+    '''
+    if name not in RENDERERS:
+        raise KeyError(f"Unknown graph renderer {name}, expected one of {', '.join(RENDERERS)}")
+    return importlib.import_module(RENDERERS[name])
+
+
+def is_loaded(name):
+    '''
+    Check whether a predictor backend or graph renderer has been imported yet.
+    '''
+    module_name = PREDICTORS.get(name, RENDERERS.get(name))
+    return module_name in sys.modules
@@ -0,0 +1,107 @@
+import os
+import glob
+import hashlib
+import collections
+
+import numpy as np
+
+'''
+Cache the trust matrices computed by the predictors, for each context of service and
+capability. Entries are kept in a bounded LRU in memory, and optionally on disk, and
+are keyed by the predictor's name and a fingerprint of its file, so retraining a
+predictor invalidates only its own entries.
+'''
+
+
+def fingerprint(filename):
+    '''
+    Get a fingerprint of a file from its path, size and modification time, or None if
+    it does not exist.
+    '''
+    if not os.path.exists(filename):
+        return None
+    stat = os.stat(filename)
+    key = f"{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+class TrustCache:
+    '''
+    LRU cache of trust matrices with an optional on-disk tier.
+    '''
+    def __init__(self, max_entries=128, cache_dir=None):
+        self.__max_entries = max_entries
+        self.__cache_dir = cache_dir
+        self.__entries = collections.OrderedDict()
+
+    def __getstate__(self):
+        return {"max_entries": self.__max_entries, "cache_dir": self.__cache_dir}
+
+    def __setstate__(self, state):
+        self.__max_entries = state["max_entries"]
+        self.__cache_dir = state["cache_dir"]
+        self.__entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __disk_filename(self, key):
+        predictor_name, predictor_fingerprint, no_of_nodes, service_target, capability_target = key
+        return os.path.join(
+            self.__cache_dir,
+            f"{predictor_name}_{predictor_fingerprint}_n{no_of_nodes}_s{service_target}_c{capability_target}.npy"
+        )
+
+    def get(self, key):
+        '''
+        Get the trust matrix for a (predictor name, predictor fingerprint, no. of nodes,
+        service, capability) key, or None on a miss.
+        '''
+        if key[1] is None:
+            return None
+        trust_matrix = self.__entries.get(key)
+        if trust_matrix is not None:
+            self.__entries.move_to_end(key)
+            return trust_matrix
+        if self.__cache_dir:
+            filename = self.__disk_filename(key)
+            if os.path.exists(filename):
+                trust_matrix = np.load(filename, mmap_mode="r")
+                self.__remember(key, trust_matrix)
+        return trust_matrix
+
+    def put(self, key, trust_matrix):
+        '''
+        Store a trust matrix in memory, and on disk when there is a cache directory.
+        '''
+        if key[1] is None:
+            return
+        self.__remember(key, trust_matrix)
+        if self.__cache_dir:
+            if not os.path.exists(self.__cache_dir):
+                os.makedirs(self.__cache_dir)
+            filename = self.__disk_filename(key)
+            with open(f"{filename}.tmp", "wb") as cache_file:
+                np.save(cache_file, trust_matrix)
+            os.replace(f"{filename}.tmp", filename)
+
+    def __remember(self, key, trust_matrix):
+        self.__entries[key] = trust_matrix
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__max_entries:
+            self.__entries.popitem(last=False)
+
+    def clear(self, predictor_name=None, predictor_fingerprint=None):
+        '''
+        Clear the entries of the named predictor in memory, and those on disk that were
+        not made by it with the given fingerprint. The other predictors' entries are kept,
+        unless predictor_name is None, which clears them all.
+        '''
+        for key in [key for key in self.__entries if predictor_name in (None, key[0])]:
+            del self.__entries[key]
+        if self.__cache_dir:
+            prefix = "" if predictor_name is None else f"{glob.escape(predictor_name)}_"
+            for filename in glob.glob(os.path.join(self.__cache_dir, f"{prefix}*.npy")):
+                if predictor_name is None or \
+                        not os.path.basename(filename).startswith(f"{predictor_name}_{predictor_fingerprint}_"):
+                    os.remove(filename)
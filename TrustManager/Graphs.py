@@ -0,0 +1,66 @@
+import os
+import json
+
+import TrustManager.Backends as Backends
+
+'''
+Write the recommendation graphs of clients, as plain DOT or JSON edge lists, or
+rendered through the graphviz binary. The DOT is built directly from a trust row, so
+only rendering needs graphviz.
+'''
+
+FORMATS = ("render", "dot", "json")
+NOTE_COLOURS = {-1: "red", 0: "purple", 1: "blue"}
+
+
+def graph_name(client_id, service_target, capability_target, predictor_name):
+    return f"id{client_id}_s{service_target}_c{capability_target}_{predictor_name}_recommendations"
+
+
+def to_dot(client_id, trust_row, malicious):
+    '''
+    Create the DOT source of a client's recommendations, with the nodes coloured by
+    whether they are malicious and the edges by the note the client gives them.
+    '''
+    lines = ["// Recommendations DiGraph", "digraph {"]
+    lines.extend(
+        f"\t{node_id} [label={node_id} color={'red' if is_malicious else 'blue'} fontcolor=white style=filled]"
+        for node_id, is_malicious in enumerate(malicious)
+    )
+    lines.extend(
+        f"\t{client_id} -> {server_id} [color={NOTE_COLOURS[int(note)]}]"
+        for server_id, note in enumerate(trust_row)
+    )
+    lines.append("}")
+
+    return "\n".join(lines) + "\n"
+
+
+def to_edge_list(client_id, service_target, capability_target, trust_row, malicious):
+    '''
+    Create a JSON-able edge list of a client's recommendations.
+    '''
+    return {
+        "client": int(client_id),
+        "service": int(service_target),
+        "capability": int(capability_target),
+        "malicious": [int(node_id) for node_id, is_malicious in enumerate(malicious) if is_malicious],
+        "edges": [[int(client_id), server_id, int(note)] for server_id, note in enumerate(trust_row)]
+    }
+
+
+def write_graph(directory, name, fmt, client_id, service_target, capability_target, trust_row, malicious):
+    '''
+    Write a recommendation graph in the format, giving the filename written.
+    '''
+    filename = os.path.join(directory, f"{name}.json" if fmt == "json" else f"{name}.gv")
+    if fmt == "json":
+        with open(filename, "w") as graph_file:
+            json.dump(to_edge_list(client_id, service_target, capability_target, trust_row, malicious), graph_file)
+        return filename
+    dot = to_dot(client_id, trust_row, malicious)
+    if fmt == "render":
+        return Backends.get_renderer("graphviz").Source(dot).render(filename, view=False)
+    with open(filename, "w") as graph_file:
+        graph_file.write(dot)
+    return filename
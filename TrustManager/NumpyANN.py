@@ -0,0 +1,170 @@
+import numpy as np
+
+import Functions
+
+'''
+Run the trained neural network with NumPy alone, from an export of its weights, so
+that predicting does not need TensorFlow. The network is a stack of dense layers, so
+a forward pass is a matrix product, bias and activation for each layer.
+'''
+
+NOTES = np.array([-1, 0, 1], dtype=np.int8)
+PREDICT_BATCH_SIZE = 65536
+
+
+def linear(x):
+    return x
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def sigmoid(x):
+    # Large negative inputs overflow the exponential to inf, which still gives 0
+    with np.errstate(over="ignore"):
+        return np.reciprocal(1 + np.exp(-x), out=x)
+
+
+ACTIVATIONS = {
+    "linear": linear,
+    "relu": relu,
+    "sigmoid": sigmoid
+}
+
+
+class NumpyANN:
+    '''
+    A dense network given by the kernel, bias and activation name of each layer, with
+    the same predict as a Keras model.
+    '''
+    def __init__(self, kernels, biases, activations, source_fingerprint=None):
+        for activation in activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unsupported activation {activation}, expected one of {', '.join(ACTIVATIONS)}")
+        self.__layers = [
+            (np.ascontiguousarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32),
+             ACTIVATIONS[activation])
+            for kernel, bias, activation in zip(kernels, biases, activations)
+        ]
+        self.__activations = list(activations)
+        self.__source_fingerprint = source_fingerprint
+
+    def get_layers(self):
+        '''
+        Get the kernel, bias and activation name of each layer.
+        '''
+        return [(kernel, bias, name) for (kernel, bias, _), name in zip(self.__layers, self.__activations)]
+
+    def get_source_fingerprint(self):
+        return self.__source_fingerprint
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        '''
+        Predict the outputs of the network for a matrix of inputs, in batches of
+        batch_size rows.
+        '''
+        inputs = np.asarray(inputs, dtype=np.float32)
+        batch_size = batch_size or PREDICT_BATCH_SIZE
+        if len(inputs) <= batch_size:
+            return self.__forward(inputs)
+        return np.concatenate([
+            self.__forward(inputs[start:start + batch_size]) for start in range(0, len(inputs), batch_size)
+        ])
+
+    def __forward(self, outputs):
+        for kernel, bias, activation in self.__layers:
+            outputs = activation(outputs @ kernel + bias)
+        return outputs
+
+
+def save_model(filename, model):
+    '''
+    Save the layers of a network to a NumPy archive.
+    '''
+    arrays = {}
+    for i, (kernel, bias, _) in enumerate(model.get_layers()):
+        arrays[f"kernel_{i}"] = kernel
+        arrays[f"bias_{i}"] = bias
+    np.savez(
+        filename, activations=np.array([name for *_, name in model.get_layers()]),
+        source_fingerprint=np.array(model.get_source_fingerprint() or ""), **arrays
+    )
+
+
+def load_model(filename):
+    '''
+    Load a network from a NumPy archive.
+    '''
+    with np.load(filename) as archive:
+        activations = [str(name) for name in archive["activations"]]
+        return NumpyANN(
+            [archive[f"kernel_{i}"] for i in range(len(activations))],
+            [archive[f"bias_{i}"] for i in range(len(activations))],
+            activations,
+            str(archive["source_fingerprint"]) or None
+        )
+
+
+def get_source_fingerprint(filename):
+    '''
+    Get the fingerprint of the model that a NumPy archive was exported from.
+    '''
+    with np.load(filename) as archive:
+        return str(archive["source_fingerprint"]) or None
+
+
+def get_trusted_list(ann, client_id, service_target, capability_target, no_of_nodes):
+    '''
+    Get the list of nodes that client trusts for a given target service, and capability.
+    '''
+    trust_row = predict_trust_matrix(ann, [client_id], service_target, capability_target, no_of_nodes)[0]
+
+    return {server_id: int(note) for server_id, note in enumerate(trust_row)}
+
+
+def create_grid(client_ids, server_ids, service_target, capability_target):
+    '''
+    Create the inputs for every pair of client and server, at the target service and capability.
+    '''
+    clients, servers = np.meshgrid(client_ids, server_ids, indexing="ij")
+    grid = np.empty((clients.size, 4), dtype=np.float32)
+    grid[:, 0] = clients.ravel()
+    grid[:, 1] = servers.ravel()
+    grid[:, 2] = service_target
+    grid[:, 3] = capability_target
+
+    return grid
+
+
+def predict_notes(ann, inputs, batch_size=PREDICT_BATCH_SIZE):
+    '''
+    Predict the notes for many inputs, in large batches.
+    '''
+    return decode(ann.predict(inputs, batch_size=batch_size, verbose=0))
+
+
+def predict_trust_matrix(ann, client_ids, service_target, capability_target, no_of_nodes,
+                         batch_size=PREDICT_BATCH_SIZE):
+    '''
+    Predict the notes that each of the clients would give each node, as a matrix with
+    a row for each client.
+    '''
+    grid = create_grid(client_ids, np.arange(no_of_nodes), service_target, capability_target)
+
+    return predict_notes(ann, grid, batch_size).reshape(len(client_ids), no_of_nodes)
+
+
+def decode(predictions):
+    '''
+    Convert binarized predictions into their respective classes.
+    '''
+    return NOTES[np.argmax(predictions, axis=-1)]
+
+
+def time_predict(ann, client_id, server_id, service_target, capability_target):
+    '''
+    Find the average time to predict.
+    '''
+    predict = Functions.wrap_func(ann.predict, np.array([[client_id, server_id, service_target, capability_target]]))
+    return Functions.time(predict)
@@ -0,0 +1,346 @@
+import os
+import json
+import itertools
+
+import numpy as np
+
+import Report
+
+'''
+A binary file format for reports, made of a short header followed by fixed
+width records, so that report files may be written in bulk and memory-mapped.
+Reports may also be split over shard files, listed in order by a JSON manifest
+that stands in for the report file. Each report file has an index of the runs of
+records made by the same reporter, so the reports of a few reporters may be read
+without reading the rest.
+'''
+
+MAGIC = b"TRUSTRPT"
+VERSION = 1
+REPORT_DTYPE = np.dtype([(name, dtype) for name, dtype in Report.REPORT_COLUMNS])
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u4"), ("record_size", "<u4")])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+INDEX_MAGIC = b"TRUSTIDX"
+INDEX_DTYPE = np.dtype([("reporter", "<i4"), ("last_epoch", "<i4"), ("start", "<i8"), ("stop", "<i8")])
+CSV_CHUNK_SIZE = 1_000_000
+MANIFEST_FORMAT = "report_shards"
+
+
+def is_report_file(filename):
+    '''
+    Check whether a file is in the binary report format.
+    '''
+    with open(filename, "rb") as report_file:
+        return report_file.read(len(MAGIC)) == MAGIC
+
+
+def write_header(report_file, magic=MAGIC, dtype=REPORT_DTYPE):
+    '''
+    Write the header of a report file, or of an index file with the index magic and dtype.
+    '''
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = magic
+    header["version"] = VERSION
+    header["record_size"] = dtype.itemsize
+    header.tofile(report_file)
+
+
+def read_header(filename, magic=MAGIC, dtype=REPORT_DTYPE):
+    '''
+    Read and validate the header of a report file, or of an index file with the index
+    magic and dtype.
+    '''
+    header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != magic:
+        raise ValueError(f"{filename} is not a {'report' if magic == MAGIC else 'report index'} file")
+    if header["version"][0] != VERSION or header["record_size"][0] != dtype.itemsize:
+        raise ValueError(f"{filename} has an unsupported report format version {header['version'][0]}")
+    return header[0]
+
+
+def to_records(columns):
+    '''
+    Pack a dict of report columns into an array of report records.
+    '''
+    records = np.zeros(len(columns["reporter"]), dtype=REPORT_DTYPE)
+    for name in REPORT_DTYPE.names:
+        records[name] = columns[name]
+    return records
+
+
+def write_reports(filename, columns):
+    '''
+    Append report columns to a report file in one write, the header is written
+    if the file is new or empty. Reports written to a manifest are appended to its
+    last shard.
+    '''
+    records = columns if isinstance(columns, np.ndarray) else to_records(columns)
+    if os.path.exists(filename) and is_manifest(filename):
+        filename = read_manifest(filename)[-1]
+    with open(filename, "ab") as report_file:
+        if report_file.tell() == 0:
+            write_header(report_file)
+        offset = (report_file.tell() - HEADER_SIZE) // REPORT_DTYPE.itemsize
+        records.tofile(report_file)
+    append_index(filename, records, offset)
+
+
+def index_filename(filename):
+    return f"{filename}.idx"
+
+
+def reporter_runs(records, offset=0):
+    '''
+    Find the runs of records made by the same reporter, as index entries of the reporter,
+    the latest epoch in the run, and the range of records, offset by the records before them.
+    '''
+    reporters = np.asarray(records["reporter"])
+    if len(reporters) == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    starts = np.flatnonzero(reporters[1:] != reporters[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    entries = np.zeros(len(starts), dtype=INDEX_DTYPE)
+    entries["reporter"] = reporters[starts]
+    entries["last_epoch"] = np.maximum.reduceat(np.asarray(records["epoch"]), starts)
+    entries["start"] = starts + offset
+    entries["stop"] = np.append(starts[1:], len(reporters)) + offset
+    return entries
+
+
+def index_coverage(filename):
+    '''
+    Get the number of records of a report file that its index covers, or None if it has
+    no valid index.
+    '''
+    try:
+        read_header(index_filename(filename), INDEX_MAGIC, INDEX_DTYPE)
+    except (OSError, ValueError):
+        return None
+    if os.path.getsize(index_filename(filename)) == HEADER_SIZE:
+        return 0
+    with open(index_filename(filename), "rb") as index_file:
+        index_file.seek(-INDEX_DTYPE.itemsize, os.SEEK_END)
+        return int(np.fromfile(index_file, dtype=INDEX_DTYPE, count=1)["stop"][0])
+
+
+def append_index(filename, records, offset):
+    '''
+    Append the reporter runs of records written at offset to the index of a report file.
+    An index that does not cover the records before them is left to be rebuilt when read.
+    '''
+    if offset == 0:
+        with open(index_filename(filename), "wb") as index_file:
+            write_header(index_file, INDEX_MAGIC, INDEX_DTYPE)
+            reporter_runs(records).tofile(index_file)
+    elif index_coverage(filename) == offset:
+        with open(index_filename(filename), "ab") as index_file:
+            reporter_runs(records, offset).tofile(index_file)
+
+
+def build_index(filename):
+    '''
+    Build the index of a report file from its records, in one pass over the reporter and
+    epoch columns.
+    '''
+    entries = reporter_runs(open_reports(filename))
+    temp_filename = f"{index_filename(filename)}.tmp"
+    with open(temp_filename, "wb") as index_file:
+        write_header(index_file, INDEX_MAGIC, INDEX_DTYPE)
+        entries.tofile(index_file)
+    os.replace(temp_filename, index_filename(filename))
+
+
+def open_index(filename):
+    '''
+    Memory-map the index of a report file, building it first if it is missing or does
+    not cover the whole file.
+    '''
+    no_of_records = (os.path.getsize(filename) - HEADER_SIZE) // REPORT_DTYPE.itemsize
+    if index_coverage(filename) != no_of_records:
+        build_index(filename)
+    if os.path.getsize(index_filename(filename)) == HEADER_SIZE:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(index_filename(filename), dtype=INDEX_DTYPE, mode="r", offset=HEADER_SIZE)
+
+
+def open_reports(filename):
+    '''
+    Memory-map the records of a report file.
+    '''
+    read_header(filename)
+    if os.path.getsize(filename) == HEADER_SIZE:
+        return np.zeros(0, dtype=REPORT_DTYPE)
+    return np.memmap(filename, dtype=REPORT_DTYPE, mode="r", offset=HEADER_SIZE)
+
+
+def shard_filename(filename, shard, no_of_shards):
+    return f"{filename}.shard-{shard:05d}-of-{no_of_shards:05d}"
+
+
+def write_manifest(filename, shard_filenames):
+    '''
+    Write a manifest listing the shard files of reports in order, with their paths
+    relative to the manifest.
+    '''
+    directory = os.path.dirname(os.path.abspath(filename))
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, "w") as manifest_file:
+        json.dump({
+            "format": MANIFEST_FORMAT,
+            "version": VERSION,
+            "shards": [os.path.relpath(os.path.abspath(shard), directory) for shard in shard_filenames]
+        }, manifest_file, indent=2)
+    os.replace(temp_filename, filename)
+
+
+def is_manifest(filename):
+    '''
+    Check whether a file is a manifest of report shards.
+    '''
+    with open(filename, "rb") as manifest_file:
+        if manifest_file.read(1) != b"{":
+            return False
+    with open(filename) as manifest_file:
+        try:
+            return json.load(manifest_file).get("format") == MANIFEST_FORMAT
+        except ValueError:
+            return False
+
+
+def read_manifest(filename):
+    '''
+    Read the filenames of the shards listed in a manifest, in order.
+    '''
+    with open(filename) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest["version"] != VERSION:
+        raise ValueError(f"{filename} has an unsupported manifest version {manifest['version']}")
+    directory = os.path.dirname(os.path.abspath(filename))
+    return [os.path.join(directory, shard) for shard in manifest["shards"]]
+
+
+def read_csv_records(filename, delimiter=","):
+    '''
+    Parse a csv of reports into report records, a chunk of rows at a time. The epoch is
+    taken from a sixth column, when there is one.
+    '''
+    chunks = []
+    with open(filename) as report_csv:
+        while True:
+            lines = list(itertools.islice(report_csv, CSV_CHUNK_SIZE))
+            if not lines:
+                break
+            rows = np.loadtxt(lines, delimiter=delimiter, dtype=np.int64, ndmin=2)
+            chunks.append(to_records({
+                "reporter": rows[:, 0],
+                "target": rows[:, 1],
+                "service": rows[:, 2],
+                "capability": rows[:, 3],
+                "note": rows[:, 4],
+                "epoch": rows[:, 5] if rows.shape[1] > 5 else 0
+            }))
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=REPORT_DTYPE)
+
+
+def cache_filename(filename):
+    return f"{filename}.bin"
+
+
+def convert_csv(filename, delimiter=","):
+    '''
+    Convert a csv of reports into a cached report file, the conversion is only
+    redone when the csv is newer than the cache. Returns the cache's filename.
+    '''
+    cached = cache_filename(filename)
+    if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(filename):
+        return cached
+    records = read_csv_records(filename, delimiter)
+    temp_filename = f"{cached}.tmp"
+    with open(temp_filename, "wb") as report_file:
+        write_header(report_file)
+        records.tofile(report_file)
+    os.replace(temp_filename, cached)
+    build_index(cached)
+    return cached
+
+
+def select_window(reports, window=None, latest_epoch=None):
+    '''
+    Select the reports made within the latest window epochs, all of them if window is
+    None, giving them along with the latest epoch. Reports in time order are selected as
+    a zero-copy slice. The latest epoch may be given, for reports that are one shard of
+    a longer history.
+    '''
+    epochs = reports["epoch"]
+    if len(epochs) == 0:
+        return reports, latest_epoch or 0
+    in_order = bool(np.all(epochs[1:] >= epochs[:-1]))
+    if latest_epoch is None:
+        latest_epoch = int(epochs[-1] if in_order else epochs.max())
+    if window is None:
+        return reports, latest_epoch
+    if in_order:
+        return reports[np.searchsorted(epochs, latest_epoch - window, side="right"):], latest_epoch
+    return reports[epochs > latest_epoch - window], latest_epoch
+
+
+def decay_weights(epochs, decay, latest_epoch):
+    '''
+    Weight reports by their age, with each epoch before the latest multiplying the
+    weight by decay.
+    '''
+    return np.power(np.float32(decay), (latest_epoch - np.asarray(epochs)).astype(np.float32))
+
+
+def select_reporters(filename, reporter_ids, window=None, delimiter=","):
+    '''
+    Load only the records made by the given reporters from a report file, csv or
+    manifest, through the index so the rest of the file is not read. As with
+    select_window, only the reports from the latest window epochs of the whole file
+    are selected if window is given, and the latest epoch is given along with them.
+    '''
+    if is_manifest(filename):
+        filenames = read_manifest(filename)
+    else:
+        filenames = [filename if is_report_file(filename) else convert_csv(filename, delimiter)]
+    indices = [open_index(filename) for filename in filenames]
+    latest_epoch = max((int(index["last_epoch"].max()) for index in indices if len(index)), default=0)
+    reporter_ids = np.asarray(reporter_ids, dtype=np.int64)
+    selected = []
+    for filename, index in zip(filenames, indices):
+        entries = index[np.isin(index["reporter"], reporter_ids)]
+        if window is not None:
+            entries = entries[entries["last_epoch"] > latest_epoch - window]
+        if len(entries) == 0:
+            continue
+        lengths = entries["stop"] - entries["start"]
+        # The position of every record in the runs, without a Python loop over the runs
+        positions = np.repeat(entries["start"] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        selected.append(open_reports(filename)[positions])
+    reports = np.concatenate(selected) if selected else np.zeros(0, dtype=REPORT_DTYPE)
+    if window is not None:
+        reports = reports[reports["epoch"] > latest_epoch - window]
+    return reports, latest_epoch
+
+
+def report_filenames(filename, delimiter=","):
+    '''
+    Get the report files holding the records of a file, the shards of a manifest in
+    order, or else the file itself, converting a csv first.
+    '''
+    if is_manifest(filename):
+        return read_manifest(filename)
+    if not is_report_file(filename):
+        return [convert_csv(filename, delimiter)]
+    return [filename]
+
+
+def load_reports(filename, delimiter=","):
+    '''
+    Load the records of a report file or csv as a memory-mapped array, or the records
+    of the shards of a manifest concatenated in order.
+    '''
+    shards = [open_reports(shard) for shard in report_filenames(filename, delimiter)]
+    if len(shards) == 1:
+        return shards[0]
+    return np.concatenate(shards) if shards else np.zeros(0, dtype=REPORT_DTYPE)
@@ -1,4 +1,7 @@
+import concurrent.futures
+
 import numpy as np
+import scipy.sparse
 from sklearn.svm import SVC
 
 import Functions
@@ -7,14 +10,17 @@ import Functions
 Use a Kernel Machine for the trust management.
 '''
 
+NOTES = np.array([-1, 0, 1], dtype=np.int8)
+
 
-def create_and_fit_svm(train_inputs, train_labels, c_value, gamma):
+def create_and_fit_svm(train_inputs, train_labels, c_value, gamma, sample_weight=None):
     '''
     Create and SVM, fit it to the training data and return it.
     '''
-    svm = SVC(C=c_value, kernel='rbf', gamma=gamma)
+    # A fixed random state keeps fitting from drawing on NumPy's global random state
+    svm = SVC(C=c_value, kernel='rbf', gamma=gamma, random_state=0)
 
-    svm.fit(train_inputs, train_labels)
+    svm.fit(train_inputs, train_labels, sample_weight=sample_weight)
 
     return svm
 
@@ -23,26 +29,255 @@ def find_accuracy(svm, data, labels):
     '''
     Give the accuracy of the svm.
     '''
-    classifications = svm.predict(data)
-    corrects = 0
+    return 100 * np.sum(svm.predict(data) == np.asarray(labels)) / len(labels)
+
+
+def squared_distances(inputs, others):
+    '''
+    Find the squared euclidean distance between each of the inputs and each of the others.
+    '''
+    inputs = np.asarray(inputs, dtype=np.float64)
+    others = np.asarray(others, dtype=np.float64)
+    sq_dists = np.einsum("ij,ij->i", inputs, inputs)[:, np.newaxis] + \
+        np.einsum("ij,ij->i", others, others)[np.newaxis, :] - 2 * inputs @ others.T
+
+    return np.maximum(sq_dists, 0, out=sq_dists)
+
+
+def merge_duplicates(inputs, labels, weights=None):
+    '''
+    Merge repeated pairs of input and label, giving the unique inputs, their labels and
+    counts, or the sums of their weights when given.
+    '''
+    rows = np.column_stack((inputs, labels))
+    unique_rows, inverse, counts = np.unique(rows, axis=0, return_inverse=True, return_counts=True)
+    if weights is not None:
+        counts = np.bincount(inverse.ravel(), weights=weights, minlength=len(unique_rows))
+
+    return unique_rows[:, :-1], unique_rows[:, -1], counts
+
+
+def create_fitness(train_inputs, train_labels, test_inputs, test_labels, train_weights=None, test_weights=None):
+    '''
+    Create a function giving the test accuracy of an RBF SVM with a genome's C and gamma.
+    Repeated reports are merged into weighted samples, the squared distances are found
+    once so that each genome only needs its Gram matrices, exp(-gamma * D), to fit and
+    predict with a precomputed kernel, and the accuracy of each genome is memoized.
+    Optional sample weights scale the reports in fitting and in the accuracy.
+    '''
+    train_inputs, train_labels, train_counts = merge_duplicates(train_inputs, train_labels, train_weights)
+    test_inputs, test_labels, test_counts = merge_duplicates(test_inputs, test_labels, test_weights)
+    train_sq_dists = squared_distances(train_inputs, train_inputs)
+    test_sq_dists = squared_distances(test_inputs, train_inputs)
+    accuracies = dict()
 
-    for i_classification in enumerate(classifications):
-        if i_classification[1] == labels[i_classification[0]]:
-            corrects += 1
+    def fitness(genome):
+        key = tuple(genome)
+        if key not in accuracies:
+            c_value, gamma = genome
+            svm = SVC(C=c_value, kernel='precomputed', random_state=0)
+            svm.fit(np.exp(-gamma * train_sq_dists), train_labels, sample_weight=train_counts)
+            corrects = svm.predict(np.exp(-gamma * test_sq_dists)) == test_labels
+            accuracies[key] = 100 * np.sum(test_counts[corrects]) / np.sum(test_counts)
+        return accuracies[key]
 
-    return 100 * corrects / len(labels)
+    return fitness
 
 
 def get_trusted_list(svm, service_target, capability_target, no_of_nodes):
     '''
     Get the list of nodes that client trusts for a given target service, and capability.
     '''
-    trusted_list = dict()
+    trust_row = predict_servers(svm, service_target, capability_target, no_of_nodes)
+
+    return {server_id: int(note) for server_id, note in enumerate(trust_row)}
+
+
+def create_inputs(service_target, capability_target, no_of_nodes):
+    '''
+    Create the inputs for every server, at the target service and capability.
+    '''
+    inputs = np.empty((no_of_nodes, 3))
+    inputs[:, 0] = np.arange(no_of_nodes)
+    inputs[:, 1] = service_target
+    inputs[:, 2] = capability_target
+
+    return inputs
+
+
+def predict_servers(svm, service_target, capability_target, no_of_nodes):
+    '''
+    Predict the notes for every server with a single call to the svm.
+    '''
+    return svm.predict(create_inputs(service_target, capability_target, no_of_nodes)).astype(np.int8)
+
+
+def fuse_svms(svms):
+    '''
+    Stack the support vectors, dual coefficients and intercepts of RBF SVMs, so that
+    their one-vs-one decision functions may be evaluated together.
+    '''
+    support_vectors = []
+    gammas = []
+    coef_rows, coef_cols, coef_values = [], [], []
+    intercepts, pair_svms, pair_firsts, pair_seconds = [], [], [], []
+    sv_offset = 0
 
-    for i in range(no_of_nodes):
-        trusted_list[i] = int(svm.predict([[i, service_target, capability_target]])[0])
+    for svm_index, svm in enumerate(svms):
+        classes = np.searchsorted(NOTES, svm.classes_)
+        dual_coef = svm.dual_coef_
+        intercept = svm.intercept_
+        if len(classes) == 2:  # scikit-learn flips the signs for binary problems
+            dual_coef = -dual_coef
+            intercept = -intercept
+        class_starts = np.concatenate(([0], np.cumsum(svm.n_support_))) + sv_offset
+        local_pair = 0
+        for i in range(len(classes)):
+            for j in range(i + 1, len(classes)):
+                # The SVs of class i weigh in with row j - 1 of the dual coefficients and those of class j with row i
+                for sv_class, coef_row in [(i, j - 1), (j, i)]:
+                    sv_ids = np.arange(class_starts[sv_class], class_starts[sv_class + 1])
+                    coef_rows.append(np.full(len(sv_ids), len(intercepts)))
+                    coef_cols.append(sv_ids)
+                    coef_values.append(dual_coef[coef_row, sv_ids - sv_offset])
+                intercepts.append(intercept[local_pair])
+                pair_svms.append(svm_index)
+                pair_firsts.append(classes[i])
+                pair_seconds.append(classes[j])
+                local_pair += 1
+        support_vectors.append(svm.support_vectors_)
+        gammas.append(np.full(len(svm.support_vectors_), svm._gamma))
+        sv_offset += len(svm.support_vectors_)
+
+    support_vectors = np.concatenate(support_vectors)
+    coefs = scipy.sparse.csr_matrix(
+        (np.concatenate(coef_values), (np.concatenate(coef_rows), np.concatenate(coef_cols))),
+        shape=(len(intercepts), sv_offset)
+    )
+    return {
+        "support_vectors": support_vectors,
+        "sv_sq_norms": np.einsum("ij,ij->i", support_vectors, support_vectors),
+        "gammas": np.concatenate(gammas),
+        "coefs": coefs,
+        "intercepts": np.array(intercepts),
+        "pair_svms": np.array(pair_svms),
+        "pair_firsts": np.array(pair_firsts),
+        "pair_seconds": np.array(pair_seconds),
+        "pair_gammas": np.array([svms[svm_index]._gamma for svm_index in pair_svms]),
+        "no_of_svms": len(svms)
+    }
+
+
+def predict_fused(fused, inputs):
+    '''
+    Predict the notes of each of the fused SVMs for each of the inputs, returns a
+    matrix with a row for each SVM.
+    '''
+    inputs = np.asarray(inputs, dtype=np.float64)
+    sq_dists = fused["sv_sq_norms"][:, np.newaxis] + np.einsum("ij,ij->i", inputs, inputs)[np.newaxis, :] \
+        - 2 * fused["support_vectors"] @ inputs.T
+    np.maximum(sq_dists, 0, out=sq_dists)
+    kernel = np.exp(-fused["gammas"][:, np.newaxis] * sq_dists, out=sq_dists)
+    decisions = fused["coefs"] @ kernel + fused["intercepts"][:, np.newaxis]
+
+    return vote(fused, decisions)
+
+
+def predict_fused_context(fused, service_target, capability_target, no_of_nodes):
+    '''
+    Predict the notes of each of the fused SVMs for every server at the target service
+    and capability. The RBF kernel of a support vector factors into a term for the context
+    and a term for the distance between server ids, so the coefficients are first summed by
+    the server of their support vector, then spread over the servers within kernel range.
+    '''
+    support_vectors = fused["support_vectors"]
+    sv_servers = support_vectors[:, 0].astype(np.int64)
+    if np.any(sv_servers != support_vectors[:, 0]) or np.any(sv_servers < 0):
+        return predict_fused(fused, create_inputs(service_target, capability_target, no_of_nodes))
+
+    no_of_servers = max(no_of_nodes, int(sv_servers.max()) + 1)
+    context_sq_dists = (support_vectors[:, 1] - service_target)**2 + (support_vectors[:, 2] - capability_target)**2
+    context_kernel = np.exp(-fused["gammas"] * context_sq_dists)
+    by_server = scipy.sparse.csr_matrix(
+        (context_kernel, (np.arange(len(sv_servers)), sv_servers)), shape=(len(sv_servers), no_of_servers)
+    )
+    server_weights = (fused["coefs"] @ by_server).toarray()
+
+    # exp(-x) is exactly 0 in double precision past x = 746, so further servers do not contribute
+    pair_gammas = fused["pair_gammas"]
+    kernel_range = min(no_of_servers - 1, int(np.ceil(np.sqrt(746 / pair_gammas.min()))))
+    decisions = np.repeat(fused["intercepts"][:, np.newaxis], no_of_nodes, axis=1)
+    for offset in range(-kernel_range, kernel_range + 1):
+        start, stop = max(0, -offset), min(no_of_nodes, no_of_servers - offset)
+        if start < stop:
+            decisions[:, start:stop] += np.exp(-pair_gammas * offset**2)[:, np.newaxis] * \
+                server_weights[:, start + offset:stop + offset]
+
+    return vote(fused, decisions)
 
-    return trusted_list
+
+def vote(fused, decisions):
+    '''
+    Find the class each fused SVM votes for, from the one-vs-one decision values.
+    '''
+    no_of_inputs = decisions.shape[1]
+    winners = np.where(decisions > 0, fused["pair_firsts"][:, np.newaxis], fused["pair_seconds"][:, np.newaxis])
+    # Count the one-vs-one votes, ties go to the lowest class as in libsvm
+    vote_ids = (fused["pair_svms"][:, np.newaxis] * len(NOTES) + winners) * no_of_inputs + np.arange(no_of_inputs)
+    votes = np.bincount(vote_ids.ravel(), minlength=fused["no_of_svms"] * len(NOTES) * no_of_inputs)
+    votes = votes.reshape(fused["no_of_svms"], len(NOTES), no_of_inputs)
+
+    return NOTES[np.argmax(votes, axis=1)]
+
+
+class FusedSVMs:
+    '''
+    Evaluate a bank of per-reporter RBF SVMs together, the SVMs are fused in chunks of
+    about chunk_size support vectors which may be evaluated across a thread pool.
+    '''
+    def __init__(self, svms, workers=1, chunk_size=20_000):
+        self.__client_ids = sorted(svms.keys())
+        self.__workers = workers
+        self.__chunks = []
+        chunk = []
+        chunk_svs = 0
+        for client_id in self.__client_ids:
+            if chunk and chunk_svs + len(svms[client_id].support_vectors_) > chunk_size:
+                self.__chunks.append(fuse_svms(chunk))
+                chunk = []
+                chunk_svs = 0
+            chunk.append(svms[client_id])
+            chunk_svs += len(svms[client_id].support_vectors_)
+        if chunk:
+            self.__chunks.append(fuse_svms(chunk))
+
+    def get_client_ids(self):
+        return self.__client_ids
+
+    def predict(self, inputs, workers=None):
+        '''
+        Predict the notes of every SVM for each of the inputs, as a matrix with a row
+        for each client in the order of get_client_ids. The chunks are evaluated across
+        workers threads, by default the number the SVMs were fused with.
+        '''
+        return self.__map_chunks(lambda fused: predict_fused(fused, inputs), workers)
+
+    def trust_matrix(self, service_target, capability_target, no_of_nodes, workers=None):
+        '''
+        Get the notes that every client predicts for every server at the target service and capability.
+        '''
+        return self.__map_chunks(
+            lambda fused: predict_fused_context(fused, service_target, capability_target, no_of_nodes), workers
+        )
+
+    def __map_chunks(self, predict, workers=None):
+        workers = workers or self.__workers
+        if workers > 1 and len(self.__chunks) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                predictions = list(executor.map(predict, self.__chunks))
+        else:
+            predictions = [predict(fused) for fused in self.__chunks]
+        return np.concatenate(predictions)
 
 
 def time_predict(svm, node_id, service_target, capability_target):
@@ -53,68 +288,72 @@ def time_predict(svm, node_id, service_target, capability_target):
     return Functions.time(predict)
 
 
-def evolve(train_inputs, train_labels, test_inputs, test_labels):
+def evolve(train_inputs, train_labels, test_inputs, test_labels, seed=None, train_weights=None, test_weights=None):
     '''
-    Perform an evolutionary algorithm to optimize SVM parameters.
+    Perform an evolutionary algorithm to optimize SVM parameters, seed is an optional
+    numpy SeedSequence for a random generator of the evolution's own, and the weights
+    are optional sample weights of the reports.
     '''
+    rng = np.random.default_rng(seed) if seed is not None else None
     genome = hill_climb(
-        train_inputs, train_labels, test_inputs, test_labels
+        train_inputs, train_labels, test_inputs, test_labels, train_weights=train_weights, test_weights=test_weights,
+        rng=rng
     )
-    return create_and_fit_svm(train_inputs, train_labels, genome[0], genome[1])
+    return create_and_fit_svm(train_inputs, train_labels, genome[0], genome[1], train_weights)
 
 
-def normalise_genome(genome):
+def normalise_genome(genome, rng=None):
     '''
     Make sure the genome does not have invalid input.
     '''
+    rng = np.random if rng is None else rng
     for index_gene in enumerate(genome):
         while genome[index_gene[0]] <= 0:
-            genome[index_gene[0]] = float(np.random.normal(10, 8, 1))
+            genome[index_gene[0]] = float(rng.normal(10, 8))
 
 
-def generate_genome():
+def generate_genome(rng=None):
     '''
     Generate a random starting genome.
     '''
-    return [float(np.random.normal(50, 2)), float(np.random.normal(1, 0.5))]
+    rng = np.random if rng is None else rng
+    return [float(rng.normal(50, 2)), float(rng.normal(1, 0.5))]
 
 
-def mutate_genome(genome):
+def mutate_genome(genome, rng=None):
     '''
     Take a genome and mutate it, return the mutant.
     '''
-    step_size = 0.1 * np.random.normal(0, 5)
+    rng = np.random if rng is None else rng
+    step_size = 0.1 * rng.normal(0, 5)
     mutant_genome = genome.copy()
 
-    if np.random.normal() < 0:
-        step_size = 3 * np.random.normal(0, 5)
+    if rng.normal() < 0:
+        step_size = 3 * rng.normal(0, 5)
 
     for index_mutant_genome in enumerate(mutant_genome):
-        mutant_genome[index_mutant_genome[0]] += float(step_size * np.random.normal(0, 1))
+        mutant_genome[index_mutant_genome[0]] += float(step_size * rng.normal(0, 1))
 
     return mutant_genome
 
 
-def hill_climb(train_inputs, train_labels, test_inputs, test_labels, acc_goal=99):
+def hill_climb(train_inputs, train_labels, test_inputs, test_labels, acc_goal=99, train_weights=None,
+               test_weights=None, rng=None):
     '''
-    Evolutionary algorithm to find the optimal parameters for the SVM.
+    Evolutionary algorithm to find the optimal parameters for the SVM, drawing from the
+    random generator rng, or NumPy's global random state if it is None.
     '''
     counter = 0
     n_epochs = 10_000
-    genome = generate_genome()
-    normalise_genome(genome)
-    svm_champ = create_and_fit_svm(
-        train_inputs, train_labels, genome[0], genome[1]
-    )
-    acc_champ = find_accuracy(svm_champ, test_inputs, test_labels)
+    fitness = create_fitness(train_inputs, train_labels, test_inputs, test_labels, train_weights, test_weights)
+    genome = generate_genome(rng)
+    normalise_genome(genome, rng)
+    acc_champ = fitness(genome)
 
     while (acc_champ < acc_goal) and (counter < n_epochs):
-        mutant_genome = mutate_genome(genome)
-        normalise_genome(mutant_genome)
-        svm_mutant = create_and_fit_svm(
-            train_inputs, train_labels, mutant_genome[0], mutant_genome[1]
-        )
-        acc_mutant = find_accuracy(svm_mutant, test_inputs, test_labels)
+        mutant_genome = mutate_genome(genome, rng)
+        normalise_genome(mutant_genome, rng)
+        acc_mutant = fitness(mutant_genome)
 
         if acc_mutant > acc_champ:
             genome = mutant_genome
@@ -0,0 +1,87 @@
+import os
+import json
+import shutil
+import weakref
+
+import numpy as np
+
+'''
+A versioned on-disk format for the state of a trust manager, made of a JSON file of
+metadata and a .npy file for each array, so that loading memory-maps the arrays
+instead of unpickling an object per node and report.
+'''
+
+FORMAT = "trust_manager"
+VERSION = 1
+META_FILENAME = "meta.json"
+# The arrays memory-mapped by load_state, by filename, so saving over them can tell which are unchanged
+MAPPED_ARRAYS = weakref.WeakValueDictionary()
+
+
+def save_state(directory, meta, arrays):
+    '''
+    Save the metadata and arrays of a state to a directory. The state is written to a
+    temporary directory which is then swapped in, so a state that is memory-mapped
+    from the directory may be saved over. Arrays that are the whole of a read-only map of
+    the state being replaced are unchanged, so their files are hard linked instead of
+    written again.
+    '''
+    temp_directory = f"{directory}.tmp"
+    if os.path.exists(temp_directory):
+        shutil.rmtree(temp_directory)
+    os.makedirs(temp_directory)
+    for name, array in arrays.items():
+        filename = os.path.join(temp_directory, f"{name}.npy")
+        old_filename = os.path.join(directory, f"{name}.npy")
+        if is_mapped_from(array, old_filename):
+            try:
+                os.link(old_filename, filename)
+                continue
+            except OSError:
+                pass
+        np.save(filename, np.ascontiguousarray(array))
+    with open(os.path.join(temp_directory, META_FILENAME), "w") as meta_file:
+        json.dump(dict(meta, format=FORMAT, version=VERSION, arrays=sorted(arrays)), meta_file, indent=2)
+
+    old_directory = f"{directory}.old"
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(temp_directory, directory)
+    if os.path.exists(old_directory):
+        shutil.rmtree(old_directory)
+
+
+def is_mapped_from(array, filename):
+    '''
+    Check whether an array is the whole of the read-only memory-map that load_state made
+    of an array file.
+    '''
+    mapped = MAPPED_ARRAYS.get(os.path.abspath(filename))
+    return (
+        mapped is not None and mapped.mode == "r" and array.dtype == mapped.dtype and array.shape == mapped.shape
+        and array.strides == mapped.strides
+        and array.__array_interface__["data"][0] == mapped.__array_interface__["data"][0]
+    )
+
+
+def is_state(directory):
+    return os.path.exists(os.path.join(directory, META_FILENAME))
+
+
+def load_state(directory, mmap_mode="r"):
+    '''
+    Load the metadata and memory-mapped arrays of a state from a directory.
+    '''
+    with open(os.path.join(directory, META_FILENAME)) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get("format") != FORMAT:
+        raise ValueError(f"{directory} does not hold a trust manager state")
+    if meta["version"] != VERSION:
+        raise ValueError(f"{directory} has an unsupported state version {meta['version']}")
+    arrays = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in meta["arrays"]
+    }
+    for name, array in arrays.items():
+        if isinstance(array, np.memmap):
+            MAPPED_ARRAYS[os.path.abspath(os.path.join(directory, f"{name}.npy"))] = array
+    return meta, arrays
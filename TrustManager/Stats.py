@@ -0,0 +1,131 @@
+import json
+import time
+import threading
+import contextlib
+import collections
+
+'''
+Counters and cumulative timers for the hot paths of the trust manager, cheap
+enough to leave on, with snapshots that may be dumped periodically as JSON lines.
+'''
+
+DISABLED_TIMER = contextlib.nullcontext()
+
+
+class Timer:
+    '''
+    Context manager which adds its elapsed time to a timer of the stats.
+    '''
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    '''
+    Thread safe named counters and timers, which may be switched off to make
+    recording a no-op.
+    '''
+    def __init__(self, enabled=True):
+        self.__enabled = enabled
+        self.__lock = threading.Lock()
+        self.__counters = collections.defaultdict(int)
+        self.__timers = collections.defaultdict(lambda: [0.0, 0])
+        self.__started = time.time()
+        self.__dump_thread = None
+        self.__dump_stop = None
+
+    def __getstate__(self):
+        return {"enabled": self.__enabled}
+
+    def __setstate__(self, state):
+        self.__init__(state["enabled"])
+
+    def is_enabled(self):
+        return self.__enabled
+
+    def set_enabled(self, enabled):
+        self.__enabled = enabled
+
+    def count(self, name, amount=1):
+        '''
+        Add an amount to a counter.
+        '''
+        if self.__enabled:
+            with self.__lock:
+                self.__counters[name] += amount
+
+    def add_time(self, name, seconds):
+        '''
+        Add a call taking some seconds to a timer.
+        '''
+        if self.__enabled:
+            with self.__lock:
+                timer = self.__timers[name]
+                timer[0] += seconds
+                timer[1] += 1
+
+    def timer(self, name):
+        '''
+        Get a context manager that times its block into the named timer.
+        '''
+        return Timer(self, name) if self.__enabled else DISABLED_TIMER
+
+    def snapshot(self):
+        '''
+        Get a copy of the counters and timers, along with the time it was taken and the
+        time since the stats were started or reset.
+        '''
+        with self.__lock:
+            now = time.time()
+            return {
+                "time": now,
+                "uptime": now - self.__started,
+                "counters": dict(self.__counters),
+                "timers": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in self.__timers.items()}
+            }
+
+    def reset(self):
+        with self.__lock:
+            self.__counters.clear()
+            self.__timers.clear()
+            self.__started = time.time()
+
+    def dump(self, filename):
+        '''
+        Append a snapshot to a JSON lines file.
+        '''
+        with open(filename, "a") as dump_file:
+            dump_file.write(json.dumps(self.snapshot()) + "\n")
+
+    def start_dump(self, filename, interval=60.0):
+        '''
+        Dump a snapshot every interval seconds from a background thread, until stopped.
+        '''
+        self.stop_dump()
+        self.__dump_stop = threading.Event()
+
+        def dump_periodically(stop):
+            while not stop.wait(interval):
+                self.dump(filename)
+
+        self.__dump_thread = threading.Thread(target=dump_periodically, args=(self.__dump_stop,), daemon=True)
+        self.__dump_thread.start()
+
+    def stop_dump(self):
+        if self.__dump_thread:
+            self.__dump_stop.set()
+            self.__dump_thread.join()
+            self.__dump_thread = None
+            self.__dump_stop = None
@@ -0,0 +1,77 @@
+import numpy as np
+
+'''
+Interaction graphs for bootstrapping a network sparsely, given as arrays of the
+reporter and target ids of each directed interaction, so that the cost grows with the
+number of interactions rather than the square of the number of nodes.
+'''
+
+
+def skip_self(reporters, choices):
+    '''
+    Map choices in [0, no_of_nodes - 1) to node ids other than the reporters.
+    '''
+    return choices + (choices >= reporters)
+
+
+def random_partners(no_of_nodes, partners, rng=None):
+    '''
+    Pick a number of distinct partners at random for each node, drawing from the global
+    random state or from the numpy Generator rng if given.
+    '''
+    partners = min(partners, no_of_nodes - 1)
+    reporters = np.repeat(np.arange(no_of_nodes, dtype=np.int32), partners).reshape(no_of_nodes, partners)
+    if rng is None:
+        choices = np.random.randint(0, no_of_nodes - 1, size=(no_of_nodes, partners), dtype=np.int32)
+    else:
+        choices = rng.integers(0, no_of_nodes - 1, size=(no_of_nodes, partners), dtype=np.int32)
+    sorted_choices = np.sort(choices, axis=1)
+    repeated_rows = np.flatnonzero((sorted_choices[:, 1:] == sorted_choices[:, :-1]).any(axis=1))
+    if len(repeated_rows):
+        # Redraw the few nodes that picked a partner twice, without replacement
+        shape = (len(repeated_rows), no_of_nodes - 1)
+        choices[repeated_rows] = np.argsort(
+            np.random.rand(*shape) if rng is None else rng.random(shape), axis=1
+        )[:, :partners]
+    targets = skip_self(reporters, choices)
+
+    return reporters.ravel(), targets.ravel()
+
+
+def random_regular(no_of_nodes, degree):
+    '''
+    Create a random regular digraph, where every node reports on degree nodes and is
+    reported on by degree nodes. It is a circulant graph over distinct random offsets,
+    with the nodes randomly relabelled.
+    '''
+    degree = min(degree, no_of_nodes - 1)
+    offsets = np.random.choice(np.arange(1, no_of_nodes), degree, replace=False)
+    labels = np.random.permutation(no_of_nodes).astype(np.int32)
+    positions = np.repeat(np.arange(no_of_nodes), degree)
+
+    return labels[positions], labels[(positions + np.tile(offsets, no_of_nodes)) % no_of_nodes]
+
+
+def small_world(no_of_nodes, degree, rewire=0.1):
+    '''
+    Create a Watts-Strogatz small world digraph, a ring where every node reports on its
+    degree nearest neighbours, with each interaction rewired to a random target with
+    probability rewire. Interactions that are rewired onto another are dropped.
+    '''
+    half_degree = max(1, min(degree, no_of_nodes - 1) // 2)
+    offsets = np.concatenate((np.arange(1, half_degree + 1), -np.arange(1, half_degree + 1)))
+    reporters = np.repeat(np.arange(no_of_nodes, dtype=np.int32), len(offsets))
+    targets = ((reporters + np.tile(offsets, no_of_nodes)) % no_of_nodes).astype(np.int32)
+    rewired = np.random.rand(len(targets)) < rewire
+    targets[rewired] = skip_self(
+        reporters[rewired], np.random.randint(0, no_of_nodes - 1, np.count_nonzero(rewired), dtype=np.int32)
+    )
+    _, unique_indices = np.unique(reporters.astype(np.int64) * no_of_nodes + targets, return_index=True)
+
+    return reporters[unique_indices], targets[unique_indices]
+
+
+TOPOLOGIES = {
+    "regular": random_regular,
+    "small-world": small_world
+}
@@ -0,0 +1,217 @@
+import os
+import glob
+import concurrent.futures
+
+import numpy as np
+from tensorflow import keras
+
+'''
+Manage the training runs of the neural network, stopping once the validation loss
+stops improving, keeping only the best few checkpoints, and resuming a run at the
+exact epoch and optimizer state it was checkpointed at.
+'''
+
+LAST_CHECKPOINT = "last.npz"
+
+
+def get_state(model):
+    '''
+    Get copies of the weights and optimizer variables of a model.
+    '''
+    return [np.array(weight) for weight in model.get_weights()], \
+        [np.array(variable) for variable in model.optimizer.variables]
+
+
+def set_state(model, weights, optimizer_variables):
+    '''
+    Set the weights and optimizer variables of a model.
+    '''
+    model.set_weights(weights)
+    if not model.optimizer.built:
+        model.optimizer.build(model.trainable_variables)
+    for variable, value in zip(model.optimizer.variables, optimizer_variables):
+        variable.assign(value)
+
+
+def write_checkpoint(filename, epoch, loss, best_loss, wait, weights, optimizer_variables):
+    '''
+    Write a checkpoint of a training run, through a temporary file so that it is never
+    seen half written.
+    '''
+    arrays = {f"weight_{i}": weight for i, weight in enumerate(weights)}
+    arrays.update({f"optimizer_{i}": variable for i, variable in enumerate(optimizer_variables)})
+    temp_filename = f"{filename}.tmp.npz"
+    np.savez(
+        temp_filename, epoch=epoch, loss=loss, best_loss=best_loss, wait=wait,
+        no_of_weights=len(weights), no_of_optimizer_variables=len(optimizer_variables), **arrays
+    )
+    os.replace(temp_filename, filename)
+
+
+def read_checkpoint(filename):
+    '''
+    Read a checkpoint of a training run, as a dict of its epoch, losses, wait, weights
+    and optimizer variables.
+    '''
+    with np.load(filename) as checkpoint:
+        return {
+            "epoch": int(checkpoint["epoch"]),
+            "loss": float(checkpoint["loss"]),
+            "best_loss": float(checkpoint["best_loss"]),
+            "wait": int(checkpoint["wait"]),
+            "weights": [checkpoint[f"weight_{i}"] for i in range(int(checkpoint["no_of_weights"]))],
+            "optimizer_variables": [
+                checkpoint[f"optimizer_{i}"] for i in range(int(checkpoint["no_of_optimizer_variables"]))
+            ]
+        }
+
+
+class TrainingRun(keras.callbacks.Callback):
+    '''
+    A training run of the neural network in run_dir. After each epoch the validation loss
+    is checked for an improvement of at least min_delta, the run stops after patience
+    epochs without one and the model is left with its best weights. The best keep_best
+    epochs are checkpointed, along with the latest epoch every checkpoint_every epochs,
+    with the writes done on a background thread.
+    '''
+    def __init__(self, run_dir="data/ANN", max_epochs=500, patience=10, min_delta=1e-4, keep_best=3,
+                 checkpoint_every=1, monitor="val_loss"):
+        super().__init__()
+        self.__run_dir = run_dir
+        self.__max_epochs = max_epochs
+        self.__patience = patience
+        self.__min_delta = min_delta
+        self.__keep_best = keep_best
+        self.__checkpoint_every = checkpoint_every
+        self.__monitor = monitor
+        self.__best_loss = np.inf
+        self.__best_weights = None
+        self.__wait = 0
+        self.__stopped_epoch = None
+        self.__best_checkpoints = []
+        self.__writer = None
+        self.__writes = []
+
+    def get_run_dir(self):
+        return self.__run_dir
+
+    def get_best_loss(self):
+        return self.__best_loss
+
+    def get_stopped_epoch(self):
+        return self.__stopped_epoch
+
+    def get_last_checkpoint(self):
+        filename = os.path.join(self.__run_dir, LAST_CHECKPOINT)
+        return filename if os.path.exists(filename) else None
+
+    def get_best_checkpoints(self):
+        '''
+        Get the filenames of the best checkpoints, from best to worst.
+        '''
+        return [filename for _, filename in sorted(self.__best_checkpoints)]
+
+    def __find_best_checkpoints(self):
+        self.__best_checkpoints = []
+        for filename in glob.glob(os.path.join(self.__run_dir, "best-*.npz")):
+            with np.load(filename) as checkpoint:
+                self.__best_checkpoints.append((float(checkpoint["loss"]), filename))
+
+    def clear(self):
+        '''
+        Remove the checkpoints of the run and reset its early stopping state.
+        '''
+        for filename in glob.glob(os.path.join(self.__run_dir, "*.npz")):
+            os.remove(filename)
+        self.__best_checkpoints = []
+        self.__best_loss = np.inf
+        self.__best_weights = None
+        self.__wait = 0
+
+    def resume(self, model):
+        '''
+        Restore the model, optimizer and early stopping state from the last checkpoint of
+        the run, and give the epoch to continue from, 0 when there is no checkpoint.
+        '''
+        self.__find_best_checkpoints()
+        filename = self.get_last_checkpoint()
+        if filename is None:
+            return 0
+        checkpoint = read_checkpoint(filename)
+        set_state(model, checkpoint["weights"], checkpoint["optimizer_variables"])
+        self.__best_loss = checkpoint["best_loss"]
+        self.__wait = checkpoint["wait"]
+        if self.__best_checkpoints:
+            self.__best_weights = read_checkpoint(self.get_best_checkpoints()[0])["weights"]
+        return checkpoint["epoch"]
+
+    def fit(self, model, *args, resume=False, callbacks=(), **kwargs):
+        '''
+        Fit the model over the run, continuing from its last checkpoint if resume is set,
+        otherwise starting afresh. The arguments are passed on to model.fit.
+        '''
+        if resume:
+            initial_epoch = self.resume(model)
+        else:
+            self.clear()
+            initial_epoch = 0
+        if initial_epoch < self.__max_epochs and self.__wait < self.__patience:
+            model.fit(
+                *args, epochs=self.__max_epochs, initial_epoch=initial_epoch, callbacks=[self, *callbacks], **kwargs
+            )
+        elif self.__best_weights is not None:
+            model.set_weights(self.__best_weights)
+        return model
+
+    def on_train_begin(self, logs=None):
+        if not os.path.exists(self.__run_dir):
+            os.makedirs(self.__run_dir)
+        self.__stopped_epoch = None
+        self.__writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__writes = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        loss = float(logs.get(self.__monitor, logs.get("loss", np.inf)))
+        improved = loss < self.__best_loss - self.__min_delta
+        if improved:
+            self.__best_loss = loss
+            self.__wait = 0
+        else:
+            self.__wait += 1
+        completed_epochs = epoch + 1
+        is_best = self.__keep_best > 0 and (
+            len(self.__best_checkpoints) < self.__keep_best or loss < max(self.__best_checkpoints)[0]
+        )
+        save_last = completed_epochs % self.__checkpoint_every == 0 or self.__wait >= self.__patience
+        if improved or is_best or save_last:
+            # Copy the state on the training thread, so only the writes are in the background
+            weights, optimizer_variables = get_state(self.model)
+            if improved:
+                self.__best_weights = weights
+            if is_best:
+                filename = os.path.join(self.__run_dir, f"best-{completed_epochs:04d}.npz")
+                self.__submit(write_checkpoint, filename, completed_epochs, loss, self.__best_loss, self.__wait,
+                              weights, optimizer_variables)
+                self.__best_checkpoints.append((loss, filename))
+                while len(self.__best_checkpoints) > self.__keep_best:
+                    worst = max(self.__best_checkpoints)
+                    self.__best_checkpoints.remove(worst)
+                    self.__submit(os.remove, worst[1])
+            if save_last:
+                self.__submit(write_checkpoint, os.path.join(self.__run_dir, LAST_CHECKPOINT), completed_epochs,
+                              loss, self.__best_loss, self.__wait, weights, optimizer_variables)
+        if self.__wait >= self.__patience:
+            self.__stopped_epoch = completed_epochs
+            self.model.stop_training = True
+
+    def __submit(self, func, *args):
+        self.__writes.append(self.__writer.submit(func, *args))
+
+    def on_train_end(self, logs=None):
+        if self.__best_weights is not None:
+            self.model.set_weights(self.__best_weights)
+        self.__writer.shutdown(wait=True)
+        for write in self.__writes:
+            write.result()
+        self.__writes = []
@@ -1,19 +1,33 @@
 import os
-import csv
+import glob
+import json
+import pickle
+import functools
+import concurrent.futures
 
 import numpy as np
 import joblib
-import graphviz
-from tensorflow import keras
 
 import Functions
 import Node
 import BadMouther
-import TrustManager.SVM as SVM
-import TrustManager.ANN as ANN
+import Report
+import TrustManager.Backends as Backends
+import TrustManager.ReportFile as ReportFile
+import TrustManager.Cache as Cache
+import TrustManager.Stats as Stats
+import TrustManager.State as State
+import TrustManager.Topology as Topology
+import TrustManager.Graphs as Graphs
 
 CAP_MAX = 10
 SERVICE_MAX = 6
+# The number of trust matrix cells to work on at once when simulating transactions
+SIMULATION_BATCH_CELLS = 10_000_000
+STATE_DIR = "data/trust_manager"
+LEGACY_FILENAME = "data/trust_manager.pkl"
+ANN_FILENAME = "data/ANN.h5"
+NUMPY_ANN_FILENAME = "data/ANN.npz"
 
 '''
 Manage the network and establish trust between nodes within it.
@@ -23,46 +37,104 @@ Date: 2019-03-30
 '''
 
 
+def __getattr__(name):
+    '''
+    Import the predictor backend submodules on first access, as TrustManager.SVM and
+    TrustManager.ANN.
+    '''
+    if name in ("SVM", "ANN"):
+        return Backends.get_predictor(name.lower())
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+
 class TrustManager:
     '''
     Create and control the network.
     '''
     def __init__(self, no_of_nodes=50, constrained_nodes=0.5, malicious_nodes=0.1, malicious_reporters=0.1,
-                 use_svm=True, train_filename="reports-train.csv", test_filename="reports-test.csv"):
-        self.__network = []
-        self.__train_filename = train_filename
-        self.__test_filename = test_filename
-        self.__use_svm = use_svm
-        self.__predictor = None
+                 use_svm=True, train_filename="reports-train.csv", test_filename="reports-test.csv",
+                 cache_size=128, cache_dir="data/cache", collect_stats=True, seed=None):
+        # The network is drawn from its own generator when seeded, otherwise from NumPy's global random state
+        rng = np.random.default_rng(seed) if seed is not None else None
+        rand = np.random.rand if rng is None else rng.random
         # A real trust model would not be aware of these lists
         # these are for the training
-        constrained_list = Functions.get_conditioned_ids(
-            no_of_nodes, constrained_nodes
-        )
-        malicious_node_list = Functions.get_conditioned_ids(
-            no_of_nodes, malicious_nodes
-        )
-        malicious_reporter_list = Functions.get_conditioned_ids(
-            no_of_nodes, malicious_reporters
-        )
+        constrained_list = set(Functions.get_conditioned_ids(
+            no_of_nodes, constrained_nodes, rng
+        ))
+        malicious_node_list = set(Functions.get_conditioned_ids(
+            no_of_nodes, malicious_nodes, rng
+        ))
+        malicious_reporter_list = set(Functions.get_conditioned_ids(
+            no_of_nodes, malicious_reporters, rng
+        ))
+        # Array form of the network, used for the vectorized computations
+        services = np.zeros(no_of_nodes, dtype=np.int8)
+        capabilities = np.zeros(no_of_nodes, dtype=np.int8)
+        malicious = np.zeros(no_of_nodes, dtype=bool)
+        bad_mouthers = np.zeros(no_of_nodes, dtype=bool)
 
         for i in range(no_of_nodes):
             if i in constrained_list:
-                service = int(np.floor(np.random.rand() * SERVICE_MAX))
-                capability = int(np.floor(np.random.rand() * CAP_MAX))
+                services[i] = int(np.floor(rand() * SERVICE_MAX))
+                capabilities[i] = int(np.floor(rand() * CAP_MAX))
             else:
-                service = SERVICE_MAX
-                capability = CAP_MAX
-            if i in malicious_reporter_list:
-                self.__network.append(
-                    BadMouther.BadMouther(service, capability, i in malicious_node_list)
-                )
-            else:
-                self.__network.append(Node.Node(service, capability, i in malicious_node_list))
+                services[i] = SERVICE_MAX
+                capabilities[i] = CAP_MAX
+            malicious[i] = i in malicious_node_list
+            bad_mouthers[i] = i in malicious_reporter_list
 
-        self.__reports = [
-            [None for _ in range(no_of_nodes)] for _ in range(no_of_nodes)
-        ]
+        self.__setup(
+            services, capabilities, malicious, bad_mouthers, use_svm, train_filename, test_filename,
+            cache_size, cache_dir, collect_stats
+        )
+
+    def __setup(self, services, capabilities, malicious, bad_mouthers, use_svm, train_filename, test_filename,
+                cache_size, cache_dir, collect_stats, train_reports=None, test_reports=None, latest="test"):
+        '''
+        Set up the trust manager around the array form of a network.
+        '''
+        # The Node objects are only built when asked for
+        self.__network = None
+        self.__services = services
+        self.__capabilities = capabilities
+        self.__malicious = malicious
+        self.__bad_mouthers = bad_mouthers
+        self.__train_filename = train_filename
+        self.__test_filename = test_filename
+        self.__use_svm = use_svm
+        self.__numpy_ann = False
+        self.__predictor = None
+        self.__fused_svms = None
+        self.__predictor_fingerprint = None
+        self.__cache_size = cache_size
+        self.__cache_dir = cache_dir
+        self.__trust_cache = Cache.TrustCache(cache_size, cache_dir)
+        self.__trust_tensor = None
+        self.__stats = Stats.Stats(collect_stats)
+        self.__train_reports = train_reports if train_reports is not None else Report.ReportStore()
+        self.__test_reports = test_reports if test_reports is not None else Report.ReportStore()
+        self.__latest_reports = self.__train_reports if latest == "train" else self.__test_reports
+
+    @classmethod
+    def from_state(cls, meta, arrays):
+        '''
+        Create a trust manager from the metadata and arrays of a saved state.
+        '''
+        trust_manager = cls.__new__(cls)
+        trust_manager.__setup(
+            arrays["services"], arrays["capabilities"], arrays["malicious"], arrays["bad_mouthers"],
+            meta["use_svm"], meta["train_filename"], meta["test_filename"], meta["cache_size"], meta["cache_dir"],
+            meta["collect_stats"],
+            Report.ReportStore.from_columns({
+                name: arrays[f"train_reports.{name}"] for name, _ in Report.REPORT_COLUMNS
+            }),
+            Report.ReportStore.from_columns({
+                name: arrays[f"test_reports.{name}"] for name, _ in Report.REPORT_COLUMNS
+            }),
+            meta["latest"]
+        )
+        return trust_manager
 
     def set_filenames(self, train_filename, test_filename):
         self.__train_filename = train_filename
@@ -71,254 +143,819 @@ class TrustManager:
     def set_use_svm_flag(self, use_svm):
         self.__use_svm = use_svm
 
+    def set_numpy_ann_flag(self, numpy_ann):
+        '''
+        Set whether the ANN predicts from its NumPy export, rather than through TensorFlow.
+        '''
+        self.__numpy_ann = numpy_ann
+        self.reset_predictor()
+
     def get_network(self):
+        '''
+        Get the nodes of the network as Node objects, which are built on first use.
+        '''
+        if self.__network is None:
+            self.__network = [
+                (BadMouther.BadMouther if bad_mouther else Node.Node)(int(service), int(capability), bool(malicious))
+                for service, capability, malicious, bad_mouther in zip(
+                    self.__services, self.__capabilities, self.__malicious, self.__bad_mouthers
+                )
+            ]
         return self.__network
 
     def get_reports(self):
-        return self.__reports
+        '''
+        Get the matrix of reports from the latest epoch, where reports[i][j] is the
+        report that node i made on node j.
+        '''
+        no_of_nodes = self.get_no_of_nodes()
+        reports = [[None for _ in range(no_of_nodes)] for _ in range(no_of_nodes)]
+        latest_epoch = self.__latest_reports.get_latest_epoch()
+        if latest_epoch is not None:
+            latest = self.__latest_reports.by_time(latest_epoch, latest_epoch)
+            for reporter, target, service, capability, note in zip(
+                    latest["reporter"], latest["target"], latest["service"], latest["capability"], latest["note"]):
+                reports[reporter][target] = Report.Report(int(service), int(capability), int(note), latest_epoch)
+        return reports
+
+    def get_report_stores(self):
+        '''
+        Get the stores of the train and test reports.
+        '''
+        return self.__train_reports, self.__test_reports
+
+    def get_node_arrays(self):
+        '''
+        Get the array form of the network: services, capabilities, malicious flags and bad mouther flags.
+        '''
+        return self.__services, self.__capabilities, self.__malicious, self.__bad_mouthers
 
     def get_no_of_nodes(self):
-        return len(self.__network)
+        return len(self.__services)
 
     def reset_predictor(self):
         self.__predictor = None
+        self.__fused_svms = None
+        self.__predictor_fingerprint = None
+        self.__trust_tensor = None
 
-    def save(self):
-        if self.__predictor:
-            del self.__predictor
-        if not os.path.exists("data"):
-            os.makedirs("data")
-        joblib.dump(self, "data/trust_manager.pkl")
+    def get_predictor_name(self):
+        return "SVM" if self.__use_svm else "ANN"
+
+    def get_predictor_filename(self):
+        if self.__use_svm:
+            return "data/SVMs.pkl"
+        return NUMPY_ANN_FILENAME if self.__numpy_ann else ANN_FILENAME
 
-    def bootstrap(self, epochs=100, filewrite=True, verbose=True):
+    def __get_ann_backend(self):
+        return Backends.get_predictor("numpy" if self.__numpy_ann else "ann")
+
+    def get_trust_cache(self):
+        return self.__trust_cache
+
+    def get_stats(self):
+        return self.__stats
+
+    def stats(self):
+        '''
+        Get a snapshot of the counters and timers of the trust manager.
+        '''
+        return self.__stats.snapshot()
+
+    def __get_predictor_fingerprint(self):
+        '''
+        Get the fingerprint of the loaded predictor, or of the predictor file when it
+        is yet to be loaded.
+        '''
+        if self.__predictor is not None and self.__predictor_fingerprint:
+            return self.__predictor_fingerprint
+        return Cache.fingerprint(self.get_predictor_filename())
+
+    def save(self, directory=STATE_DIR):
+        '''
+        Save the network and its reports as a versioned directory of arrays.
+        '''
+        arrays = {
+            "services": self.__services,
+            "capabilities": self.__capabilities,
+            "malicious": self.__malicious,
+            "bad_mouthers": self.__bad_mouthers
+        }
+        for store_name, report_store in [("train_reports", self.__train_reports), ("test_reports", self.__test_reports)]:
+            for name, column in report_store.get_columns().items():
+                arrays[f"{store_name}.{name}"] = column
+        meta = {
+            "no_of_nodes": self.get_no_of_nodes(),
+            "use_svm": self.__use_svm,
+            "train_filename": self.__train_filename,
+            "test_filename": self.__test_filename,
+            "cache_size": self.__cache_size,
+            "cache_dir": self.__cache_dir,
+            "collect_stats": self.__stats.is_enabled(),
+            "latest": "train" if self.__latest_reports is self.__train_reports else "test"
+        }
+        State.save_state(directory, meta, arrays)
+
+    def bootstrap(self, epochs=100, filewrite=True, verbose=True, vectorized=True, keep_history=True,
+                  partners=None, topology=None):
         '''
         Go through the network and perform artificial transactions to develop
-        reports.
+        reports, each call starts a fresh report history. By default every node
+        transacts with every other node each epoch, if partners is given each node
+        instead transacts with that many random partners each epoch, and if topology
+        is given as arrays of reporter and target ids the nodes transact along it.
         '''
+        if partners is not None and topology is not None:
+            raise ValueError("Bootstrap with either a number of partners or a topology, not both")
+        if partners is not None:
+            interactions = functools.partial(Topology.random_partners, self.get_no_of_nodes(), partners)
+        elif topology is not None:
+            reporters, targets = (np.asarray(ids, dtype=np.int32) for ids in topology)
+            interactions = lambda: (reporters, targets)
+        else:
+            interactions = functools.partial(all_pairs, self.get_no_of_nodes())
+        self.__train_reports.clear()
+        self.__test_reports.clear()
         if verbose:
             print(f"\nBootstrapping network for {epochs} epochs:")
             Functions.print_progress(0, epochs)
         for i in range(1, epochs + 1):
-            self.__artificial_transactions(i, self.__train_filename if filewrite else None)
-            self.__artificial_transactions(i, self.__test_filename if filewrite else None)
+            if not keep_history:
+                self.__train_reports.clear()
+                self.__test_reports.clear()
+            self.__artificial_transactions(
+                i, self.__train_reports, self.__train_filename if filewrite else None, vectorized, interactions
+            )
+            self.__artificial_transactions(
+                i, self.__test_reports, self.__test_filename if filewrite else None, vectorized, interactions
+            )
             if verbose:
                 Functions.print_progress(i, epochs, prefix=f"{i}/{epochs}")
         if verbose:
             print()
 
-    def __artificial_transactions(self, current_epoch, report_filename=None):
+    def bootstrap_sharded(self, epochs=100, shards=8, seed=0, workers=None, partners=None, topology=None,
+                          verbose=True):
         '''
-        Perform some transactions through the entire network with random
+        Bootstrap the network with its epochs split into contiguous shards run across a
+        process pool, each call starts a fresh report history. Every shard draws from its
+        own random generator spawned from the seed, and writes its train and test reports
+        to shard files, which manifests at the train and test filenames list in order. So
+        the reports are the same for a seed and number of shards, whatever the number of
+        workers. The interactions are chosen as in bootstrap.
+        '''
+        if partners is not None and topology is not None:
+            raise ValueError("Bootstrap with either a number of partners or a topology, not both")
+        if topology is not None:
+            topology = tuple(np.asarray(ids, dtype=np.int32) for ids in topology)
+        workers = workers or os.cpu_count()
+        epoch_shards = np.array_split(np.arange(1, epochs + 1), shards)
+        seed_sequences = np.random.SeedSequence(seed).spawn(shards)
+        for filename in (self.__train_filename, self.__test_filename):
+            for old_shard in glob.glob(f"{glob.escape(filename)}.shard-*"):
+                os.remove(old_shard)
+        shard_filenames = [
+            (ReportFile.shard_filename(self.__train_filename, shard, shards),
+             ReportFile.shard_filename(self.__test_filename, shard, shards))
+            for shard in range(shards)
+        ]
+        node_arrays = tuple(np.asarray(array) for array in self.get_node_arrays())
+        # Shards left without epochs, when there are more shards than epochs, are written empty
+        jobs = [
+            (node_arrays, int(epoch_shard[0]) if len(epoch_shard) else 1,
+             int(epoch_shard[-1]) if len(epoch_shard) else 0, seed_sequence, partners, topology, *filenames)
+            for epoch_shard, seed_sequence, filenames in zip(epoch_shards, seed_sequences, shard_filenames)
+        ]
+        if verbose:
+            print(f"\nBootstrapping network for {epochs} epochs in {shards} shards:")
+            Functions.print_progress(0, shards)
+        no_of_reports = 0
+        with self.__stats.timer("transactions"):
+            if workers == 1:
+                for progress, job in enumerate(jobs, start=1):
+                    no_of_reports += bootstrap_shard(*job)
+                    if verbose:
+                        Functions.print_progress(progress, shards, prefix=f"{progress}/{shards}")
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(bootstrap_shard, *job) for job in jobs]
+                    for progress, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                        no_of_reports += future.result()
+                        if verbose:
+                            Functions.print_progress(progress, shards, prefix=f"{progress}/{shards}")
+        if verbose:
+            print()
+        self.__stats.count("transactions.reports", no_of_reports)
+
+        ReportFile.write_manifest(self.__train_filename, [train_shard for train_shard, _ in shard_filenames])
+        ReportFile.write_manifest(self.__test_filename, [test_shard for _, test_shard in shard_filenames])
+        self.__train_reports, self.__test_reports = (
+            Report.ReportStore.from_columns({
+                name: np.ascontiguousarray(records[name]) for name, _ in Report.REPORT_COLUMNS
+            })
+            for records in map(ReportFile.load_reports, (self.__train_filename, self.__test_filename))
+        )
+        self.__latest_reports = self.__test_reports
+
+    def __artificial_transactions(self, current_epoch, report_store, report_filename=None, vectorized=True,
+                                  interactions=None):
+        '''
+        Perform some transactions through the network's interactions with random
         targets.
         '''
-        for i_node_i in enumerate(self.__network):
-            for j_node_j in enumerate(self.__network):
-                if i_node_i[0] != j_node_j[0]:
-                    service_target = int(np.floor(np.random.rand() * SERVICE_MAX)) + 1
-                    capability_target = int(np.floor(np.random.rand() * CAP_MAX)) + 1
-                    self.__reports[i_node_i[0]][j_node_j[0]] = i_node_i[1].send_report(
-                        j_node_j[1],
-                        service_target,
-                        capability_target,
-                        current_epoch
-                    )
+        if interactions is None:
+            interactions = functools.partial(all_pairs, self.get_no_of_nodes())
+        with self.__stats.timer("transactions"):
+            if vectorized:
+                reports = self.__vectorized_transactions(interactions)
+            else:
+                reports = self.__looped_transactions(current_epoch, interactions)
+        self.__stats.count("transactions.reports", len(reports[0]))
+        report_store.append_epoch(current_epoch, *reports)
+        self.__latest_reports = report_store
         if report_filename:
-            self.save_reports_csv(report_filename)
+            self.save_reports(report_filename)
+
+    def __vectorized_transactions(self, interactions):
+        '''
+        Perform the transactions for every interaction in the network at once.
+        '''
+        reporters, targets = interactions()
+        service_targets = np.random.randint(1, SERVICE_MAX + 1, len(reporters), dtype=np.int8)
+        capability_targets = np.random.randint(1, CAP_MAX + 1, len(reporters), dtype=np.int8)
+        notes = take_notes(self.get_node_arrays(), reporters, targets, service_targets, capability_targets)
+        return reporters, targets, service_targets, capability_targets, notes
+
+    def __looped_transactions(self, current_epoch, interactions):
+        '''
+        Perform the transactions one interaction at a time, through the Node objects.
+        '''
+        network = self.get_network()
+        reporters, targets = interactions()
+        service_targets = np.zeros(len(reporters), dtype=np.int8)
+        capability_targets = np.zeros(len(reporters), dtype=np.int8)
+        notes = np.zeros(len(reporters), dtype=np.int8)
+        for index, (i, j) in enumerate(zip(reporters, targets)):
+            service_target = int(np.floor(np.random.rand() * SERVICE_MAX)) + 1
+            capability_target = int(np.floor(np.random.rand() * CAP_MAX)) + 1
+            report = network[i].send_report(
+                network[j], service_target, capability_target, current_epoch
+            )
+            service_targets[index] = report.get_service()
+            capability_targets[index] = report.get_capability()
+            notes[index] = report.get_note()
+        return reporters, targets, service_targets, capability_targets, notes
+
+    def save_reports(self, filename):
+        '''
+        Save the report data from the latest epoch, as a csv if the filename
+        ends with .csv otherwise in the binary report format.
+        '''
+        latest_epoch = self.__latest_reports.get_latest_epoch()
+        if latest_epoch is not None:
+            self.__append_reports(filename, self.__latest_reports.by_time(latest_epoch, latest_epoch))
 
     def save_reports_csv(self, filename):
         '''
-        Save a csv on the report data
+        Save a csv on the report data from the latest epoch
         '''
-        with open(filename, "a") as report_csv:
-            for reports_from_node_i in enumerate(self.__reports):
-                for reports_on_node_j in enumerate(reports_from_node_i[1]):
-                    if reports_from_node_i[0] != reports_on_node_j[0]:
-                        report_csv.write(
-                            f"{reports_from_node_i[0]},{reports_on_node_j[0]},{reports_on_node_j[1].csv_output()}\n"
-                        )
+        latest_epoch = self.__latest_reports.get_latest_epoch()
+        if latest_epoch is not None:
+            self.__append_reports(filename, self.__latest_reports.by_time(latest_epoch, latest_epoch), csv=True)
 
-    def train(self, cont):
+    def __append_reports(self, filename, columns, csv=None):
         '''
-        Train the predictor.
+        Append report columns to a file, as a csv if csv is set or the filename ends with
+        .csv, otherwise in the binary report format.
         '''
+        if csv is None:
+            csv = filename.endswith(".csv")
+        size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        if csv:
+            rows = np.column_stack((
+                columns["reporter"], columns["target"], columns["service"], columns["capability"], columns["note"],
+                columns["epoch"]
+            ))
+            with self.__stats.timer("save_reports_csv"), open(filename, "a") as report_csv:
+                np.savetxt(report_csv, rows, fmt="%d", delimiter=",")
+        else:
+            with self.__stats.timer("save_reports"):
+                ReportFile.write_reports(filename, columns)
+        self.__stats.count("files.bytes_written", os.path.getsize(filename) - size)
+
+    def train(self, cont, stream=True, workers=None, seed=None, window=None, decay=None, reporter_ids=None):
+        '''
+        Train the predictor, on only the reports from the latest window epochs if window
+        is given, and with the reports weighted by decay to the power of their age in
+        epochs if decay is given. If reporter_ids is given only the SVMs of those
+        reporters are retrained.
+        '''
+        with self.__stats.timer("train"):
+            if self.__use_svm:
+                self.evolve_svm(workers, seed, window, decay, reporter_ids)
+            else:
+                self.train_ann(cont, stream, window, decay)
         if self.__use_svm:
-            self.evolve_svm()
             self.load_svms()
         else:
-            self.train_ann(cont)
             self.load_ann()
+        self.__trust_cache.clear(self.get_predictor_name(), self.__predictor_fingerprint)
+        self.__trust_tensor = None
+
+    def update(self, reports, epoch=None, ann_epochs=5):
+        '''
+        Update the trained predictor with a batch of newly arrived reports, given as columns
+        of reporter, target, service, capability and note, made at epoch, or the epoch after
+        the latest by default. The reports are added to the training reports, then only
+        the SVMs of the reporters that made them are refitted with their current C and
+        gamma, or the ANN is warm started with a few epochs on them.
+        '''
+        if epoch is None:
+            latest_epoch = self.__train_reports.get_latest_epoch()
+            epoch = 1 if latest_epoch is None else latest_epoch + 1
+        columns = {name: np.asarray(reports[name]) for name in ("reporter", "target", "service", "capability", "note")}
+        with self.__stats.timer("update"):
+            self.__train_reports.append_epoch(
+                epoch, columns["reporter"], columns["target"], columns["service"], columns["capability"],
+                columns["note"]
+            )
+            self.__append_reports(self.__train_filename, dict(columns, epoch=np.full(len(columns["note"]), epoch)))
+            if self.__use_svm:
+                self.__update_svms(np.unique(columns["reporter"]))
+            else:
+                self.__update_ann(columns, ann_epochs)
+        self.__stats.count("update.reports", len(columns["note"]))
+        self.__trust_cache.clear(self.get_predictor_name(), self.__predictor_fingerprint)
+        self.__trust_tensor = None
+
+    def __update_svms(self, reporter_ids):
+        '''
+        Refit the SVMs of the given reporters on all of their training reports, keeping their
+        C and gamma. Reporters without an SVM are fitted with the median C and gamma.
+        '''
+        SVM = Backends.get_predictor("svm")
+        self.load_predictor()
+        train_data, train_notes, _ = self.__read_data(self.__train_filename, reporter_ids=reporter_ids)
+        svms = dict(self.__predictor)
+        median_params = (
+            float(np.median([svm.C for svm in svms.values()])), float(np.median([svm.gamma for svm in svms.values()]))
+        )
+        for reporter_id in (int(reporter_id) for reporter_id in reporter_ids):
+            svm = svms.get(reporter_id)
+            c_value, gamma = (svm.C, svm.gamma) if svm is not None else median_params
+            try:
+                svms[reporter_id] = SVM.create_and_fit_svm(
+                    train_data[reporter_id], train_notes[reporter_id], c_value, gamma
+                )
+            except ValueError:
+                # All of the reporter's notes are the same, so keep its current SVM
+                continue
+            self.__stats.count("update.refits")
+        joblib.dump({reporter_id: svms[reporter_id] for reporter_id in sorted(svms)}, "data/SVMs.pkl")
+        self.load_svms()
+
+    def __update_ann(self, columns, epochs):
+        '''
+        Warm start the ANN with a few epochs on the new reports.
+        '''
+        inputs = np.column_stack((columns["reporter"], columns["target"], columns["service"], columns["capability"]))
+        model = Backends.get_predictor("ann").update_ann(self.__load_keras_ann(), inputs, columns["note"], epochs)
+        model.save(ANN_FILENAME)
+        self.load_ann()
+
+    def __load_keras_ann(self):
+        '''
+        Get the Keras model of the ANN, which is the loaded predictor unless predicting
+        from the NumPy export.
+        '''
+        if self.__numpy_ann:
+            with self.__stats.timer("load_model"):
+                return Backends.get_predictor("ann").load_model(ANN_FILENAME)
+        self.load_predictor()
+        return self.__predictor
 
-    def evolve_svm(self):
+    def evolve_svm(self, workers=None, seed=None, window=None, decay=None, reporter_ids=None):
         '''
         Perform an evolutionary algorithm to find the optimal values of C and gamma
-        for the respective SVMs.
+        for the respective SVMs. The reporters are spread across a pool of worker
+        processes, each reporter is given its own random stream derived from seed. If
+        reporter_ids is given only their SVMs are evolved, reading only their reports,
+        and the rest of the saved SVMs are kept.
         '''
-        train_data, train_notes = read_data(self.__train_filename)
-        test_data, test_notes = read_data(self.__test_filename)
+        SVM = Backends.get_predictor("svm")
+        keep_others = reporter_ids is not None and os.path.exists("data/SVMs.pkl")
+        train_data, train_notes, train_weights = self.__read_data(
+            self.__train_filename, window=window, decay=decay, reporter_ids=reporter_ids
+        )
+        test_data, test_notes, test_weights = self.__read_data(
+            self.__test_filename, window=window, decay=decay, reporter_ids=reporter_ids
+        )
+        if decay is None:
+            train_weights = test_weights = dict.fromkeys(train_data)
 
+        reporter_ids = sorted(train_data.keys())
+        seeds = dict(zip(reporter_ids, np.random.SeedSequence(seed).spawn(len(reporter_ids))))
         svms = dict()
-        total_reporters = len(train_data.keys())
+        total_reporters = len(reporter_ids)
         progress = 0
 
         Functions.print_progress(progress, total_reporters, prefix=f"{progress}/{total_reporters}")
-        for reporter_id, _ in train_data.items():
-            svms[reporter_id] = SVM.evolve(
-                train_data[reporter_id], train_notes[reporter_id], test_data[reporter_id], test_notes[reporter_id]
-            )
-            progress += 1
-            Functions.print_progress(progress, total_reporters, prefix=f"{progress}/{total_reporters}")
+        if workers == 1:
+            for reporter_id in reporter_ids:
+                svms[reporter_id] = SVM.evolve(
+                    train_data[reporter_id], train_notes[reporter_id], test_data[reporter_id], test_notes[reporter_id],
+                    seeds[reporter_id], train_weights[reporter_id], test_weights[reporter_id]
+                )
+                progress += 1
+                Functions.print_progress(progress, total_reporters, prefix=f"{progress}/{total_reporters}")
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(
+                        SVM.evolve, train_data[reporter_id], train_notes[reporter_id], test_data[reporter_id],
+                        test_notes[reporter_id], seeds[reporter_id], train_weights[reporter_id],
+                        test_weights[reporter_id]
+                    ): reporter_id for reporter_id in reporter_ids
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    svms[futures[future]] = future.result()
+                    progress += 1
+                    Functions.print_progress(progress, total_reporters, prefix=f"{progress}/{total_reporters}")
+        if keep_others:
+            svms = {**joblib.load("data/SVMs.pkl"), **svms}
+            reporter_ids = sorted(svms)
+        svms = {reporter_id: svms[reporter_id] for reporter_id in reporter_ids}
 
         if not os.path.exists("data"):
             os.makedirs("data")
         joblib.dump(svms, "data/SVMs.pkl")
         print()
 
-    def train_ann(self, cont):
+    def train_ann(self, cont, stream=True, window=None, decay=None):
         '''
-        Train the artificial neural network.
+        Train the artificial neural network, streaming the reports from their files
+        unless stream is False. Continuing resumes the last training run from its latest
+        checkpoint, or else starts a new run from the saved network.
         '''
-        train_data, train_notes = read_data(self.__train_filename, dict_mode=False)
-        test_data, test_notes = read_data(self.__test_filename, dict_mode=False)
+        ANN = Backends.get_predictor("ann")
+        run = ANN.TrainingRun.TrainingRun()
+        resume = cont and run.get_last_checkpoint() is not None
+        model = None
+        if cont and not resume and os.path.exists(ANN_FILENAME):
+            model = self.__load_keras_ann()
+        if stream:
+            for filename in (self.__train_filename, self.__test_filename):
+                self.__count_bytes_read(filename)
+            model = ANN.create_and_train_ann_streaming(
+                [self.__train_filename], [self.__test_filename], model=model, window=window, decay=decay,
+                run=run, resume=resume
+            )
+        else:
+            train_data, train_notes, train_weights = self.__read_data(
+                self.__train_filename, dict_mode=False, window=window, decay=decay
+            )
+            test_data, test_notes, test_weights = self.__read_data(
+                self.__test_filename, dict_mode=False, window=window, decay=decay
+            )
+            model = ANN.create_and_train_ann(
+                train_data, train_notes, test_data, test_notes, model=model, train_weights=train_weights,
+                test_weights=test_weights, run=run, resume=resume
+            )
+        model.save(ANN_FILENAME)
 
-        if cont and os.path.exists("data/ANN.h5"):
-            self.load_ann()
-        ANN.create_and_train_ann(train_data, train_notes, test_data, test_notes,
-                                 model=self.__predictor).save("data/ANN.h5")
+    def __read_data(self, filename, dict_mode=True, window=None, decay=None, reporter_ids=None):
+        '''
+        Read the data from a file of reports, or only that of the given reporters, counting
+        the time and bytes taken.
+        '''
+        with self.__stats.timer("read_data"):
+            data = read_data(filename, dict_mode=dict_mode, window=window, decay=decay, reporter_ids=reporter_ids)
+        if reporter_ids is None:
+            self.__count_bytes_read(filename)
+        else:
+            notes = data[1]
+            no_of_reports = sum(map(len, notes.values())) if dict_mode else len(notes)
+            self.__stats.count("files.bytes_read", no_of_reports * ReportFile.REPORT_DTYPE.itemsize)
+        return data
+
+    def __count_bytes_read(self, filename):
+        '''
+        Count the size of the report files holding a file's reports as read.
+        '''
+        self.__stats.count("files.bytes_read", sum(map(os.path.getsize, ReportFile.report_filenames(filename))))
+
+    def load_predictor(self):
+        '''
+        Load the predictor in use, unless it is already loaded.
+        '''
+        if not self.__predictor:
+            if self.__use_svm:
+                self.load_svms()
+            else:
+                self.load_ann()
 
     def load_svms(self):
         '''
         Load the kernel machine classifiers for each node in the network.
         '''
-        self.__predictor = joblib.load("data/SVMs.pkl")
+        self.__predictor_fingerprint = Cache.fingerprint("data/SVMs.pkl")
+        with self.__stats.timer("load_model"):
+            self.__predictor = joblib.load("data/SVMs.pkl")
+        self.__fused_svms = None
 
     def load_ann(self):
         '''
-        Load the neural network classifier.
+        Load the neural network classifier, or its NumPy export when the flag is set,
+        exporting it first if the export is missing or was made from another network.
         '''
-        self.__predictor = dict()
-        self.__predictor = keras.models.load_model(f"data/ANN.h5")
+        if self.__numpy_ann and self.__is_numpy_ann_stale():
+            self.export_ann()
+        self.__predictor_fingerprint = Cache.fingerprint(self.get_predictor_filename())
+        with self.__stats.timer("load_model"):
+            self.__predictor = self.__get_ann_backend().load_model(self.get_predictor_filename())
 
-    def get_all_recommendations(self, service_target, capability_target):
+    def __is_numpy_ann_stale(self):
         '''
-        Get all of the predicted recommendations from each node, for each node.
+        Check whether the NumPy export of the ANN is missing, or was made from a network
+        other than the saved one.
         '''
-        trusted_lists = dict()
-        no_of_nodes = self.get_no_of_nodes()
+        if not os.path.exists(NUMPY_ANN_FILENAME):
+            return True
+        ann_fingerprint = Cache.fingerprint(ANN_FILENAME)
+        return ann_fingerprint is not None and \
+            ann_fingerprint != Backends.get_predictor("numpy").get_source_fingerprint(NUMPY_ANN_FILENAME)
 
-        for client_id in range(no_of_nodes):
-            if self.__use_svm:
-                if not self.__predictor:
-                    self.load_svms()
-                trusted_lists[client_id] = SVM.get_trusted_list(
-                    self.__predictor[client_id], service_target, capability_target, no_of_nodes
-                )
-            else:
-                if not self.__predictor:
-                    self.load_ann()
-                trusted_lists[client_id] = ANN.get_trusted_list(
-                    self.__predictor, client_id, service_target, capability_target, no_of_nodes
-                )
+    def export_ann(self, filename=NUMPY_ANN_FILENAME):
+        '''
+        Export the weights of the neural network to a NumPy archive, for predicting
+        without TensorFlow.
+        '''
+        ANN = Backends.get_predictor("ann")
+        with self.__stats.timer("load_model"):
+            model = ANN.load_model(ANN_FILENAME)
+        ANN.export_numpy(model, filename, Cache.fingerprint(ANN_FILENAME))
+
+    def get_trust_matrix(self, service_target, capability_target, client_ids=None, fill_cache=True):
+        '''
+        Get the predicted notes that each client gives each node in the network at the
+        target service and capability, as a matrix with a row for each client. These are
+        indexed from the compiled trust tensor when there is one, otherwise full
+        matrices are cached by context, a miss computes the full matrix and caches it
+        unless fill_cache is False, in which case only the requested rows are predicted.
+        '''
+        trust_tensor = self.get_trust_tensor()
+        if trust_tensor is not None and 0 <= service_target <= SERVICE_MAX and 0 <= capability_target <= CAP_MAX:
+            self.__stats.count("tensor.hits")
+            trust_matrix = trust_tensor[service_target, capability_target]
+            return trust_matrix if client_ids is None else trust_matrix[client_ids]
 
-        return trusted_lists
+        key = (
+            self.get_predictor_name(), self.__get_predictor_fingerprint(), self.get_no_of_nodes(), service_target,
+            capability_target
+        )
+        trust_matrix = self.__trust_cache.get(key)
+        self.__stats.count("cache.misses" if trust_matrix is None else "cache.hits")
+        if trust_matrix is None:
+            if client_ids is not None and not fill_cache:
+                return self.__predict_trust_matrix(service_target, capability_target, client_ids)
+            trust_matrix = self.__predict_trust_matrix(service_target, capability_target)
+            trust_matrix.setflags(write=False)
+            key = key[:1] + (self.__get_predictor_fingerprint(),) + key[2:]
+            self.__trust_cache.put(key, trust_matrix)
+        return trust_matrix if client_ids is None else trust_matrix[client_ids]
 
-    def graph_recommendations(self, client_id, service_target, capability_target):
+    def __predict_trust_matrix(self, service_target, capability_target, client_ids=None, workers=None):
         '''
-        Create a DiGraph of the recommendations for the client at the target service and capability.
+        Predict the trust matrix with the predictor, for all clients or the given ones.
         '''
-        graph = graphviz.Digraph(comment="Recommendations DiGraph")
-        trusted_lists = self.get_all_recommendations(service_target, capability_target)
-        for node_id in range(self.get_no_of_nodes()):
-            graph.node(
-                f"{node_id}",
-                f"{node_id}",
-                color="red" if self.__network[node_id].is_malicious() else "blue",
-                style="filled",
-                fontcolor="white"
-            )
-        for other_node_id, trust_val in trusted_lists[client_id].items():
-            graph.edge(
-                f"{client_id}",
-                f"{other_node_id}",
-                color="red" if trust_val == -1 else "purple" if trust_val == 0 else "blue"
-            )
-        if not os.path.exists("graphs"):
-            os.makedirs("graphs")
-        predictor_name = "SVM" if self.__use_svm else "ANN"
-        graph.render(f"graphs/id{client_id}_s{service_target}_c{capability_target}_{predictor_name}_recommendations.gv", view=False)
+        with self.__stats.timer("predict"):
+            trust_matrix = self.__run_predictor(service_target, capability_target, client_ids, workers)
+        self.__stats.count("predict.rows", len(trust_matrix))
+        return trust_matrix
 
-    def find_best_servers(self, client_id, service_target, capability_target):
+    def __run_predictor(self, service_target, capability_target, client_ids=None, workers=None):
         '''
-        Give a list of trusted nodes for the client at the target service and capability.
+        Run the predictor over the clients at the target service and capability, the fused
+        SVMs run across workers threads, by default one for each cpu.
         '''
+        no_of_nodes = self.get_no_of_nodes()
+
         if self.__use_svm:
+            SVM = Backends.get_predictor("svm")
             if not self.__predictor:
                 self.load_svms()
-            trusted_list = SVM.get_trusted_list(
-                self.__predictor[client_id], service_target, capability_target, len(self.__network)
-            )
+            if client_ids is None:
+                trust_matrix = self.__get_fused_svms().trust_matrix(
+                    service_target, capability_target, no_of_nodes, workers
+                )
+            else:
+                trust_matrix = np.array([
+                    SVM.predict_servers(self.__predictor[client_id], service_target, capability_target, no_of_nodes)
+                    for client_id in client_ids
+                ], dtype=np.int8).reshape(len(client_ids), no_of_nodes)
         else:
             if not self.__predictor:
                 self.load_ann()
-            trusted_list = ANN.get_trusted_list(
-                self.__predictor, client_id, service_target, capability_target, len(self.__network)
+            trust_matrix = self.__get_ann_backend().predict_trust_matrix(
+                self.__predictor, np.arange(no_of_nodes) if client_ids is None else client_ids,
+                service_target, capability_target, no_of_nodes
             )
-        return trusted_list
+        return trust_matrix
 
-    def __find_and_rate_best_server(self, client_index, service, capability, predictions):
+    def __get_fused_svms(self):
         '''
-        Predict the best server and return the note that the client gives it.
+        Get the loaded SVMs fused together, fusing them the first time.
         '''
-        good_indices = []
-        okay_indices = []
+        if not self.__fused_svms:
+            fused_svms = Backends.get_predictor("svm").FusedSVMs(self.__predictor, workers=os.cpu_count())
+            # The fused rows follow the clients with SVMs, so they are only the matrix rows if every node has one
+            if fused_svms.get_client_ids() != list(range(self.get_no_of_nodes())):
+                missing_ids = sorted(set(range(self.get_no_of_nodes())) - set(fused_svms.get_client_ids()))
+                raise KeyError(f"The SVMs do not match the clients of the network, missing {missing_ids}")
+            self.__fused_svms = fused_svms
+        return self.__fused_svms
 
-        for index, prediction in predictions[service][capability][client_index].items():
-            if index != client_index:
-                if prediction == 1:
-                    good_indices.append(index)
-                elif prediction == 0:
-                    okay_indices.append(index)
+    def get_trust_tensor_filename(self):
+        return f"data/trust_tensor_{self.get_predictor_name()}.npy"
 
-        if good_indices:
-            server_index = good_indices[int(np.floor(np.random.rand() * len(good_indices)))]
-            note = self.__network[client_index].take_note(self.__network[server_index], service, capability)
-        elif okay_indices:
-            server_index = okay_indices[int(np.floor(np.random.rand() * len(okay_indices)))]
-            note = self.__network[client_index].take_note(self.__network[server_index], service, capability)
-        else:
-            note = -1
+    def compile_trust_tensor(self, workers=None, verbose=True):
+        '''
+        Evaluate the predictor over every context, client and server, and save the
+        results as an int8 tensor indexed by [service, capability, client, server].
+        The contexts are spread across a thread pool, with the SVMs fused once beforehand
+        and each context run on its own thread. The Keras ANN is not safe to call from
+        several threads, so its contexts are run one at a time, while TensorFlow spreads
+        each prediction across the cpus. The NumPy ANN uses the pool as the SVMs do.
+        '''
+        no_of_nodes = self.get_no_of_nodes()
+        if self.__use_svm:
+            if not self.__predictor:
+                self.load_svms()
+            self.__get_fused_svms()
+        elif not self.__predictor:
+            self.load_ann()
+        if not os.path.exists("data"):
+            os.makedirs("data")
+        filename = self.get_trust_tensor_filename()
+        in_threads = self.__use_svm or self.__numpy_ann
+        self.__write_trust_tensor(f"{filename}.tmp", workers if in_threads else 1, verbose)
+        os.replace(f"{filename}.tmp", filename)
+        with open(f"{filename}.json", "w") as meta_file:
+            json.dump({"fingerprint": self.__predictor_fingerprint, "no_of_nodes": no_of_nodes}, meta_file)
+        self.__trust_tensor = None
+
+    def __write_trust_tensor(self, filename, workers, verbose):
+        '''
+        Write the predictions for every context to a new tensor file, across a pool of
+        workers threads. The file is flushed and unmapped before returning.
+        '''
+        no_of_nodes = self.get_no_of_nodes()
+        trust_tensor = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=np.int8, shape=(SERVICE_MAX + 1, CAP_MAX + 1, no_of_nodes, no_of_nodes)
+        )
+        contexts = [(service, capability) for service in range(SERVICE_MAX + 1) for capability in range(CAP_MAX + 1)]
+
+        def compile_context(context):
+            trust_tensor[context] = self.__predict_trust_matrix(*context, workers=1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for progress, _ in enumerate(executor.map(compile_context, contexts), start=1):
+                if verbose:
+                    Functions.print_progress(progress, len(contexts), prefix=f"{progress}/{len(contexts)}")
+        if verbose:
+            print()
+        trust_tensor.flush()
+        trust_tensor._mmap.close()
+
+    def get_trust_tensor(self):
+        '''
+        Get the memory-mapped trust tensor, or None if it has not been compiled for the
+        current predictor.
+        '''
+        if self.__trust_tensor is None:
+            self.__trust_tensor = False
+            filename = self.get_trust_tensor_filename()
+            if os.path.exists(f"{filename}.json"):
+                with open(f"{filename}.json") as meta_file:
+                    meta = json.load(meta_file)
+                if meta["fingerprint"] == self.__get_predictor_fingerprint() and \
+                        meta["no_of_nodes"] == self.get_no_of_nodes():
+                    self.__trust_tensor = np.load(filename, mmap_mode="r")
+        return self.__trust_tensor if self.__trust_tensor is not False else None
+
+    def get_all_recommendations(self, service_target, capability_target):
+        '''
+        Get all of the predicted recommendations from each node, for each node.
+        '''
+        trust_matrix = self.get_trust_matrix(service_target, capability_target)
 
-        return note
+        return {client_id: to_trusted_list(trust_row) for client_id, trust_row in enumerate(trust_matrix)}
+
+    def graph_recommendations(self, client_id, service_target, capability_target):
+        '''
+        Create a DiGraph of the recommendations for the client at the target service and capability.
+        '''
+        return self.export_graphs([(client_id, service_target, capability_target)])[0]
+
+    def export_graphs(self, queries, fmt="render", directory="graphs", workers=None):
+        '''
+        Write the recommendation graphs for many (client, service, capability) queries,
+        rendered through graphviz, or as DOT or JSON edge lists which need no graphviz
+        binary. Only the trust rows of the requested clients are predicted, once for each
+        context, then the graphs are written across a thread pool. Gives the filenames
+        written, in the order of the queries.
+        '''
+        if fmt not in Graphs.FORMATS:
+            raise ValueError(f"Unknown graph format {fmt}, expected one of {', '.join(Graphs.FORMATS)}")
+        queries = list(dict.fromkeys(
+            (int(client_id), int(service_target), int(capability_target))
+            for client_id, service_target, capability_target in queries
+        ))
+        contexts = {}
+        for client_id, service_target, capability_target in queries:
+            contexts.setdefault((service_target, capability_target), []).append(client_id)
+        trust_rows = {}
+        for (service_target, capability_target), client_ids in contexts.items():
+            trust_matrix = self.get_trust_matrix(service_target, capability_target, client_ids, fill_cache=False)
+            for client_id, trust_row in zip(client_ids, trust_matrix):
+                trust_rows[(client_id, service_target, capability_target)] = trust_row
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        predictor_name = self.get_predictor_name()
+        malicious = np.asarray(self.__malicious)
+
+        def write_graph(query):
+            return Graphs.write_graph(
+                directory, Graphs.graph_name(*query, predictor_name), fmt, *query, trust_rows[query], malicious
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            return list(executor.map(write_graph, queries))
+
+    def find_best_servers(self, client_id, service_target, capability_target):
+        '''
+        Give a list of trusted nodes for the client at the target service and capability.
+        '''
+        return to_trusted_list(self.get_trust_matrix(service_target, capability_target, [client_id])[0])
+
+    def __rate_best_servers(self, client_ids, service, capability):
+        '''
+        Predict the best server for each of the clients at a context, and return the notes
+        that the clients give them. The server is picked at random from those predicted
+        good, or else okay, with a masked random choice across all clients at once.
+        '''
+        trust_rows = self.get_trust_matrix(service, capability, client_ids)
+        not_client = np.arange(trust_rows.shape[1])[np.newaxis, :] != client_ids[:, np.newaxis]
+        good = (trust_rows == 1) & not_client
+        okay = (trust_rows == 0) & not_client
+        candidates = np.where(good.any(axis=1)[:, np.newaxis], good, okay)
+        no_of_candidates = candidates.sum(axis=1)
+        choices = np.floor(np.random.rand(len(client_ids)) * no_of_candidates)
+        server_ids = np.argmax(np.cumsum(candidates, axis=1) > choices[:, np.newaxis], axis=1)
+
+        notes = np.where(
+            self.__bad_mouthers[client_ids],
+            BadMouther.take_notes(self.__malicious[server_ids]),
+            Node.take_notes(
+                self.__services[server_ids], self.__capabilities[server_ids], self.__malicious[server_ids],
+                service, capability
+            )
+        )
+        return np.where(no_of_candidates > 0, notes, np.int8(-1))
 
     def __simulate_and_rate_trans(self, epochs):
         '''
         Simulate epochs transactions and count the number of various ratings given by clients.
+        The transactions are drawn and rated as arrays, in batches grouped by context.
         '''
-        bad_transactions = 0
-        okay_transactions = 0
-        good_transactions = 0
-        predictions = dict()
+        no_of_nodes = self.get_no_of_nodes()
+        batch_size = max(1, SIMULATION_BATCH_CELLS // no_of_nodes)
+        note_counts = np.zeros(3, dtype=np.int64)
+        simulated = 0
 
         Functions.print_progress(0, epochs, prefix=f"0/{epochs}")
-        for epoch in range(1, epochs + 1):
-            service = int(np.floor(np.random.rand() * (SERVICE_MAX + 1)))
-            capability = int(np.floor(np.random.rand() * (CAP_MAX + 1)))
-            client_index = int(np.floor(np.random.rand() * len(self.__network)))
-            if not predictions.get(service):
-                predictions[service] = dict()
-            if not predictions[service].get(capability):
-                predictions[service][capability] = self.get_all_recommendations(service, capability)
-
-            note = self.__find_and_rate_best_server(client_index, service, capability, predictions)
-
-            if note == -1:
-                bad_transactions += 1
-            elif note == 0:
-                okay_transactions += 1
-            else:
-                good_transactions += 1
-            Functions.print_progress(epoch, epochs, prefix=f"{epoch}/{epochs}")
+        while simulated < epochs:
+            size = min(batch_size, epochs - simulated)
+            services = np.random.randint(0, SERVICE_MAX + 1, size)
+            capabilities = np.random.randint(0, CAP_MAX + 1, size)
+            client_ids = np.random.randint(0, no_of_nodes, size)
+
+            contexts = services * (CAP_MAX + 1) + capabilities
+            order = np.argsort(contexts, kind="stable")
+            unique_contexts, starts = np.unique(contexts[order], return_index=True)
+            for context, transactions in zip(unique_contexts, np.split(order, starts[1:])):
+                service, capability = divmod(int(context), CAP_MAX + 1)
+                notes = self.__rate_best_servers(client_ids[transactions], service, capability)
+                note_counts += np.bincount(notes + 1, minlength=3)
+
+            simulated += size
+            self.__stats.count("simulate.transactions", size)
+            self.__stats.count("simulate.contexts", len(unique_contexts))
+            Functions.print_progress(simulated, epochs, prefix=f"{simulated}/{epochs}")
         print()
 
+        bad_transactions, okay_transactions, good_transactions = (int(count) for count in note_counts)
         return bad_transactions, okay_transactions, good_transactions
 
     def simulate_transactions(self, epochs):
@@ -327,7 +964,8 @@ class TrustManager:
         transactions that have occured.
         '''
         print("Simulating transactions...")
-        bad_transactions, okay_transactions, good_transactions = self.__simulate_and_rate_trans(epochs)
+        with self.__stats.timer("simulate"):
+            bad_transactions, okay_transactions, good_transactions = self.__simulate_and_rate_trans(epochs)
 
         return Functions.calc_percentage(bad_transactions, epochs), \
             Functions.calc_percentage(okay_transactions, epochs), \
@@ -344,51 +982,183 @@ class TrustManager:
         if self.__use_svm:
             if not self.__predictor:
                 self.load_svms()
-            avg_time = SVM.time_predict(self.__predictor[client], server, service, capability)
+            avg_time = Backends.get_predictor("svm").time_predict(self.__predictor[client], server, service, capability)
         else:
             if not self.__predictor:
                 self.load_ann()
-            avg_time = ANN.time_predict(self.__predictor, client, server, service, capability)
+            avg_time = self.__get_ann_backend().time_predict(self.__predictor, client, server, service, capability)
         return avg_time
 
 
-def load(train_filename, test_filename, use_svm):
+def load(train_filename, test_filename, use_svm, numpy_ann=False):
     '''
-    Load a previously saved trust manager.
+    Load a previously saved trust manager, its arrays are memory-mapped from the saved
+    state. A manager pickled by an older version is converted to a state the first time.
+    With numpy_ann the ANN predicts from its NumPy export.
     '''
-    trust_manager = joblib.load("data/trust_manager.pkl")
+    if not State.is_state(STATE_DIR) and os.path.exists(LEGACY_FILENAME):
+        State.save_state(STATE_DIR, *legacy_state(LEGACY_FILENAME))
+    if not State.is_state(STATE_DIR):
+        raise FileNotFoundError(f"There is no saved trust manager in {STATE_DIR}, bootstrap one first")
+    trust_manager = TrustManager.from_state(*State.load_state(STATE_DIR))
 
     trust_manager.set_filenames(train_filename, test_filename)
     trust_manager.set_use_svm_flag(use_svm)
+    trust_manager.set_numpy_ann_flag(numpy_ann)
     trust_manager.reset_predictor()
 
     return trust_manager
 
 
-def read_data(filename, delimiter=",", dict_mode=True):
+class LegacyObject:
+    '''
+    Holds the attributes of an object pickled by an older version of a class.
+    '''
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    '''
+    Unpickle a trust manager from before the array state, with it and its reports as
+    plain attributes, since Report no longer has a __dict__ to restore into.
+    '''
+    def find_class(self, module, name):
+        if (module, name) in (("TrustManager", "TrustManager"), ("Report", "Report")):
+            return LegacyObject
+        return super().find_class(module, name)
+
+
+def legacy_state(filename):
+    '''
+    Convert a pickled trust manager from before the array state into the metadata and
+    arrays of a state. Its matrix of the latest reports becomes the test reports.
+    '''
+    with open(filename, "rb") as legacy_file:
+        legacy = vars(LegacyUnpickler(legacy_file).load())
+    network = legacy["_TrustManager__network"]
+    reports = [
+        (report._Report__time, reporter_id, target_id, report._Report__service, report._Report__capability,
+         report._Report__note)
+        for reporter_id, row in enumerate(legacy["_TrustManager__reports"])
+        for target_id, report in enumerate(row) if report is not None
+    ]
+    arrays = {
+        "services": np.array([node.get_service() for node in network], dtype=np.int8),
+        "capabilities": np.array([node.get_capability() for node in network], dtype=np.int8),
+        "malicious": np.array([node.is_malicious() for node in network], dtype=bool),
+        "bad_mouthers": np.array([isinstance(node, BadMouther.BadMouther) for node in network], dtype=bool)
+    }
+    for i, (name, dtype) in enumerate(Report.REPORT_COLUMNS):
+        arrays[f"train_reports.{name}"] = np.zeros(0, dtype=dtype)
+        arrays[f"test_reports.{name}"] = np.array([report[i] for report in reports], dtype=dtype)
+    meta = {
+        "no_of_nodes": len(network),
+        "use_svm": legacy["_TrustManager__use_svm"],
+        "train_filename": legacy["_TrustManager__train_filename"],
+        "test_filename": legacy["_TrustManager__test_filename"],
+        "cache_size": 128,
+        "cache_dir": "data/cache",
+        "collect_stats": True,
+        "latest": "test"
+    }
+    return meta, arrays
+
+
+def to_trusted_list(trust_row):
+    '''
+    Convert a row of a trust matrix into a trusted list, mapping node ids to notes.
+    '''
+    return {node_id: int(note) for node_id, note in enumerate(trust_row)}
+
+
+def all_pairs(no_of_nodes):
+    '''
+    Get the reporter and target ids of every ordered pair of distinct nodes.
+    '''
+    reporters = np.repeat(np.arange(no_of_nodes, dtype=np.int32), no_of_nodes - 1)
+    targets = np.tile(np.arange(no_of_nodes - 1, dtype=np.int32), no_of_nodes)
+    targets += targets >= reporters
+
+    return reporters, targets
+
+
+def take_notes(node_arrays, reporters, targets, service_targets, capability_targets):
+    '''
+    Give the notes that the reporters take of transactions with the targets, in a network
+    given by its node arrays.
+    '''
+    services, capabilities, malicious, bad_mouthers = node_arrays
+    target_malicious = malicious[targets]
+    return np.where(
+        bad_mouthers[reporters],
+        BadMouther.take_notes(target_malicious),
+        Node.take_notes(
+            services[targets], capabilities[targets], target_malicious, service_targets, capability_targets
+        )
+    )
+
+
+def bootstrap_shard(node_arrays, first_epoch, last_epoch, seed_sequence, partners, topology, train_filename,
+                    test_filename):
     '''
-    Read data from a csv of reports.
+    Bootstrap the epochs of a shard with a random generator of its own, writing the train
+    and test reports of each epoch to the shard's files. Gives the number of reports written.
     '''
+    rng = np.random.default_rng(seed_sequence)
+    no_of_nodes = len(node_arrays[0])
+    for filename in (train_filename, test_filename):
+        with open(filename, "wb") as report_file:
+            ReportFile.write_header(report_file)
+    no_of_reports = 0
+    for epoch in range(first_epoch, last_epoch + 1):
+        for filename in (train_filename, test_filename):
+            if partners is not None:
+                reporters, targets = Topology.random_partners(no_of_nodes, partners, rng)
+            elif topology is not None:
+                reporters, targets = topology
+            else:
+                reporters, targets = all_pairs(no_of_nodes)
+            service_targets = rng.integers(1, SERVICE_MAX + 1, len(reporters), dtype=np.int8)
+            capability_targets = rng.integers(1, CAP_MAX + 1, len(reporters), dtype=np.int8)
+            ReportFile.write_reports(filename, {
+                "epoch": epoch,
+                "reporter": reporters,
+                "target": targets,
+                "service": service_targets,
+                "capability": capability_targets,
+                "note": take_notes(node_arrays, reporters, targets, service_targets, capability_targets)
+            })
+            no_of_reports += len(reporters)
+    return no_of_reports
+
+
+def read_data(filename, delimiter=",", dict_mode=True, window=None, decay=None, reporter_ids=None):
+    '''
+    Read data from a file of reports, either in the binary report format or a csv.
+    The inputs are typed arrays of reporter id, target id, service and capability,
+    in dict mode they are grouped by reporter id and the reporter column is dropped.
+    If window is given only the reports from the latest window epochs are read. The
+    inputs and notes are returned with sample weights, which are decay to the power of
+    each report's age in epochs grouped the same as the notes, or None if there is no
+    decay. If reporter_ids is given only the reports of those reporters are read,
+    through the file's index.
+    '''
+    if reporter_ids is None:
+        reports, latest_epoch = ReportFile.select_window(ReportFile.load_reports(filename, delimiter), window)
+    else:
+        reports, latest_epoch = ReportFile.select_reporters(filename, reporter_ids, window, delimiter)
+    notes = np.asarray(reports["note"])
+    weights = None if decay is None else ReportFile.decay_weights(reports["epoch"], decay, latest_epoch)
     if dict_mode:
-        train_data = dict()
-        notes = dict()
+        inputs = np.column_stack((reports["target"], reports["service"], reports["capability"]))
+        reporters = np.asarray(reports["reporter"])
+        order = np.argsort(reporters, kind="stable")
+        reporter_ids, starts = np.unique(reporters[order], return_index=True)
+        grouped = np.split(order, starts[1:])
+        train_data = {int(reporter_id): inputs[rows] for reporter_id, rows in zip(reporter_ids, grouped)}
+        notes = {int(reporter_id): notes[rows] for reporter_id, rows in zip(reporter_ids, grouped)}
+        if weights is not None:
+            weights = {int(reporter_id): weights[rows] for reporter_id, rows in zip(reporter_ids, grouped)}
     else:
-        train_data = []
-        notes = []
-
-    with open(filename) as report_csv:
-        csv_reader = csv.reader(report_csv, delimiter=delimiter)
-        for row in csv_reader:
-            if dict_mode:
-                reporter_id = int(row[0])
-                if train_data.get(reporter_id):
-                    train_data[reporter_id].append(row[1:-1])
-                    notes[reporter_id].append(row[-1])
-                else:
-                    train_data[reporter_id] = [row[1:-1]]
-                    notes[reporter_id] = [row[-1]]
-            else:
-                train_data.append(row[:-1])
-                notes.append(row[-1])
+        train_data = np.column_stack((reports["reporter"], reports["target"], reports["service"], reports["capability"]))
 
-    return train_data, notes
+    return train_data, notes, weights
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
+import time
+START_TIME = time.perf_counter()
+
 import os
 import sys
 import argparse
 
 import TrustManager
-import TrustManager.SVM
 
 '''
 A trust model simulation which uses machine learning techniques to find trust.
@@ -18,30 +20,63 @@ Date: 2019-03-12
 if __name__ == '__main__':
     PARSER = argparse.ArgumentParser(description="Simulate a trust model which uses either a kernel machine or neural network for trust management.")
     PARSER.add_argument("-c", "--create-data", dest="is_creating", action="store_const", const=True, default=False,
-                        help="Create data and place it in the csv file.")
+                        help="Create data and place it in the report files.")
     PARSER.add_argument("-e", "--epochs", dest="epochs", type=int, action="store", default=200,
                         help="The number of epochs to bootstrap for. [default 200]")
+    PARSER.add_argument("-n", "--nodes", dest="no_of_nodes", type=int, action="store", default=50,
+                        help="The number of nodes in the network created. [default 50]")
+    PARSER.add_argument("-k", "--partners", dest="partners", type=int, action="store", default=None,
+                        help="Have each node transact with this many partners per epoch when bootstrapping, or along a topology of this degree. [default all nodes]")
+    PARSER.add_argument("-tg", "--topology", dest="topology", action="store", default=None,
+                        choices=list(TrustManager.Topology.TOPOLOGIES),
+                        help="Bootstrap along a random regular or small world topology with a degree of --partners.")
+    PARSER.add_argument("-sh", "--shards", dest="shards", type=int, action="store", default=None,
+                        help="Bootstrap in this many shards across --workers processes, reproducibly for a --seed.")
     PARSER.add_argument("-s", "--svm", dest="use_svm", action="store_const", const=True, default=False,
                         help="Use a svm as the predictor")
     PARSER.add_argument("-a", "--ann", dest="use_ann", action="store_const", const=True, default=False,
                         help="Use an ann as the predictor [default predictor]")
+    PARSER.add_argument("-np", "--numpy-ann", dest="numpy_ann", action="store_const", const=True, default=False,
+                        help="Predict with the NumPy export of the ann, exporting it when out of date, so TensorFlow is not needed.")
     PARSER.add_argument("-t", "--train", dest="train", action="store_const", const=True, default=False,
                         help="Train the predictor on the previously generated data")
     PARSER.add_argument("-co", "--continue", dest="cont", action="store_const", const=True, default=False,
                         help="Continue training the ann.")
+    PARSER.add_argument("-w", "--workers", dest="workers", type=int, action="store", default=None,
+                        help="The number of worker processes to train the svms or bootstrap shards with. [default no. of cpus]")
+    PARSER.add_argument("--seed", dest="seed", type=int, action="store", default=None,
+                        help="Seed for the random streams used in creating the network, training the svms and in sharded bootstraps.")
+    PARSER.add_argument("-wi", "--window", dest="window", type=int, action="store", default=None,
+                        help="Train on only the reports from this many of the latest epochs.")
+    PARSER.add_argument("-dc", "--decay", dest="decay", type=float, action="store", default=None,
+                        help="Weight the reports in training by this decay to the power of their age in epochs.")
+    PARSER.add_argument("-ri", "--reporter-ids", dest="reporter_ids", type=int, nargs="+", default=None,
+                        help="Only retrain the svms of these reporters, reading only their reports.")
+    PARSER.add_argument("-im", "--in-memory", dest="in_memory", action="store_const", const=True, default=False,
+                        help="Load all of the reports into memory when training the ann, instead of streaming them.")
+    PARSER.add_argument("-cp", "--compile", dest="compile", action="store_const", const=True, default=False,
+                        help="Compile the predictions over every context into a trust tensor, for fast lookups.")
     PARSER.add_argument("-tr", "--transact", dest="transact", action="store", nargs=3, type=int,
                         metavar=("ID", "SERVICE", "CAPABILITY"),
                         help="Simulate a single transaction for node ID for SERVICE at CAPABILITY and print out the trusted list.")
+    PARSER.add_argument("-ga", "--graph-audit", dest="graph_audit", action="store", default=None,
+                        choices=list(TrustManager.Graphs.FORMATS),
+                        help="Write the recommendation graphs of every client in every context to graphs/, rendered or as DOT or JSON edge lists.")
     PARSER.add_argument("-si", "--simulate", dest="simulate", action="store_const", const=True, default=False,
                         help="Simulate EPOCH number of transactions and find the number of bad, okay, and good transactions that occured.")
     PARSER.add_argument("-tp", "--time-predict", dest="time_predict", action="store_const", const=True, default=False,
                         help="Find the average time it takes for the trust manager to make a prediction.")
+    PARSER.add_argument("-st", "--stats", dest="stats_filename", action="store", default=None,
+                        help="Append a JSON line of the trust manager's counters and timers to this file when done.")
+    PARSER.add_argument("-su", "--startup-time", dest="startup_time", action="store_const", const=True,
+                        default=False, help="Print the time taken to start up and to run.")
     ARGS = PARSER.parse_args()
+    STARTUP_TIME = time.perf_counter() - START_TIME
 
     if not os.path.exists("data"):
         os.makedirs("data")
-    TRAIN_FILENAME = "data/reports-train.csv"
-    TEST_FILENAME = "data/reports-test.csv"
+    TRAIN_FILENAME = "data/reports-train.bin"
+    TEST_FILENAME = "data/reports-test.bin"
 
     if len(sys.argv) == 1:
         PARSER.print_help()
@@ -57,34 +92,71 @@ if __name__ == '__main__':
 
         # Then create trust manager and bootstrap
         TRUST_MANAGER = TrustManager.TrustManager(
-            train_filename=TRAIN_FILENAME, test_filename=TEST_FILENAME, use_svm=ARGS.use_svm
+            no_of_nodes=ARGS.no_of_nodes, train_filename=TRAIN_FILENAME, test_filename=TEST_FILENAME,
+            use_svm=ARGS.use_svm, seed=ARGS.seed
         )
-        TRUST_MANAGER.bootstrap(ARGS.epochs)
+        TOPOLOGY = None
+        if ARGS.topology:
+            TOPOLOGY = TrustManager.Topology.TOPOLOGIES[ARGS.topology](ARGS.no_of_nodes, ARGS.partners or 10)
+        if ARGS.shards:
+            TRUST_MANAGER.bootstrap_sharded(
+                ARGS.epochs, ARGS.shards, ARGS.seed or 0, ARGS.workers,
+                partners=None if TOPOLOGY else ARGS.partners, topology=TOPOLOGY
+            )
+        elif TOPOLOGY:
+            TRUST_MANAGER.bootstrap(ARGS.epochs, topology=TOPOLOGY)
+        else:
+            TRUST_MANAGER.bootstrap(ARGS.epochs, partners=ARGS.partners)
+        # Only creating changes the saved state, the other commands read it
+        TRUST_MANAGER.save()
 
     if ARGS.train:
         print("Training...")
-        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm)
-        TRUST_MANAGER.train(ARGS.cont)
+        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm, ARGS.numpy_ann)
+        TRUST_MANAGER.train(
+            ARGS.cont, not ARGS.in_memory, ARGS.workers, ARGS.seed, ARGS.window, ARGS.decay, ARGS.reporter_ids
+        )
+
+    if ARGS.compile:
+        print("Compiling trust tensor...")
+        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm, ARGS.numpy_ann)
+        TRUST_MANAGER.compile_trust_tensor()
 
     if ARGS.transact:
-        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm)
+        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm, ARGS.numpy_ann)
         ID, SERVICE, CAP = ARGS.transact[0], ARGS.transact[1], ARGS.transact[2]
         print(f"Trusted list for node {ID} requesting service {SERVICE} at capability {CAP}")
         print()
         print(TRUST_MANAGER.find_best_servers(ID, SERVICE, CAP))
         TRUST_MANAGER.graph_recommendations(ID, SERVICE, CAP)
 
+    if ARGS.graph_audit:
+        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm, ARGS.numpy_ann)
+        QUERIES = [
+            (client_id, service, capability)
+            for service in range(TrustManager.SERVICE_MAX + 1)
+            for capability in range(TrustManager.CAP_MAX + 1)
+            for client_id in range(TRUST_MANAGER.get_no_of_nodes())
+        ]
+        FILENAMES = TRUST_MANAGER.export_graphs(QUERIES, ARGS.graph_audit, workers=ARGS.workers)
+        print(f"Wrote {len(FILENAMES)} graphs to graphs/")
+
     if ARGS.simulate:
-        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm)
+        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm, ARGS.numpy_ann)
         BAD_PER, OK_PER, GOOD_PER = TRUST_MANAGER.simulate_transactions(ARGS.epochs)
         print(f"Percentage of bad transactions: {BAD_PER}%")
         print(f"Percentage of okay transactions: {OK_PER}%")
         print(f"Percentage of good transactions: {GOOD_PER}%")
 
     if ARGS.time_predict:
-        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm)
+        TRUST_MANAGER = TrustManager.load(TRAIN_FILENAME, TEST_FILENAME, ARGS.use_svm, ARGS.numpy_ann)
         print(f"Average time to predict is {TRUST_MANAGER.time_predict()} seconds")
 
+    if TRUST_MANAGER and ARGS.stats_filename:
+        TRUST_MANAGER.get_stats().dump(ARGS.stats_filename)
+
     if TRUST_MANAGER:
-        TRUST_MANAGER.save()
         print("Done.")
+
+    if ARGS.startup_time:
+        print(f"Started up in {STARTUP_TIME:.4f} seconds, ran in {time.perf_counter() - START_TIME:.4f} seconds")